@@ -1,10 +1,12 @@
-from adafruit_pybadger import pybadger
+from hal import badger as pybadger
 
+from utils.clock import RealClock
 from utils.resource_manager import cleanup
 
 
 class AudioEngine:
-    def __init__(self):
+    def __init__(self, clock=None):
+        self.clock = clock or RealClock()
         self.notes = {
             'C4': 261.63,
             'D4': 293.66,
@@ -39,7 +41,10 @@ class AudioEngine:
         """
         frequency = self.notes.get(note)
         if frequency:
-            pybadger.play_tone(frequency, duration)
+            # Timed on the clock rather than with pybadger.play_tone, so a simulated clock doesn't wait for it
+            pybadger.start_tone(frequency)
+            self.clock.sleep(duration)
+            pybadger.stop_tone()
         else:
             raise ValueError(
                 f"Note '{note}' is not a valid note. Please use one of the following: {', '.join(self.notes.keys())}")
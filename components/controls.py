@@ -1,11 +1,15 @@
-from adafruit_pybadger import pybadger
-from time import monotonic
+from hal import badger as pybadger
 
+from utils.clock import RealClock
 from utils.resource_manager import cleanup
 
+BUTTON_ORDER = ('up', 'down', 'left', 'right', 'a', 'b', 'start', 'select')  # Bit order of button masks
+DRIVING_BUTTON_NAMES = BUTTON_ORDER[:6]  # Buttons read by the race simulation
+
 
 class Controls:
-    def __init__(self):
+    def __init__(self, clock=None):
+        self.clock = clock or RealClock()
         self.input_enabled = True
         self.default_debounce_time = 0.4
         self.debounce_times = {
@@ -35,60 +39,90 @@ class Controls:
         if button_name in self.debounce_times:
             self.debounce_times[button_name] = debounce_time
 
-    def button_pressed(self, button_name):
+    def reset_press_times(self, current_time, button_names=BUTTON_ORDER):
+        """
+        Forget the last presses of buttons, for debouncing them against another time line such as the race's
+        simulated time.
+        :param current_time: the time the buttons will be debounced against next
+        :param button_names:
+        :return:
+        """
+        for button_name in button_names:
+            self.last_press_times[button_name] = current_time - self.debounce_times[button_name]
+
+    def button_pressed(self, button_name, current_time=None):
         """
         Check if a button is pressed and has passed the debounce time.
         :param button_name:
+        :param current_time: time to debounce against, the clock's if None
         :return:
         """
-        current_time = monotonic()  # Get the current time
+        if current_time is None:
+            current_time = self.clock.monotonic()  # Get the current time
         if self.buttons[button_name]() and (current_time - self.last_press_times[button_name]) >= self.debounce_times[
             button_name] and self.input_enabled:
             self.last_press_times[button_name] = current_time  # Update the last press time for the button
             return True
         return False
 
-    def up_button(self):
+    def button_mask(self):
+        """
+        Read the state of every button at once, without debouncing.
+        :return: bit mask of the held buttons, one bit per button in BUTTON_ORDER
+        """
+        mask = 0
+        for bit, button_name in enumerate(BUTTON_ORDER):
+            if self.buttons[button_name]():
+                mask |= 1 << bit
+        return mask
+
+    def up_button(self, current_time=None):
         """
         Check if the up button is pressed and has passed the debounce time.
+        :param current_time:
         :return:
         """
-        return self.button_pressed('up')
+        return self.button_pressed('up', current_time)
 
-    def down_button(self):
+    def down_button(self, current_time=None):
         """
         Check if the down button is pressed and has passed the debounce time.
+        :param current_time:
         :return:
         """
-        return self.button_pressed('down')
+        return self.button_pressed('down', current_time)
 
-    def left_button(self):
+    def left_button(self, current_time=None):
         """
         Check if the left button is pressed and has passed the debounce time.
+        :param current_time:
         :return:
         """
-        return self.button_pressed('left')
+        return self.button_pressed('left', current_time)
 
-    def right_button(self):
+    def right_button(self, current_time=None):
         """
         Check if the right button is pressed and has passed the debounce time.
+        :param current_time:
         :return:
         """
-        return self.button_pressed('right')
+        return self.button_pressed('right', current_time)
 
-    def a_button(self):
+    def a_button(self, current_time=None):
         """
         Check if the A button is pressed and has passed the debounce time.
+        :param current_time:
         :return:
         """
-        return self.button_pressed('a')
+        return self.button_pressed('a', current_time)
 
-    def b_button(self):
+    def b_button(self, current_time=None):
         """
         Check if the B button is pressed and has passed the debounce time.
+        :param current_time:
         :return:
         """
-        return self.button_pressed('b')
+        return self.button_pressed('b', current_time)
 
     def start_button(self):
         """
@@ -1,20 +1,26 @@
+from array import array
 from math import log
-from random import random, randint, choice, uniform
-from time import monotonic
 
+from components.controls import DRIVING_BUTTON_NAMES
+from components.graphics import ObstacleTilemap, sprite_extractor
 from components.menus import BaseMenu
-from components.objects import Block, Block2, Block3, Block4, Block5, WaterSpill, Money, Person, BasicTrolley, \
+from components.obstacle_backends import PythonObstacleBackend, VectorObstacleBackend
+from components.objects import SpriteFunctions, Block, Block2, Block3, Block4, Block5, WaterSpill, Money, Person, BasicTrolley, \
     SportsTrolley, BigTrolley, SuperTrolley, CarbonFibreWheels, RacingHandle, ScanningComputer, CarbonFibreFrame, \
     NitrousOxide, BrakeUpgrade, ExhaustUpgrade, TurboUpgrade, AirFilterUpgrade, ComputerChipUpgrade, SuspensionUpgrade, \
     TrolleyMovetoWinMenuItem, TrackSelectMenuItem, TrolleyMovetoCrashMenuItem, TrolleyMovetoLoseMenuItem, \
     TrolleyMovetoDrawMenuItem, TrolleyGarageMenuItem, TrolleyShopMenuItem
-from utils.resource_manager import cleanup
+from utils.resource_manager import PHASE_RACE_FRAME, PHASE_RACE_SPAWN, cleanup, heap_telemetry, memory_policy
+from utils.rng import RandomService, build_alias_table
+
+OBSTACLE_SPAWNED = 0x01  # Obstacle flag, spawned since the last sprite sync so its sprite still has to be set up
 
 
 class AIEngine:
-    def __init__(self, track_generator, player_stats):
+    def __init__(self, track_generator, player_stats, random_stream=None):
         self.track_generator = track_generator
         self.player_stats = player_stats
+        self.random_stream = random_stream or RandomService().stream('ai')
 
         difficulty_to_trolley = {
             'easy': 'trolley_basic',
@@ -28,7 +34,7 @@ class AIEngine:
         trolley_class = self.player_stats.trolley_controller.trolleys.get(trolley_key)
         if trolley_class:
             self.ai_trolley = trolley_class(x=70, y=50, transparent_background=True, pixel_shadow=True,
-                                            color_shift=(255, 0, 0))
+                                            color_shift='ai_red')
 
         self.x_wall_buffer = 5
         self.y_wall_buffer = 25
@@ -65,17 +71,19 @@ class AIEngine:
         self.random_direction_x = 0
         self.random_direction_y = 0
 
-    def check_collision(self, sprite1, sprite2):
+    def check_collision(self, x1, y1, x2, y2):
         """
-        Check for collision between two sprites.
-        :param sprite1:
-        :param sprite2:
+        Check for collision between two 16x16 objects.
+        :param x1:
+        :param y1:
+        :param x2:
+        :param y2:
         :return:
         """
-        return (sprite1.x < sprite2.x + 16 and
-                sprite1.x + 16 > sprite2.x and
-                sprite1.y < sprite2.y + 16 and
-                sprite1.y + 16 > sprite2.y)
+        return (x1 < x2 + 16 and
+                x1 + 16 > x2 and
+                y1 < y2 + 16 and
+                y1 + 16 > y2)
 
     def determine_best_direction(self):
         """
@@ -83,23 +91,25 @@ class AIEngine:
         :return:
         """
         ai_trolley = self.ai_trolley
+        obstacle_x = self.track_generator.obstacle_x
         left_obstacles = sum(
-            1 for obstacle in self.track_generator.obstacles if obstacle.sprite.x < ai_trolley.sprite.x)
+            1 for slot in self.track_generator.obstacles if obstacle_x[slot] < ai_trolley.sprite.x)
         right_obstacles = sum(
-            1 for obstacle in self.track_generator.obstacles if obstacle.sprite.x > ai_trolley.sprite.x)
+            1 for slot in self.track_generator.obstacles if obstacle_x[slot] > ai_trolley.sprite.x)
 
         if left_obstacles < right_obstacles:
             return -ai_trolley.speed
         elif right_obstacles < left_obstacles:
             return ai_trolley.speed
         else:
-            return choice([-ai_trolley.speed, ai_trolley.speed])
+            return self.random_stream.choice((-ai_trolley.speed, ai_trolley.speed))
 
-    def update_ai_movement(self, current_time, player_trolley):
+    def update_ai_movement(self, current_time, player_x, player_y):
         """
         Update the AI trolley's movement based on the player's trolley position and obstacles.
         :param current_time:
-        :param player_trolley:
+        :param player_x: the player's simulated position, not where its sprite was last drawn
+        :param player_y:
         :return:
         """
         if current_time - self.ai_last_move_time > self.move_interval:
@@ -109,31 +119,40 @@ class AIEngine:
 
                 if current_time - self.random_move_start_time >= self.random_move_duration:
                     self.reset_random_movement()
-            elif random() < self.random_movement_chance:
-                self.random_direction_x = choice([-1, 1])
-                self.random_direction_y = choice([-1, 1])
-                self.random_move_duration = uniform(1, 5)
+            elif self.random_stream.random() < self.random_movement_chance:
+                self.random_direction_x = self.random_stream.choice((-1, 1))
+                self.random_direction_y = self.random_stream.choice((-1, 1))
+                self.random_move_duration = self.random_stream.uniform(1, 5)
                 self.random_move_start_time = current_time
 
-            distance_ahead_y = self.ai_trolley.sprite.y - player_trolley.sprite.y
+            distance_ahead_y = self.ai_trolley.sprite.y - player_y
 
             if distance_ahead_y < self.min_distance_ahead:
                 self.velocity_y = -self.ai_trolley.speed
 
             ai_trolley = self.ai_trolley
+            track_generator = self.track_generator
+
+            # Only obstacles within the detection range can be reacted to, the player is checked last
+            sides = self.detection_range['sides']
+            reach = max(self.detection_range['up'], self.detection_range['down'])
+            nearby = [(track_generator.obstacle_x[slot], track_generator.screen_y(slot)) for slot in
+                      track_generator.query(ai_trolley.sprite.x - sides, ai_trolley.sprite.y - reach,
+                                            16 + 2 * sides, 16 + 2 * reach)]
+            nearby.append((player_x, player_y))
 
-            for obstacle in self.track_generator.obstacles + [player_trolley]:
-                distance_x, distance_y = self.get_distance(ai_trolley, obstacle)
+            for obstacle_x, obstacle_y in nearby:
+                distance_x, distance_y = self.get_distance(ai_trolley, obstacle_x, obstacle_y)
 
                 if abs(distance_x) < self.detection_range['sides']:
                     if self.detection_range['down'] > distance_y > -self.detection_range['up']:
-                        self.set_avoidance_velocity(distance_x, distance_y, ai_trolley, obstacle)
-                        if self.check_collision(ai_trolley.sprite, obstacle.sprite):
-                            if self.ai_trolley.sprite.y < obstacle.sprite.y + 16:
+                        self.set_avoidance_velocity(distance_x, distance_y, ai_trolley, obstacle_x, obstacle_y)
+                        if self.check_collision(ai_trolley.sprite.x, ai_trolley.sprite.y, obstacle_x, obstacle_y):
+                            if self.ai_trolley.sprite.y < obstacle_y + 16:
                                 # Move backwards
                                 self.velocity_y += self.ai_trolley_obstacle_drag_speed_y
                                 # Check if the obstacle is to the left of the AI trolley
-                                if obstacle.sprite.x + 16 > self.ai_trolley.sprite.x > obstacle.sprite.x:
+                                if obstacle_x + 16 > self.ai_trolley.sprite.x > obstacle_x:
                                     if self.ai_trolley.sprite.x + 16 < 160 - (self.x_wall_buffer + 16):
                                         # Move right
                                         self.velocity_x += self.ai_trolley_obstacle_drag_speed_x
@@ -141,8 +160,8 @@ class AIEngine:
                                         # Move left
                                         self.velocity_x = -self.ai_trolley_obstacle_drag_speed_x
                                 # Check if the obstacle is to the right of the AI trolley
-                                elif (self.ai_trolley.sprite.x + 16 > obstacle.sprite.x and self.ai_trolley.sprite.x
-                                      < obstacle.sprite.x + 16):
+                                elif (self.ai_trolley.sprite.x + 16 > obstacle_x and self.ai_trolley.sprite.x
+                                      < obstacle_x + 16):
                                     if self.ai_trolley.sprite.x > (self.x_wall_buffer + 16):
                                         # Move left
                                         self.velocity_x -= self.ai_trolley_obstacle_drag_speed_x
@@ -185,11 +204,12 @@ class AIEngine:
         ai_trolley.sprite.y = int(max(self.y_wall_buffer, min(128 - self.y_wall_buffer - 16,
                                                               ai_trolley.sprite.y + self.velocity_y)))
 
-    def get_distance(self, ai_trolley, obstacle):
+    def get_distance(self, ai_trolley, obstacle_x, obstacle_y):
         """
         Calculate the horizontal and vertical distances between the AI trolley and an obstacle.
         :param ai_trolley:
-        :param obstacle:
+        :param obstacle_x:
+        :param obstacle_y:
         :return:
         """
         ai_trolley_left = ai_trolley.sprite.x
@@ -197,10 +217,10 @@ class AIEngine:
         ai_trolley_top = ai_trolley.sprite.y
         ai_trolley_bottom = ai_trolley.sprite.y + 16
 
-        obstacle_left = obstacle.sprite.x
-        obstacle_right = obstacle.sprite.x + 16
-        obstacle_top = obstacle.sprite.y
-        obstacle_bottom = obstacle.sprite.y + 16
+        obstacle_left = obstacle_x
+        obstacle_right = obstacle_x + 16
+        obstacle_top = obstacle_y
+        obstacle_bottom = obstacle_y + 16
 
         # Calculate horizontal and vertical distances
         if ai_trolley_right < obstacle_left:  # AI trolley is to the left of the obstacle
@@ -219,29 +239,104 @@ class AIEngine:
 
         return distance_x, distance_y
 
-    def set_avoidance_velocity(self, distance_x, distance_y, ai_trolley, obstacle):
+    def set_avoidance_velocity(self, distance_x, distance_y, ai_trolley, obstacle_x, obstacle_y):
         """
         Set the avoidance velocity based on the distance between the AI trolley and an obstacle.
         :param distance_x:
         :param distance_y:
         :param ai_trolley:
-        :param obstacle:
+        :param obstacle_x:
+        :param obstacle_y:
         :return:
         """
-        if ai_trolley.sprite.x < obstacle.sprite.x:
+        if ai_trolley.sprite.x < obstacle_x:
             self.velocity_x = -ai_trolley.speed
         else:
             self.velocity_x = ai_trolley.speed
 
-        if ai_trolley.sprite.y < obstacle.sprite.y:
+        if ai_trolley.sprite.y < obstacle_y:
             self.velocity_y = -ai_trolley.speed
         else:
             self.velocity_y = ai_trolley.speed
 
 
+class ObstaclePool:
+    """
+    Preallocated obstacle sprites for a race, one per slot of the track's obstacle columns. Sprites are recycled by
+    swapping their tile and position instead of building a new sprite for every spawn, which keeps the heap from
+    fragmenting as the track generates obstacles. When a tilemap draws the obstacles the pool only hands out slots,
+    and no sprites are built.
+    """
+
+    def __init__(self, size, template_id='block_1', sprites=True):
+        self.size = size
+        self.sprites = None
+        if sprites:
+            self.sprites = [SpriteFunctions(template_id, x=0, y=-64, transparent_background=True, pixel_shadow=True)
+                            for _ in range(size)]
+        self.free = list(range(size - 1, -1, -1))
+        self.used = bytearray(size)  # Slots that have held an obstacle before
+        self.in_use = 0
+        self.recycled = 0
+
+        cleanup()
+
+    def acquire(self):
+        """
+        Take a free slot from the pool.
+        :return: the slot, or None if every slot in the pool is in use
+        """
+        if not self.free:
+            return None
+        slot = self.free.pop()
+        if self.used[slot]:
+            self.recycled += 1
+        self.used[slot] = 1
+        self.in_use += 1
+        return slot
+
+    def release(self, slot):
+        """
+        Return a slot to the pool.
+        :param slot:
+        :return:
+        """
+        self.free.append(slot)
+        self.in_use -= 1
+
+    def stats(self):
+        """
+        Get the pool counters.
+        :return:
+        """
+        return {
+            'size': self.size,
+            'in_use': self.in_use,
+            'free': len(self.free),
+            'recycled': self.recycled,
+        }
+
+
 class TrackGenerator:
-    def __init__(self, difficulty='easy'):
-        self.obstacles = []
+    """
+    Generates the obstacles of a race and scrolls them down the track. Obstacle state is kept in columns indexed by
+    pool slot, x, track position, type and flags, and the gameplay logic only ever reads those, the sprites are
+    written once per rendered frame by sync_sprites. Spawning and culling both happen in step, so the obstacles only
+    depend on the number of steps simulated, never on how many frames they were drawn in.
+
+    Every obstacle scrolls by the same amount, so their order never changes: the active slots are kept sorted by track
+    position (screen y minus the scroll offset when they were spawned), the lowest one on screen last. Obstacles
+    leaving the screen are popped off the end. Area queries and culling are done by an obstacle backend, either plain
+    Python binary searching the band of rows an area covers, or vectorised tests of every slot at once.
+    """
+
+    def __init__(self, difficulty='easy', tilemap=None, vectorised=False, random_stream=None):
+        self.random_stream = random_stream or RandomService().stream('track')
+        self.obstacles = []  # Active slots, sorted by track_y, so by screen y as well
+        self.culled = []  # Sprites of removed obstacles still on the display, for the next render to remove
+        self.scroll = 0  # Pixels the track has scrolled, an obstacle's screen y is its track_y plus the scroll
+        self.obstacle_size = 16  # Width and height of every obstacle
+        self.tilemap = tilemap  # Optional ObstacleTilemap drawing every obstacle, instead of a sprite each
         self.max_obstacles = 15
         self.update_counter = 0
         self.update_interval = 1  # Update every frame
@@ -249,9 +344,7 @@ class TrackGenerator:
         self.difficulty = difficulty
         self.winning_money = 500
 
-        self.start_time = None  # Track the start time of the race
-        self.elapsed_time = 0  # Track the elapsed time
-        self.last_cleanup_time = monotonic()  # Initialize last cleanup time
+        self.elapsed_time = 0  # Simulated seconds the track has been moving for
 
         self.obstacle_classes = {
             'Block': (Block, 0.20),
@@ -263,6 +356,8 @@ class TrackGenerator:
             'Money': (Money, 0.05),
             'Person': (Person, 0.07),
         }
+        # Obstacle type ids are indexes into this list
+        self.obstacle_types = [obstacle_class for obstacle_class, _ in self.obstacle_classes.values()]
 
         """Set parameters based on the selected difficulty level."""
         if self.difficulty == 'easy':
@@ -291,99 +386,224 @@ class TrackGenerator:
         self.obstacles = []
         self.update_counter = 0
 
+        # Obstacles are recycled through a pool sized to the most obstacles the difficulty can have on the track, with
+        # a sprite per slot unless the tilemap draws them
+        self.obstacle_pool = ObstaclePool(self.max_obstacles, sprites=tilemap is None)
+
+        # Obstacle state, one entry per pool slot. Track positions keep growing more negative as the race goes on,
+        # past what an 'h' column holds in a long race, so they are 32 bit.
+        self.obstacle_x = array('h', [0] * self.max_obstacles)
+        self.obstacle_track_y = array('l', [0] * self.max_obstacles)
+        self.obstacle_type = bytearray(self.max_obstacles)
+        self.obstacle_flags = bytearray(self.max_obstacles)
+
+        self.backend = VectorObstacleBackend(self) if vectorised else PythonObstacleBackend(self)
+
+        # Spawn selection, an alias table over the obstacle weights picks a type with two draws from the stream
+        self.spawn_table = build_alias_table([weight for _, weight in self.obstacle_classes.values()])
+
+        # Obstacles spawn in lanes across the track, the tilemap's columns when it draws them
+        self.lane_width = tilemap.cell_width if tilemap else self.obstacle_size
+        self.lane_count = tilemap.columns if tilemap else 160 // self.obstacle_size
+
         cleanup()
 
-    def check_overlap(self, new_obstacle):
+    def position(self, track_y):
         """
-        Checks whether the new obstacle overlaps with any existing obstacles.
-        :param new_obstacle:
-        :return:
+        Binary search for where an obstacle at the given track position goes in the sorted obstacles.
+        :param track_y:
+        :return: index of the first obstacle at or below the track position
         """
-        for existing_obstacle in self.obstacles:
-            # Calculate the ending coordinates for comparison without a large buffer.
-            existing_right = existing_obstacle.sprite.x + existing_obstacle.width
-            existing_bottom = existing_obstacle.sprite.y + existing_obstacle.height
-            new_right = new_obstacle.sprite.x + new_obstacle.width
-            new_bottom = new_obstacle.sprite.y + new_obstacle.height
-
-            # Check for overlap
-            if (new_obstacle.sprite.x < existing_right and
-                    new_right > existing_obstacle.sprite.x and
-                    new_obstacle.sprite.y < existing_bottom and
-                    new_bottom > existing_obstacle.sprite.y):
-                return True
-        return False
+        obstacles = self.obstacles
+        obstacle_track_y = self.obstacle_track_y
+        low = 0
+        high = len(obstacles)
+        while low < high:
+            middle = (low + high) // 2
+            if obstacle_track_y[obstacles[middle]] < track_y:
+                low = middle + 1
+            else:
+                high = middle
+        return low
 
-    def cleanup_obstacles(self):
+    def pick_lane(self, y):
+        """
+        Pick a random free lane for an obstacle spawning at the given screen y, from a bitmask of the lanes blocked by
+        the obstacles already in that band.
+        :param y:
+        :return: the lane, or None if every lane is blocked
+        """
+        lane_width = self.lane_width
+        blocked = 0
+        for slot in self.query(0, y, 160, self.obstacle_size):
+            first = self.obstacle_x[slot] // lane_width
+            last = (self.obstacle_x[slot] + self.obstacle_size - 1) // lane_width
+            blocked |= ((1 << (last - first + 1)) - 1) << first
+
+        free = 0
+        for lane in range(self.lane_count):
+            if not blocked & (1 << lane):
+                free += 1
+        if not free:
+            return None
+
+        pick = self.random_stream.below(free)
+        for lane in range(self.lane_count):
+            if not blocked & (1 << lane):
+                if not pick:
+                    return lane
+                pick -= 1
+
+    def obstacle_id(self, slot):
         """
-        Remove obstacles that have moved past the bottom of the screen.
+        Get the object id of the obstacle in a slot.
+        :param slot:
         :return:
         """
-        # Iterate in reverse to avoid skipping elements after removal
-        for i in range(len(self.obstacles) - 1, -1, -1):
-            obstacle = self.obstacles[i]
-            # Check if the obstacle should be removed (e.g., moved past bottom of screen)
-            if obstacle.sprite.y > 128 + 16:  # Adjust condition as necessary
-                # Remove from obstacles list
-                del self.obstacles[i]
-                # Signal that obstacle should be removed from display group as well
-                yield obstacle
-        cleanup()
+        return self.obstacle_types[self.obstacle_type[slot]].object_id
 
-    def update(self, total_pause_duration=0):
+    def screen_y(self, slot):
         """
-        Update the track and obstacles.
-        :param total_pause_duration:
+        Get the screen y of the obstacle in a slot.
+        :param slot:
         :return:
         """
-        if self.track_moving:
-            if self.start_time is None:
-                self.start_time = monotonic()  # Start the timer
+        return self.obstacle_track_y[slot] + self.scroll
 
-            current_time = monotonic() - total_pause_duration
+    def query(self, x, y, width=16, height=16):
+        """
+        Get the slots of the obstacles overlapping an area of the track.
+        :param x:
+        :param y:
+        :param width:
+        :param height:
+        :return: the slots, in ascending order
+        """
+        return self.backend.query(x, y, width, height)
 
-            self.elapsed_time += current_time - self.start_time
-            self.start_time = current_time  # Reset start time for continuous tracking
+    def check_overlap(self, x, y, width=16, height=16):
+        """
+        Checks whether an obstacle placed at the given position would overlap with any existing obstacles.
+        :param x:
+        :param y:
+        :param width:
+        :param height:
+        :return:
+        """
+        return bool(self.query(x, y, width, height))
 
-            self.update_counter += 1
+    def release_slot(self, slot):
+        """
+        Return the slot of an obstacle already taken off the obstacles list to the obstacle pool. A sprite that has
+        been added to the display is kept in culled until the next render removes it, one that never was is not.
+        :param slot:
+        :return:
+        """
+        self.backend.remove(slot)
+        if self.tilemap:
+            self.tilemap.clear(self.obstacle_x[slot], self.screen_y(slot))
+        elif not self.obstacle_flags[slot] & OBSTACLE_SPAWNED:
+            self.culled.append(self.obstacle_pool.sprites[slot])
+        self.obstacle_pool.release(slot)
+
+    def remove_obstacle(self, slot):
+        """
+        Remove an obstacle from the track and return its slot to the obstacle pool.
+        :param slot:
+        :return:
+        """
+        i = self.position(self.obstacle_track_y[slot])
+        while self.obstacles[i] != slot:
+            i += 1
+        del self.obstacles[i]
+        self.release_slot(slot)
 
-            if len(self.obstacles) < self.max_obstacles and self.update_counter % self.update_interval == 0:
-                for _ in range(10):  # Try multiple times to place a new obstacle
-                    new_x = randint(0, 160 - 16)
-                    new_y = randint(-256, 0)
-
-                    options = list(self.obstacle_classes.items())
-
-                    # Sum the weights to get the total weight.
-                    total = sum(weight for _, (_, weight) in options)
-
-                    # Generate a random number between 0 and the total weight.
-                    r = uniform(0, total)
-                    # Initialize the cumulative weight.
-                    upto = 0
-                    # Iterate over the options.
-                    for item, (cls, weight) in options:
-                        upto += weight
-                        # Check if the random number is less than the current cumulative weight.
-                        if upto >= r:
-                            # If it is, return the class associated with the current item.
-                            obstacle_class = cls
-                            break
+    def cleanup_obstacles(self):
+        """
+        Remove obstacles that have moved past the bottom of the screen, every simulation step. The lowest obstacles
+        are always last, so they are popped off the end until one is still on screen.
+        :return: the number of obstacles removed
+        """
+        offscreen = self.backend.count_offscreen(128 + 16 - self.scroll)
+        for _ in range(offscreen):
+            self.release_slot(self.obstacles.pop())
+        if offscreen:
+            cleanup()
+        return offscreen
 
-                    temp_obstacle = obstacle_class(x=new_x, y=new_y, transparent_background=True,
-                                                   pixel_shadow=True)
+    def sync_sprites(self):
+        """
+        Write the obstacle positions to their sprites, once per rendered frame. Sprites of newly spawned obstacles get
+        their tile swapped first. Only used without a tilemap, the pool has no sprites with one.
+        :return: sprites of the obstacles spawned since the last sync, to be added to the display
+        """
+        spawned = []
+        sprites = self.obstacle_pool.sprites
+        obstacle_x = self.obstacle_x
+        obstacle_track_y = self.obstacle_track_y
+        obstacle_flags = self.obstacle_flags
+        scroll = self.scroll
+        for slot in self.obstacles:
+            obstacle = sprites[slot]
+            if obstacle_flags[slot] & OBSTACLE_SPAWNED:
+                obstacle_flags[slot] &= ~OBSTACLE_SPAWNED
+                obstacle.set_object(self.obstacle_id(slot), obstacle_x[slot], obstacle_track_y[slot] + scroll)
+                spawned.append(obstacle)
+            else:
+                obstacle.sprite.y = obstacle_track_y[slot] + scroll
+        return spawned
 
-                    if temp_obstacle and not self.check_overlap(temp_obstacle):
-                        self.obstacles.append(temp_obstacle)
-                        break
+    def place_tilemap_row(self):
+        """
+        Draw the obstacles that have just scrolled into the top row of the tilemap.
+        :return:
+        """
+        track_y = self.tilemap.grid.y - self.scroll
+        for i in range(self.position(track_y), len(self.obstacles)):
+            slot = self.obstacles[i]
+            if self.obstacle_track_y[slot] != track_y:
+                break
+            self.tilemap.place(self.obstacle_x[slot], self.tilemap.grid.y, self.obstacle_id(slot))
 
-            # Move existing obstacles down the screen, regardless of new additions
+    def step(self, dt):
+        """
+        Advance the track and obstacles by one fixed simulation step, obstacles move 1px per step.
+        :param dt: length of the step in seconds
+        :return:
+        """
+        if self.track_moving:
+            self.elapsed_time += dt
+            self.update_counter += 1
+
+            if len(self.obstacles) < self.max_obstacles and self.update_counter % self.update_interval == 0:
+                new_y = self.random_stream.randint(-256, 0)
+                if self.tilemap:
+                    # Obstacles drawn by the tilemap have to line up with its cells
+                    _, new_y = self.tilemap.snap(0, new_y)
+                lane = self.pick_lane(new_y)
+
+                # Only take a slot from the pool once a free lane has been found
+                if lane is not None:
+                    slot = self.obstacle_pool.acquire()
+                    if slot is not None:
+                        new_x = lane * self.lane_width
+                        self.obstacle_x[slot] = new_x
+                        self.obstacle_track_y[slot] = new_y - self.scroll
+                        self.obstacle_type[slot] = self.random_stream.weighted(self.spawn_table)
+                        self.obstacle_flags[slot] = OBSTACLE_SPAWNED
+                        self.obstacles.insert(self.position(self.obstacle_track_y[slot]), slot)
+                        self.backend.place(slot)
+                        if self.tilemap:
+                            self.tilemap.place(new_x, new_y, self.obstacle_id(slot))
+
+            # Scroll the track, regardless of new additions, the obstacles follow through the scroll offset
             if self.update_counter % self.update_interval == 0:
-                for obstacle in self.obstacles:
-                    obstacle.move(0, 1)
+                self.scroll += 1
+                if self.tilemap and self.tilemap.scroll(1):
+                    self.place_tilemap_row()
 
-        else:
-            self.start_time = None  # Pause the timer
+            # Cull in the step as well as spawn, a slot freed here can be spawned into by the next step
+            self.cleanup_obstacles()
 
 
 class TrolleyController:
@@ -559,7 +779,21 @@ class RaceEngine(BaseMenu):
 
     grip_factor = 1.0  # Reset grip factor to default
 
-    move_interval = 0.05  # Time between movement updates in seconds
+    move_interval = 0.05  # Simulated time between player movement updates in seconds
+
+    # The race is simulated in fixed steps, as many as the time since the last frame covers, then drawn once
+    simulation_step = 1 / 60  # Seconds per simulation step, the track moves 1px per step
+    max_steps_per_frame = 6  # Steps run before a frame at most, the rest is dropped so a slow frame can't snowball
+    interpolate = False  # Draw the player part of the way to its next position, between movement updates
+
+    tilemap_rendering = False  # Draw every obstacle with one tilemap instead of a sprite per obstacle
+    vectorised_obstacles = False  # Query and cull obstacles with ulab.numpy instead of Python loops
+
+    race_seed = None  # Seed of the race's random streams, None for a new one every race
+    input_recorder = None  # InputRecorder capturing the buttons of every simulation step, see utils/replay.py
+    input_player = None  # InputPlayer feeding recorded buttons back in on the host backend
+    performance_test_seed = 1  # performance_test races always use this seed, so they repeat exactly between builds
+    heap_sample_interval = 30  # Frames between heap telemetry records of the race frame
 
     def __init__(self, app):
         super().__init__(app, background_image='images/floor.bmp')
@@ -570,41 +804,48 @@ class RaceEngine(BaseMenu):
             # Additional obstacle types and their handlers can be added here
         }
 
-    def handle_money_obstacle(self, obstacle):
+    def handle_money_obstacle(self, obstacle_x, obstacle_y, slot):
         """
         Handle the money obstacle.
-        :param obstacle:
+        :param obstacle_x:
+        :param obstacle_y:
+        :param slot:
         :return:
         """
-        obstacle.remove(self.track_generator.obstacles)
-        self.app.root_display.main_display_group.remove(obstacle.sprite)
-        self.app.player_stats.money_update(randint(10, 1000), add=True)
+        self.track_generator.remove_obstacle(slot)
+        self.app.player_stats.money_update(self.random_service.stream('pickups').randint(10, 1000), add=True)
 
-    def handle_water_spill(self, obstacle):
+    def handle_water_spill(self, obstacle_x, obstacle_y, slot):
         """
         Handle the water spill obstacle.
-        :param obstacle:
+        :param obstacle_x:
+        :param obstacle_y:
+        :param slot:
         :return:
         """
         self.grip_affected = True
         self.water_grip_timer = self.current_time  # Reset timer every time we hit a new water spill
 
-    def handle_default_obstacle(self, obstacle):
+    def handle_default_obstacle(self, obstacle_x, obstacle_y, slot):
         """
         Handle the default obstacle.
-        :param obstacle:
+        :param obstacle_x:
+        :param obstacle_y:
+        :param slot: the obstacle's slot on the track, None for the AI trolley
         :return:
         """
-        if obstacle.sprite.y > self.player_trolley.sprite.y:
+        player_x = int(self.trolley_x)
+        player_y = int(self.trolley_y)
+        if obstacle_y > player_y:
             self.player_dy = -self.bounce_factor * abs(self.player_dy)
             self.block_below = True
-        if obstacle.sprite.y < self.player_trolley.sprite.y:
+        if obstacle_y < player_y:
             self.player_dy = self.bounce_factor * abs(self.player_dy)
             self.block_above = True
-        if obstacle.sprite.x > self.player_trolley.sprite.x:
+        if obstacle_x > player_x:
             self.player_dx = -self.bounce_factor * abs(self.player_dx)
             self.block_right = True
-        if obstacle.sprite.x < self.player_trolley.sprite.x:
+        if obstacle_x < player_x:
             self.player_dx = self.bounce_factor * abs(self.player_dx)
             self.block_left = True
 
@@ -615,16 +856,16 @@ class RaceEngine(BaseMenu):
             # Push the trolley backwards and also to the left or right
             self.player_dy += self.trolley_drag_speed_y  # Move backwards
             # Check if the obstacle is to the right of the player trolley
-            if self.player_trolley.sprite.x > obstacle.sprite.x:
-                if self.player_trolley.sprite.x + 16 < 160 - 16 or self.player_trolley.sprite.y + 16 == 0:
+            if player_x > obstacle_x:
+                if player_x + 16 < 160 - 16 or player_y + 16 == 0:
                     # Move right
                     self.player_dx += self.trolley_drag_speed_x
                 else:
                     # Move left
                     self.player_dx = -self.trolley_drag_speed_x
             # Check if the obstacle is to the left of the player trolley
-            elif self.player_trolley.sprite.x < obstacle.sprite.x + 16 or self.player_trolley.sprite.y + 16 == 0:
-                if self.player_trolley.sprite.x > 16:
+            elif player_x < obstacle_x + 16 or player_y + 16 == 0:
+                if player_x > 16:
                     # Move left
                     self.player_dx -= self.trolley_drag_speed_x
                 else:
@@ -645,24 +886,203 @@ class RaceEngine(BaseMenu):
         :param menu:
         :return:
         """
-        self.app.root_display.fade_screen('out')
+        # The LEDs go off once the screen has faded out, the display is cleared by the menu controller
+        if self.input_recorder:
+            self.input_recorder.close()
+        self.app.root_display.start_fade('out', on_complete=self.app.led_controller.clear_leds)
         self.app.controls.set_debounce_time('up', self.app.controls.default_debounce_time)
         self.app.controls.set_debounce_time('down', self.app.controls.default_debounce_time)
         self.app.controls.set_debounce_time('left', self.app.controls.default_debounce_time)
         self.app.controls.set_debounce_time('right', self.app.controls.default_debounce_time)
-        self.app.root_display.clear_main_display_group()
-        self.app.led_controller.clear_leds()
+        self.app.controls.reset_press_times(self.app.clock.monotonic(), DRIVING_BUTTON_NAMES)
         self.app.root_display.display.auto_refresh = True
         self.switch_menu(menu, fade=False)
         cleanup()
 
+    def step_simulation(self, dt):
+        """
+        Advance the race by one fixed simulation step: the track, the AI, collisions and, every move_interval, the
+        player.
+        :param dt: length of the step in seconds
+        :return:
+        """
+        self.simulation_time += dt
+        self.current_time = self.simulation_time
+
+        # Replays set the buttons of every step, recordings capture them
+        if self.input_player:
+            self.input_player.next_step()
+        if self.input_recorder:
+            self.input_recorder.record(self.app.controls.button_mask())
+
+        self.block_above = self.block_below = self.block_left = self.block_right = False
+
+        # 1. Update track, obstacles and AI movement
+        self.track_generator.step(dt)
+        self.ai_engine.update_ai_movement(self.current_time, int(self.trolley_x), int(self.trolley_y))
+
+        # 2. Detect and handle collisions, with the obstacles around the player and the AI trolley. The query only
+        # returns obstacles within the buffer around the player, so only the AI trolley still needs checking. The
+        # player's sprite is only drawn from the simulated position, so it is never read here.
+        if self.track_generator.difficulty != 'performance_test':
+            track_generator = self.track_generator
+            buffer = self.collision_buffer
+            player_x = int(self.trolley_x)
+            player_y = int(self.trolley_y)
+            for slot in track_generator.query(player_x - buffer, player_y - buffer, 16 + 2 * buffer, 16 + 2 * buffer):
+                # Call the appropriate handler based on the obstacle type
+                handler = self.obstacle_type_handlers.get(track_generator.obstacle_id(slot),
+                                                          self.handle_default_obstacle)
+                handler(track_generator.obstacle_x[slot], track_generator.screen_y(slot), slot)
+            ai_sprite = self.ai_engine.ai_trolley.sprite
+            if (ai_sprite.x < player_x + 16 + buffer and ai_sprite.x + 16 + buffer > player_x and
+                    ai_sprite.y < player_y + 16 + buffer and ai_sprite.y + 16 + buffer > player_y):
+                self.handle_default_obstacle(ai_sprite.x, ai_sprite.y, None)
+
+        # 3. Update trolley position based on control input and grip, every move_interval of simulated time
+        self.move_accumulator += dt
+        if self.move_accumulator >= self.move_interval:
+            self.move_accumulator -= self.move_interval
+            self.move_player()
+
+        # 4. Update game state variables if necessary (e.g., reset blocks, handle grip factor updates)
+        # Check if the grip has been affected by a recent water spill
+        if self.grip_affected:
+            self.grip_factor = 0.2  # Reduce grip due to water
+        if self.grip_affected and self.current_time - self.water_grip_timer > 3.0:
+            self.grip_factor = 1.0
+            self.grip_affected = False  # Reset flag after grip change applied
+
+        self.block_above = self.block_below = self.block_left = self.block_right = False
+
+    def move_player(self):
+        """
+        Update the player trolley's velocity from the controls and grip, and move it.
+        :return:
+        """
+        # Calculate the grip increase based on weight using log
+        grip_increase = self.player_trolley.grip * log(1 + self.player_trolley.weight)
+
+        # Cap the grip increase to ensure it doesn't exceed the maximum allowed grip
+        max_grip_increase = self.player_trolley.grip * (self.max_grip_multiplier - 1)
+        limited_grip_increase = min(grip_increase, max_grip_increase)
+
+        # Calculate the final grip
+        current_grip = (self.player_trolley.grip + limited_grip_increase) * self.grip_factor
+
+        # Adjust boost and brake factors incrementally for smooth changes
+        if self.app.controls.a_button(self.current_time):
+            self.acceleration_factor += (self.player_trolley.boost_strength * self.boost_multiplier
+                                         - self.acceleration_factor) * 0.1
+        else:
+            self.acceleration_factor += (1 - self.acceleration_factor) * 0.1
+
+        if self.app.controls.b_button(self.current_time):
+            self.deceleration_factor += (self.player_trolley.brake_strength * self.brake_multiplier
+                                         - self.deceleration_factor) * 0.1
+        else:
+            self.deceleration_factor += (1 - self.deceleration_factor) * 0.1
+
+        # Update speed limits based on boost
+        max_speed = self.player_trolley.speed * self.acceleration_factor
+
+        # Calculate adjusted acceleration
+        acceleration = self.player_trolley.acceleration * self.acceleration_factor / (
+                1 + self.player_trolley.weight * self.acceleration_weight_factor)
+
+        # Calculate adjusted deceleration
+        deceleration = self.player_trolley.deceleration * self.deceleration_factor / (
+                1 + max(self.min_deceleration_denominator,
+                        self.player_trolley.weight * self.deceleration_weight_factor))
+
+        # Horizontal movement
+        if self.app.controls.left_button(self.current_time) and not self.block_left:
+            self.player_dx = max(-max_speed, self.player_dx - (acceleration * current_grip))
+        elif self.app.controls.right_button(self.current_time) and not self.block_right:
+            self.player_dx = min(max_speed, self.player_dx + (acceleration * current_grip))
+        else:
+            # Apply natural deceleration
+            if self.player_dx > 0:
+                self.player_dx = max(0, self.player_dx - (deceleration * current_grip))
+            elif self.player_dx < 0:
+                self.player_dx = min(0, self.player_dx + (deceleration * current_grip))
+
+        # Vertical movement
+        if self.app.controls.up_button(self.current_time) and not self.block_above:
+            self.player_dy = max(-max_speed, self.player_dy - (acceleration * current_grip))
+        elif self.app.controls.down_button(self.current_time) and not self.block_below:
+            self.player_dy = min(max_speed, self.player_dy + (acceleration * current_grip))
+        else:
+            # Apply natural deceleration
+            if self.player_dy > 0:
+                self.player_dy = max(0, self.player_dy - (deceleration * current_grip))
+            elif self.player_dy < 0:
+                self.player_dy = min(0, self.player_dy + (deceleration * current_grip))
+
+        # Update logical position
+        self.previous_trolley_x = self.trolley_x
+        self.previous_trolley_y = self.trolley_y
+        self.trolley_x += self.player_dx
+        self.trolley_y += self.player_dy
+
+        # Ensure trolley stays within bounds
+        self.trolley_x = max(0, min(self.app.root_display.display.width - 16, self.trolley_x))
+        self.trolley_y = max(0, min(self.app.root_display.display.height - 16, self.trolley_y))
+
+    def render(self):
+        """
+        Draw a frame of the race from the current simulation state, once per loop however many steps were run.
+        :return:
+        """
+        # Update LED progress based on elapsed time
+        self.app.led_controller.update_progress(self.track_generator.elapsed_time,
+                                                self.track_generator.race_duration)
+
+        # Remove the sprites of the obstacles the simulation steps culled or picked up, before any slot reused since
+        # is added again
+        culled = self.track_generator.culled
+        while culled:
+            self.app.root_display.remove(culled.pop().sprite)
+
+        # Write the simulated obstacle positions to their sprites, in a single pass for the frame
+        if self.obstacle_tilemap is None:
+            spawned = self.track_generator.sync_sprites()
+            for obstacle in spawned:
+                self.app.root_display.add(obstacle.sprite, 'obstacles')
+            if spawned:
+                heap_telemetry.record_ids(PHASE_RACE_SPAWN, self.heap_tag)
+
+        # Only the render writes the player's sprite, the simulation keeps its position in trolley_x and trolley_y
+        if self.interpolate:
+            # Blend between the last two player positions by how far the next movement update is
+            alpha = self.move_accumulator / self.move_interval
+            self.player_trolley.sprite.x = int(self.previous_trolley_x +
+                                               (self.trolley_x - self.previous_trolley_x) * alpha)
+            self.player_trolley.sprite.y = int(self.previous_trolley_y +
+                                               (self.trolley_y - self.previous_trolley_y) * alpha)
+        else:
+            self.player_trolley.sprite.x = int(self.trolley_x)
+            self.player_trolley.sprite.y = int(self.trolley_y)
+
+        self.heap_sample_countdown -= 1
+        if self.heap_sample_countdown <= 0:
+            self.heap_sample_countdown = self.heap_sample_interval
+            heap_telemetry.record_ids(PHASE_RACE_FRAME, self.heap_tag)
+        # show_free_memory()
+        # Collect in whatever is left of the frame if the heap is getting low, the refresh waits out the rest of it
+        memory_policy.idle_collect(self.simulation_step)
+        self.app.root_display.refresh_scheduler.refresh(target_frames_per_second=60)
+
     def show(self, menu_passthrough=None):
         """
         Update the display and handle user input while processing game functions
         :param menu_passthrough:
         :return:
         """
-        self.app.root_display.fade_screen('in')
+        self.show_background()
+        self.app.root_display.start_fade('in')
+        # The race refreshes the screen itself, only when something on it has changed
+        self.app.root_display.display.auto_refresh = False
         try:
             self.player_trolley = self.app.player_stats.trolley_controller.instantiate_trolley(
                 self.app.player_stats.trolley_controller.current_trolley, pixel_shadow=True,
@@ -675,11 +1095,14 @@ class RaceEngine(BaseMenu):
                 next_menu = TrolleyShopMenuItem()
             else:
                 next_menu = TrolleyGarageMenuItem()
-            no_trolley_label = self.app.root_display.label_factory(self.no_trolley_text, (30, 50),
-                                                                   color=0xFFFFFF, background_color=0x8132a8)
-            self.app.root_display.main_display_group.append(no_trolley_label)
+            # Kept with the menu's labels, so they go back to the label pool when the menu is dropped
+            self.labels['no_trolley'] = self.app.root_display.label_factory(self.no_trolley_text, (30, 50),
+                                                                            color=0xFFFFFF, background_color=0x8132a8)
+            self.app.root_display.add(self.labels['no_trolley'], 'overlay')
             while not self.app.controls.start_button():
-                pass
+                self.app.clock.tick()
+                self.app.root_display.update_transition()
+                self.app.root_display.refresh_scheduler.refresh()
             self.exit(next_menu)
 
             return
@@ -697,42 +1120,71 @@ class RaceEngine(BaseMenu):
         self.player_trolley.grip = self.app.player_stats.garage[
             self.app.player_stats.trolley_controller.current_trolley].grip
 
-        self.track_generator = TrackGenerator(self.app.player_stats.difficulty)
+        if self.tilemap_rendering:
+            self.obstacle_tilemap = ObstacleTilemap(sprite_extractor, self.app.root_display.display.width,
+                                                    self.app.root_display.display.height)
+            self.app.root_display.add(self.obstacle_tilemap.grid, 'obstacles')
+        else:
+            self.obstacle_tilemap = None
+        seed = self.race_seed
+        if seed is None and self.app.player_stats.difficulty == 'performance_test':
+            seed = self.performance_test_seed
+        if self.input_player:
+            seed = self.input_player.seed
+        self.random_service = RandomService(seed)
+        if self.input_recorder:
+            self.input_recorder.start(self.random_service.seed, self.app.player_stats.difficulty,
+                                      self.app.player_stats.trolley_controller.current_trolley)
+        self.track_generator = TrackGenerator(self.app.player_stats.difficulty, tilemap=self.obstacle_tilemap,
+                                              vectorised=self.vectorised_obstacles,
+                                              random_stream=self.random_service.stream('track'))
         reward = self.track_generator.winning_money
-        self.ai_engine = AIEngine(self.track_generator, self.app.player_stats)
+        self.ai_engine = AIEngine(self.track_generator, self.app.player_stats, self.random_service.stream('ai'))
 
         self.paused = False
-        self.pause_start_time = 0
-        self.total_pause_duration = 0
-        self.app.root_display.auto_refresh = False
-        self.app.root_display.main_display_group.append(self.player_trolley.sprite)
-        self.app.root_display.main_display_group.append(self.ai_engine.ai_trolley.sprite)
+        self.app.root_display.add(self.player_trolley.sprite, 'actors')
+        self.app.root_display.add(self.ai_engine.ai_trolley.sprite, 'actors')
 
         self.app.controls.set_debounce_time('up', 0.0)
         self.app.controls.set_debounce_time('down', 0.0)
         self.app.controls.set_debounce_time('left', 0.0)
         self.app.controls.set_debounce_time('right', 0.0)
-        self.track_generator.start_time = monotonic()
-
-        self.last_move_time = monotonic()
-        self.last_damage_time = self.last_move_time
+        self.simulation_time = 0.0  # Seconds simulated, only advances while the race isn't paused
+        # The driving buttons are debounced in simulated time, so a replay presses them in the same steps
+        self.app.controls.reset_press_times(self.simulation_time, DRIVING_BUTTON_NAMES)
+        self.accumulator = 0.0  # Frame time not simulated yet
+        self.move_accumulator = 0.0  # Simulated time since the last player movement update
+        self.dropped_time = 0.0  # Frame time dropped by the max_steps_per_frame limit
+        self.current_time = 0.0
+        self.last_damage_time = 0.0
+        self.previous_trolley_x = self.trolley_x
+        self.previous_trolley_y = self.trolley_y
+        # The tag is looked up once here, so the frames record the heap with ids only
+        self.heap_tag = heap_telemetry.tag_id(self.app.player_stats.difficulty)
+        self.heap_sample_countdown = 0
 
         cleanup()
 
+        self.last_frame_time = self.app.clock.monotonic()
+
         while True:
+            self.app.clock.tick()
+            self.app.root_display.update_transition()
+
             # Start/pause functionality
             if self.app.controls.start_button():
                 self.paused = not self.paused
                 if self.paused:
-                    self.pause_start_time = monotonic()  # Record the pause start time
-                    pause_label = self.app.root_display.label_factory(self.pause_text, (60, 60),
-                                                                      color=0xFFFFFF, background_color=0x8132a8)
-                    self.app.root_display.main_display_group.append(pause_label)
+                    self.labels['pause'] = self.app.root_display.label_factory(self.pause_text, (60, 60),
+                                                                               color=0xFFFFFF,
+                                                                               background_color=0x8132a8)
+                    self.app.root_display.add(self.labels['pause'], 'overlay')
                 else:
-                    self.total_pause_duration += monotonic() - self.pause_start_time  # Calculate and add pause duration
-                    self.app.root_display.main_display_group.remove(pause_label)
+                    self.app.root_display.release_label(self.labels.pop('pause'))
                 while self.app.controls.start_button():
                     pass
+                # Time spent paused is never simulated
+                self.last_frame_time = self.app.clock.monotonic()
             cleanup()
 
             # Exiting to menu
@@ -741,124 +1193,24 @@ class RaceEngine(BaseMenu):
                 break
 
             if not self.paused:
-                self.current_time = monotonic()
-
-                # Update LED progress based on elapsed time
-                self.app.led_controller.update_progress(self.track_generator.elapsed_time,
-                                                        self.track_generator.race_duration)
-
-                self.block_above = self.block_below = self.block_left = self.block_right = False
-
-                # Update track and obstacles
-                self.track_generator.update(self.total_pause_duration)
-
-                # Update AI movement
-                self.ai_engine.update_ai_movement(self.current_time, self.player_trolley)
-
-                # Clean up obstacles and remove them from the display group as needed
-                for obstacle_to_remove in self.track_generator.cleanup_obstacles():
-                    if obstacle_to_remove.sprite in self.app.root_display.main_display_group:
-                        self.app.root_display.main_display_group.remove(obstacle_to_remove.sprite)
-
-                # 2. Detect and handle collisions
-                for obstacle in self.track_generator.obstacles + [self.ai_engine.ai_trolley]:
-                    if obstacle.sprite not in self.app.root_display.main_display_group:
-                        self.app.root_display.main_display_group.append(obstacle.sprite)
-
-                    if ((obstacle.sprite.x < self.player_trolley.sprite.x + 16 + self.collision_buffer and
-                         obstacle.sprite.x + 16 + self.collision_buffer > self.player_trolley.sprite.x and
-                         obstacle.sprite.y < self.player_trolley.sprite.y + 16 + self.collision_buffer and
-                         obstacle.sprite.y + 16 + self.collision_buffer > self.player_trolley.sprite.y)
-                            and self.track_generator.difficulty != 'performance_test'):
-                        # Call the appropriate handler based on the obstacle type
-                        handler = self.obstacle_type_handlers.get(obstacle.object_id, self.handle_default_obstacle)
-                        handler(obstacle)
-
-                # 3. Update trolley position based on control input and grip
-                # Time check to control movement updates
-                if self.current_time - self.last_move_time > self.move_interval:
-                    # Calculate the grip increase based on weight using log
-                    grip_increase = self.player_trolley.grip * log(1 + self.player_trolley.weight)
-
-                    # Cap the grip increase to ensure it doesn't exceed the maximum allowed grip
-                    max_grip_increase = self.player_trolley.grip * (self.max_grip_multiplier - 1)
-                    limited_grip_increase = min(grip_increase, max_grip_increase)
-
-                    # Calculate the final grip
-                    current_grip = (self.player_trolley.grip + limited_grip_increase) * self.grip_factor
-
-                    # Adjust boost and brake factors incrementally for smooth changes
-                    if self.app.controls.a_button():
-                        self.acceleration_factor += (self.player_trolley.boost_strength * self.boost_multiplier
-                                                     - self.acceleration_factor) * 0.1
-                    else:
-                        self.acceleration_factor += (1 - self.acceleration_factor) * 0.1
-
-                    if self.app.controls.b_button():
-                        self.deceleration_factor += (self.player_trolley.brake_strength * self.brake_multiplier
-                                                     - self.deceleration_factor) * 0.1
-                    else:
-                        self.deceleration_factor += (1 - self.deceleration_factor) * 0.1
-
-                    # Update speed limits based on boost
-                    max_speed = self.player_trolley.speed * self.acceleration_factor
-
-                    # Calculate adjusted acceleration
-                    acceleration = self.player_trolley.acceleration * self.acceleration_factor / (
-                            1 + self.player_trolley.weight * self.acceleration_weight_factor)
-
-                    # Calculate adjusted deceleration
-                    deceleration = self.player_trolley.deceleration * self.deceleration_factor / (
-                            1 + max(self.min_deceleration_denominator,
-                                    self.player_trolley.weight * self.deceleration_weight_factor))
-
-                    # Horizontal movement
-                    if self.app.controls.left_button() and not self.block_left:
-                        self.player_dx = max(-max_speed, self.player_dx - (acceleration * current_grip))
-                    elif self.app.controls.right_button() and not self.block_right:
-                        self.player_dx = min(max_speed, self.player_dx + (acceleration * current_grip))
-                    else:
-                        # Apply natural deceleration
-                        if self.player_dx > 0:
-                            self.player_dx = max(0, self.player_dx - (deceleration * current_grip))
-                        elif self.player_dx < 0:
-                            self.player_dx = min(0, self.player_dx + (deceleration * current_grip))
-
-                    # Vertical movement
-                    if self.app.controls.up_button() and not self.block_above:
-                        self.player_dy = max(-max_speed, self.player_dy - (acceleration * current_grip))
-                    elif self.app.controls.down_button() and not self.block_below:
-                        self.player_dy = min(max_speed, self.player_dy + (acceleration * current_grip))
-                    else:
-                        # Apply natural deceleration
-                        if self.player_dy > 0:
-                            self.player_dy = max(0, self.player_dy - (deceleration * current_grip))
-                        elif self.player_dy < 0:
-                            self.player_dy = min(0, self.player_dy + (deceleration * current_grip))
-
-                    # Update logical position
-                    self.trolley_x += self.player_dx
-                    self.trolley_y += self.player_dy
-
-                    # Ensure trolley stays within bounds
-                    self.trolley_x = max(0, min(self.app.root_display.display.width - 16, self.trolley_x))
-                    self.trolley_y = max(0, min(self.app.root_display.display.height - 16, self.trolley_y))
-
-                    # Update actual sprite position
-                    self.player_trolley.sprite.x = int(self.trolley_x)
-                    self.player_trolley.sprite.y = int(self.trolley_y)
-
-                    self.last_move_time = self.current_time  # Reset movement timer
-
-                # 4. Update game state variables if necessary (e.g., reset blocks, handle grip factor updates)
-                # Check if the grip has been affected by a recent water spill
-                if self.grip_affected:
-                    self.grip_factor = 0.2  # Reduce grip due to water
-                if self.grip_affected and self.current_time - self.water_grip_timer > 3.0:
-                    self.grip_factor = 1.0
-                    self.grip_affected = False  # Reset flag after grip change applied
-
-                self.block_above = self.block_below = self.block_left = self.block_right = False
+                if self.input_player:
+                    self.input_player.next_frame()
+                frame_time = self.app.clock.monotonic()
+                self.accumulator += frame_time - self.last_frame_time
+                self.last_frame_time = frame_time
+
+                # Stop stepping in the step the race ends in, however many more the frame covers
+                steps = 0
+                while self.accumulator >= self.simulation_step and steps < self.max_steps_per_frame:
+                    self.step_simulation(self.simulation_step)
+                    self.accumulator -= self.simulation_step
+                    steps += 1
+                    if (self.player_trolley.health <= 0 or
+                            self.track_generator.elapsed_time >= self.track_generator.race_duration):
+                        break
+                if self.accumulator >= self.simulation_step:
+                    self.dropped_time += self.accumulator
+                    self.accumulator = 0.0
 
                 if self.player_trolley.health <= 0:
                     self.app.player_stats.money_update(250, add=False)
@@ -867,12 +1219,12 @@ class RaceEngine(BaseMenu):
                     return return_menu_items
             if self.track_generator.elapsed_time >= self.track_generator.race_duration:
                 # Calculate the reward based on difficulty
-                if self.player_trolley.sprite.y < self.ai_engine.ai_trolley.sprite.y:
+                if int(self.trolley_y) < self.ai_engine.ai_trolley.sprite.y:
                     self.app.player_stats.money_update(reward, add=True)
                     self.exit(TrolleyMovetoWinMenuItem())
                     return_menu_items = {'reward': reward}
                     return return_menu_items
-                elif self.player_trolley.sprite.y > self.ai_engine.ai_trolley.sprite.y:
+                elif int(self.trolley_y) > self.ai_engine.ai_trolley.sprite.y:
                     self.exit(TrolleyMovetoLoseMenuItem())
                     return_menu_items = {}
                     return return_menu_items
@@ -882,5 +1234,5 @@ class RaceEngine(BaseMenu):
                     self.exit(TrolleyMovetoDrawMenuItem())
                     return_menu_items = {'reward': reward}
                     return return_menu_items
-            # show_free_memory()
-            self.app.root_display.display.refresh(minimum_frames_per_second=0, target_frames_per_second=60)
+            self.render()
+            memory_policy.frame()
@@ -1,23 +1,531 @@
-from adafruit_display_text import label
-from adafruit_imageload import load as imageload
-from board import DISPLAY as board_display
-from displayio import Bitmap as display_bitmap
-from displayio import Group as display_group
-from displayio import OnDiskBitmap as display_on_disk_bitmap
-from displayio import Palette as display_palette
-from displayio import TileGrid as display_tilegrid
-from terminalio import FONT as terminalio_font
-from time import sleep
+from collections import OrderedDict
+from os import stat
+from time import monotonic
 
-from utils.resource_manager import cleanup
+from hal import BitmapLabel as bitmap_label
+from hal import Bitmap as display_bitmap
+from hal import Group as display_group
+from hal import Label as text_label
+from hal import OnDiskBitmap as display_on_disk_bitmap
+from hal import Palette as display_palette
+from hal import TileGrid as display_tilegrid
+from hal import arrayblit, imageload, resource_path
+from hal import display as board_display
+from hal import font as terminalio_font
+
+from components.sprite_layout import (SPRITE_SHEET, SPRITE_PACK, SPRITE_WIDTH, SPRITE_HEIGHT, COLUMNS, ROWS,
+                                      SPRITE_MATRIX, ATLAS_SHADOW_ANGLE, ATLAS_SHADOW_STRENGTH, TINTS, adjust_color,
+                                      draw_shadow_atlas)
+from utils.asset_pack import AssetPack
+from utils.clock import RealClock
+from utils.resource_manager import cleanup, collect_now, free_memory, memory_policy
+
+
+class RefreshScheduler:
+    """
+    Decides when the display needs refreshing while auto refresh is off. Watched sprites are compared against their
+    position at the last refresh, the areas they moved from and to are marked dirty along with any areas invalidated
+    by elements being added or removed, and the refresh is skipped entirely when nothing is dirty. Labels are watched
+    for their text changing in place as well as moving, and invalidate the whole screen as they have no fixed size.
+    Dirty areas are merged into one bounding box per frame, so marking an area is constant time. The box is only an
+    estimate of the pixels and rows pushed to the panel per frame, displayio tracks its own dirty areas and decides
+    what it actually sends.
+    """
+
+    def __init__(self, display, width=160, height=128):
+        self.display = display
+        self.width = width
+        self.height = height
+        self.watched = {}  # id(sprite) -> [sprite, x at last refresh, y at last refresh, width, height]
+        self.watched_labels = {}  # id(label) -> [label, x at last refresh, y at last refresh, text at last refresh]
+        # Bounding box of the dirty areas since the last refresh, x2 and y2 are one past the last dirty column and row
+        self.dirty_x1 = width
+        self.dirty_y1 = height
+        self.dirty_x2 = 0
+        self.dirty_y2 = 0
+        self.dirty = False
+        self.mark(0, 0, width, height)
+
+        self.frames_refreshed = 0
+        self.frames_skipped = 0
+        self.last_pixels = 0
+        self.last_rows = 0
+        self.total_pixels = 0
+
+    def element_size(self, element):
+        """
+        Get the on screen size of a sprite, or None if the element doesn't have a fixed size (e.g. labels).
+        :param element:
+        :return:
+        """
+        try:
+            return element.width * element.tile_width, element.height * element.tile_height
+        except AttributeError:
+            return None
+
+    def mark(self, x, y, width, height):
+        """
+        Mark an area of the screen as dirty.
+        :param x:
+        :param y:
+        :param width:
+        :param height:
+        :return:
+        """
+        x_start = max(0, x)
+        x_end = min(self.width, x + width)
+        y_start = max(0, y)
+        y_end = min(self.height, y + height)
+        if x_start >= x_end or y_start >= y_end:
+            return
+        self.dirty = True
+        if x_start < self.dirty_x1:
+            self.dirty_x1 = x_start
+        if y_start < self.dirty_y1:
+            self.dirty_y1 = y_start
+        if x_end > self.dirty_x2:
+            self.dirty_x2 = x_end
+        if y_end > self.dirty_y2:
+            self.dirty_y2 = y_end
+
+    def invalidate(self, element=None):
+        """
+        Mark the area of an element as dirty, or the whole screen if no element (or an element without a fixed size)
+        is given.
+        :param element:
+        :return:
+        """
+        size = self.element_size(element) if element is not None else None
+        if size is None:
+            self.mark(0, 0, self.width, self.height)
+        else:
+            self.mark(element.x, element.y, size[0], size[1])
+
+    def added(self, element):
+        """
+        Mark a newly shown element as dirty, and watch it for movement if it is a sprite, or for movement and text
+        changes if it is a label.
+        :param element:
+        :return:
+        """
+        self.invalidate(element)
+        size = self.element_size(element)
+        if size is not None:
+            self.watched[id(element)] = [element, element.x, element.y, size[0], size[1]]
+        elif hasattr(element, 'text'):
+            self.watched_labels[id(element)] = [element, element.x, element.y, element.text]
+
+    def removed(self, element):
+        """
+        Mark the area a removed element was last drawn in as dirty and stop watching it.
+        :param element:
+        :return:
+        """
+        self.watched_labels.pop(id(element), None)
+        entry = self.watched.pop(id(element), None)
+        if entry is None:
+            self.invalidate(element)
+        else:
+            self.mark(entry[1], entry[2], entry[3], entry[4])
+            self.invalidate(element)
+
+    def reset(self):
+        """
+        Stop watching everything and mark the whole screen as dirty.
+        :return:
+        """
+        self.watched.clear()
+        self.watched_labels.clear()
+        self.mark(0, 0, self.width, self.height)
+
+    def collect_moves(self):
+        """
+        Mark the old and new areas of every watched sprite that moved since the last refresh, and the whole screen
+        if a watched label moved or had its text changed.
+        :return:
+        """
+        for entry in self.watched.values():
+            sprite = entry[0]
+            x = sprite.x
+            y = sprite.y
+            if x != entry[1] or y != entry[2]:
+                self.mark(entry[1], entry[2], entry[3], entry[4])
+                self.mark(x, y, entry[3], entry[4])
+                entry[1] = x
+                entry[2] = y
+        for entry in self.watched_labels.values():
+            label = entry[0]
+            if label.text != entry[3] or label.x != entry[1] or label.y != entry[2]:
+                self.mark(0, 0, self.width, self.height)
+                entry[1] = label.x
+                entry[2] = label.y
+                entry[3] = label.text
+
+    def refresh(self, target_frames_per_second=60):
+        """
+        Refresh the display if anything changed since the last refresh.
+        :param target_frames_per_second:
+        :return: True if the display was refreshed
+        """
+        self.collect_moves()
+        if not self.dirty:
+            self.frames_skipped += 1
+            self.last_pixels = 0
+            self.last_rows = 0
+            return False
+
+        rows = self.dirty_y2 - self.dirty_y1
+        pixels = (self.dirty_x2 - self.dirty_x1) * rows
+        self.dirty_x1 = self.width
+        self.dirty_y1 = self.height
+        self.dirty_x2 = 0
+        self.dirty_y2 = 0
+        self.dirty = False
+
+        self.last_pixels = pixels
+        self.last_rows = rows
+        self.total_pixels += pixels
+        self.frames_refreshed += 1
+        self.display.refresh(minimum_frames_per_second=0, target_frames_per_second=target_frames_per_second)
+        return True
+
+    def stats(self):
+        """
+        Get the refresh counters, the pixel and row counts are estimates from the dirty bounding box tracked here.
+        :return:
+        """
+        return {
+            'frames_refreshed': self.frames_refreshed,
+            'frames_skipped': self.frames_skipped,
+            'last_pixels': self.last_pixels,
+            'last_rows': self.last_rows,
+            'total_pixels': self.total_pixels,
+            'average_pixels': self.total_pixels // self.frames_refreshed if self.frames_refreshed else 0,
+        }
+
+
+class BackgroundCache:
+    """
+    Keeps recently used background images open between menu switches, so going back and forth between menus doesn't
+    reopen the same BMP from flash every time. Images are kept as OnDiskBitmap handles, or decoded into RAM when there
+    is enough free heap to spare, and the least recently used images are evicted whenever free heap drops below the
+    minimum. Images are only trimmed on a lookup or a menu switch, so the Display also has the memory policy release
+    all but the current image when the heap runs low in between, such as during a race.
+    """
+
+    def __init__(self, max_images=4, min_free_memory=16384, decode_headroom=49152):
+        self.max_images = max_images
+        self.min_free_memory = min_free_memory  # Evict images until at least this much heap is free
+        self.decode_headroom = decode_headroom  # Only decode images if this much heap is still free afterwards
+        self.images = OrderedDict()  # image path -> (bitmap, pixel shader, decoded)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_times = {}  # image path -> milliseconds taken by the last load
+
+    def get(self, image_path):
+        """
+        Get the bitmap and pixel shader of a background image, loading it if it isn't cached.
+        :param image_path:
+        :return:
+        """
+        entry = self.images.pop(image_path, None)
+        if entry is None:
+            self.misses += 1
+            entry = self.load(image_path)
+        else:
+            self.hits += 1
+        self.images[image_path] = entry
+
+        while len(self.images) > self.max_images:
+            self.evict_oldest()
+        self.trim()
+
+        return entry[0], entry[1]
+
+    def load(self, image_path):
+        """
+        Open a background image, decoding it into RAM if there is enough heap for it.
+        :param image_path:
+        :return:
+        """
+        start_time = monotonic()
+        odb = display_on_disk_bitmap(resource_path(image_path))
+        decoded = free_memory() - odb.width * odb.height > self.decode_headroom
+        if decoded:
+            del odb
+            cleanup()
+            bitmap, pixel_shader = imageload(resource_path(image_path), bitmap=display_bitmap, palette=display_palette)
+        else:
+            bitmap, pixel_shader = odb, odb.pixel_shader
+        self.load_times[image_path] = int((monotonic() - start_time) * 1000)
+        return bitmap, pixel_shader, decoded
+
+    def evict_oldest(self):
+        """
+        Evict the least recently used image.
+        :return:
+        """
+        oldest_path = next(iter(self.images))
+        del self.images[oldest_path]
+        self.evictions += 1
+        # trim measures the free heap straight after, so this can't wait for the memory policy
+        collect_now()
+
+    def release(self):
+        """
+        Drop every image but the most recently used one, without collecting, for the memory policy to call right
+        before it collects because the heap is low.
+        :return:
+        """
+        while len(self.images) > 1:
+            del self.images[next(iter(self.images))]
+            self.evictions += 1
+
+    def trim(self):
+        """
+        Evict least recently used images, other than the most recent one, until enough heap is free.
+        :return:
+        """
+        while len(self.images) > 1 and free_memory() < self.min_free_memory:
+            self.evict_oldest()
+
+    def stats(self):
+        """
+        Get the cache counters, including the hit rate and the load time of each image in milliseconds.
+        :return:
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'cached': [(path, entry[2]) for path, entry in self.images.items()],
+            'load_times': self.load_times,
+        }
+
+
+class ObstacleTilemap:
+    """
+    Draws the whole obstacle field as one multi-cell TileGrid over the shadow atlas, instead of one TileGrid per
+    obstacle. Obstacles sit on a grid of atlas sized cells (17x17 with the default shadow), the grid scrolls down with
+    the track by moving its y offset, and every time it has moved a whole cell the rows are shifted down by one and
+    the freshly exposed top row is filled in. Drawing cost stays the same however many obstacles are on the track.
+    """
+
+    def __init__(self, extractor, width=160, height=128, template_id='block_1'):
+        self.extractor = extractor
+        bitmap, palette, self.cell_width, self.cell_height, _ = extractor.get_variant(
+            template_id, pixel_shadow=True, transparent_background=True)
+        self.blank_tile = extractor.blank_tile
+        self.columns = width // self.cell_width  # Obstacle lanes, anything past the last whole cell isn't used
+        self.rows = height // self.cell_height + 2  # Enough rows to cover the screen at any scroll position
+        self.grid = display_tilegrid(bitmap, pixel_shader=palette, width=self.columns, height=self.rows,
+                                     tile_width=self.cell_width, tile_height=self.cell_height,
+                                     default_tile=self.blank_tile)
+        self.grid.y = -self.cell_height
+
+        cleanup()
+
+    def snap(self, x, y):
+        """
+        Snap a position onto the tilemap grid, so an obstacle placed there lines up with a cell.
+        :param x:
+        :param y:
+        :return:
+        """
+        lane = min(self.columns - 1, max(0, x // self.cell_width))
+        return lane * self.cell_width, y - (y - self.grid.y) % self.cell_height
+
+    def cell(self, x, y):
+        """
+        Get the (column, row) of the cell at a grid aligned position, or None if it isn't in the grid.
+        :param x:
+        :param y:
+        :return:
+        """
+        column = x // self.cell_width
+        row = (y - self.grid.y) // self.cell_height
+        if 0 <= column < self.columns and 0 <= row < self.rows:
+            return column, row
+        return None
+
+    def place(self, x, y, object_id):
+        """
+        Draw an obstacle into the tilemap, if it has already scrolled into the grid.
+        :param x:
+        :param y:
+        :param object_id:
+        :return:
+        """
+        cell = self.cell(x, y)
+        if cell is not None:
+            self.grid[cell] = self.extractor.tile_index(object_id)
+
+    def clear(self, x, y):
+        """
+        Remove an obstacle from the tilemap.
+        :param x:
+        :param y:
+        :return:
+        """
+        cell = self.cell(x, y)
+        if cell is not None:
+            self.grid[cell] = self.blank_tile
+
+    def scroll(self, dy=1):
+        """
+        Scroll the tilemap down with the track, wrapping rows once a whole cell has been scrolled. Obstacles that have
+        just scrolled into the blank top row (those at y == grid.y) are left for the caller to place.
+        :param dy:
+        :return: True if the rows wrapped
+        """
+        self.grid.y += dy
+        wrapped = False
+        while self.grid.y >= 0:
+            self.grid.y -= self.cell_height
+            for row in range(self.rows - 1, 0, -1):
+                for column in range(self.columns):
+                    self.grid[column, row] = self.grid[column, row - 1]
+            for column in range(self.columns):
+                self.grid[column, 0] = self.blank_tile
+            wrapped = True
+        return wrapped
+
+
+class LabelPool:
+    """
+    Fixed set of reusable bitmap_label slots, created once at boot. Text, colour and position are updated in place
+    when a slot is handed out, so showing menu rows, notifications and the pause overlay doesn't build new labels.
+    bitmap_label draws its text into a single bitmap instead of a TileGrid per glyph.
+    """
+
+    def __init__(self, size=8, font=terminalio_font):
+        self.font = font
+        self.slots = [bitmap_label(font, text=" ") for _ in range(size)]
+        self.free = list(self.slots)
+        self.in_use = set()  # id() of every slot currently handed out
+        self.overflows = 0  # Labels built because every slot was in use
+
+        cleanup()
+
+    def acquire(self, text, pos, color=0xFFFFFF, background_color=0x000000):
+        """
+        Get a label showing the given text, reusing a free slot if there is one.
+        :param text:
+        :param pos:
+        :param color:
+        :param background_color:
+        :return:
+        """
+        x, y = pos
+        if not self.free:
+            self.overflows += 1
+            return bitmap_label(self.font, text=text, color=color, background_color=background_color, x=x, y=y)
+        slot = self.free.pop()
+        self.in_use.add(id(slot))
+        slot.text = text
+        slot.color = color
+        slot.background_color = background_color
+        slot.x = x
+        slot.y = y
+        return slot
+
+    def release(self, slot):
+        """
+        Return a label to the pool, labels built on overflow are just dropped.
+        :param slot:
+        :return:
+        """
+        if id(slot) in self.in_use:
+            self.in_use.remove(id(slot))
+            self.free.append(slot)
+
+    def release_all(self):
+        """
+        Return every label to the pool.
+        :return:
+        """
+        self.in_use.clear()
+        self.free = list(self.slots)
+
+    def stats(self):
+        """
+        Get the pool counters.
+        :return:
+        """
+        return {
+            'size': len(self.slots),
+            'in_use': len(self.in_use),
+            'free': len(self.free),
+            'overflows': self.overflows,
+        }
+
+
+class FadeTransition:
+    """
+    A screen fade that advances one step every time it is updated from a main loop tick, instead of blocking until
+    it is done. The brightness follows the time elapsed since the fade started, so the fade takes the same time
+    whatever the tick rate is, and work done between ticks overlaps the fade instead of adding to it.
+    """
+
+    def __init__(self, display, direction, full_brightness, duration=0.25, on_complete=None, clock=None):
+        self.clock = clock or RealClock()
+        self.display = display
+        self.start_brightness = display.brightness
+        self.target_brightness = full_brightness if direction == 'in' else 0
+        self.duration = duration
+        self.on_complete = on_complete
+        self.start_time = self.clock.monotonic()
+
+    def step(self):
+        """
+        Advance the fade to the current time.
+        :return: True once the fade has finished
+        """
+        if self.duration > 0:
+            progress = min(1.0, (self.clock.monotonic() - self.start_time) / self.duration)
+        else:
+            progress = 1.0
+        self.display.brightness = (self.start_brightness +
+                                   (self.target_brightness - self.start_brightness) * progress)
+        return progress >= 1.0
 
 
 class Display:
-    def __init__(self):
+    def __init__(self, clock=None, label_pool_size=5):
+        self.clock = clock or RealClock()  # Fades are timed on this clock
         self.display = board_display
         self.main_display_group = display_group()
         self.display.root_group = self.main_display_group
         self.full_brightness = 0.75
+
+        # Fixed layers drawn in this order, each its own group so nothing has to search the whole screen
+        self.layer_names = ('background', 'obstacles', 'actors', 'hud', 'overlay')
+        self.layers = {}
+        for layer_name in self.layer_names:
+            self.layers[layer_name] = display_group()
+            self.main_display_group.append(self.layers[layer_name])
+
+        # Side index of id(element) -> (layer name, position in layer), for constant time add/remove/lookup
+        self.layer_index = {}
+        # Layers whose drawing order doesn't matter, removing from them swaps the last element into the gap, the
+        # obstacles don't rely on the order they are drawn in
+        self.unordered_layers = ('obstacles',)
+
+        # Used instead of auto refresh where the screen is refreshed manually, e.g. the race loop
+        self.refresh_scheduler = RefreshScheduler(self.display, self.display.width, self.display.height)
+
+        self.background_cache = BackgroundCache()
+        # The bound method is kept, so close can deregister the same object
+        self.low_memory_handler = self.background_cache.release
+        memory_policy.add_low_memory_handler(self.low_memory_handler)
+
+        # Sized by the Application from the menu rows and overlay labels that can be on screen at once
+        self.label_pool = LabelPool(size=label_pool_size)
+
+        self.transition = None  # Screen transition currently running, advanced by update_transition
         cleanup()
 
     def fade_screen(self, direction='in', steps=100, delay=0.0025):
@@ -30,43 +538,137 @@ class Display:
         Returns: None
         """
         if direction == 'instant_in':
+            self.transition = None
             self.display.brightness = self.full_brightness
         elif direction == 'instant_out':
+            self.transition = None
             self.display.brightness = 0
-        elif direction == 'in':
-            for b in range(steps):
-                self.display.brightness = b / steps * self.full_brightness
-                sleep(delay)
-        elif direction == 'out':
-            for b in range(steps, -1, -1):
-                self.display.brightness = b / steps * self.full_brightness
-                sleep(delay)
+        elif direction in ('in', 'out'):
+            self.start_fade(direction, duration=steps * delay)
+            self.finish_transition()
+
+    def start_fade(self, direction='in', duration=0.25, on_complete=None):
+        """
+        Start fading the screen in or out without blocking, the fade then advances every time update_transition is
+        called.
+        :param direction:
+        :param duration:
+        :param on_complete: called once the fade has finished
+        :return:
+        """
+        self.transition = FadeTransition(self.display, direction, self.full_brightness, duration=duration,
+                                         on_complete=on_complete, clock=self.clock)
+
+    def update_transition(self):
+        """
+        Advance the running transition by one step, called once per main loop tick.
+        :return: True while a transition is still running
+        """
+        transition = self.transition
+        if transition is None:
+            return False
+        if transition.step():
+            self.transition = None
+            if transition.on_complete:
+                transition.on_complete()
+            return False
+        return True
+
+    def finish_transition(self, delay=0.0025):
+        """
+        Block until the running transition, if any, has finished.
+        :param delay:
+        :return:
+        """
+        while self.update_transition():
+            self.clock.sleep(delay)
 
     def clear_main_display_group(self):
         """
-        Clear the main display group.
+        Clear every layer of the main display group. Labels aren't handed back to the label pool here, the menus that
+        took them release them, as the next menu may already hold some.
         :return:
         """
-        while len(self.main_display_group):
-            del self.main_display_group[-1]
+        for layer in self.layers.values():
+            while len(layer):
+                layer.pop()
+        self.layer_index.clear()
+        self.refresh_scheduler.reset()
         cleanup()
+        self.background_cache.trim()
+
+    def close(self):
+        """
+        Deregister from the memory policy and drop the cached backgrounds, for when the display is replaced, such as
+        by the host tools building another Application in the same process.
+        :return:
+        """
+        memory_policy.remove_low_memory_handler(self.low_memory_handler)
+        self.background_cache.images.clear()
+
+    def add(self, element, layer='actors'):
+        """
+        Add a sprite or label to a display layer.
+        :param element:
+        :param layer:
+        :return:
+        """
+        group = self.layers[layer]
+        group.append(element)
+        self.layer_index[id(element)] = (layer, len(group) - 1)
+        self.refresh_scheduler.added(element)
+
+    def remove(self, element):
+        """
+        Remove a sprite or label from whichever display layer it is in. In an unordered layer the last element is
+        moved into its place, which takes constant time. In the other layers the elements above it move down one
+        position to keep the drawing order, so removal there takes time in proportion to the elements above it. The
+        ordered layers only hold the background, the two trolleys and a handful of labels.
+        :param element:
+        :return: True if the element was on screen
+        """
+        entry = self.layer_index.pop(id(element), None)
+        if entry is None:
+            return False
+        layer, position = entry
+        group = self.layers[layer]
+        if layer in self.unordered_layers:
+            last = group.pop()
+            if last is not element:
+                group[position] = last
+                self.layer_index[id(last)] = (layer, position)
+        else:
+            group.pop(position)
+            for i in range(position, len(group)):
+                self.layer_index[id(group[i])] = (layer, i)
+        self.refresh_scheduler.removed(element)
+        return True
+
+    def contains(self, element):
+        """
+        Check whether a sprite or label is on screen.
+        :param element:
+        :return:
+        """
+        return id(element) in self.layer_index
 
-    def show_image(self, image_path):
+    def show_image(self, image_path, image=None):
         """
         Display an image on the screen.
         :param image_path:
+        :param image: (bitmap, pixel shader) already got from the background cache, to save looking it up again
         :return:
         """
-        odb = display_on_disk_bitmap(image_path)
-        loaded_image = display_tilegrid(odb, pixel_shader=odb.pixel_shader)
-        del odb
-        self.main_display_group.append(loaded_image)
+        bitmap, pixel_shader = image or self.background_cache.get(image_path)
+        loaded_image = display_tilegrid(bitmap, pixel_shader=pixel_shader)
+        del bitmap, pixel_shader
+        self.add(loaded_image, 'background')
         del loaded_image
         cleanup()
 
     def label_factory(self, text, pos, color=0xFFFFFF, background_color=0x000000, font=terminalio_font):
         """
-        Create a label object.
+        Get a label object, from the label pool unless a different font is needed.
         :param text:
         :param pos:
         :param color:
@@ -74,9 +676,200 @@ class Display:
         :param font:
         :return:
         """
+        if font is self.label_pool.font:
+            return self.label_pool.acquire(text, pos, color=color, background_color=background_color)
         x, y = pos
         cleanup()
-        return label.Label(font, text=text, color=color, background_color=background_color, x=x, y=y)
+        return text_label(font, text=text, color=color, background_color=background_color, x=x, y=y)
+
+    def release_label(self, text_label):
+        """
+        Take a label off the screen and hand it back to the label pool.
+        :param text_label:
+        :return:
+        """
+        self.remove(text_label)
+        self.label_pool.release(text_label)
+
+
+class PaletteBank:
+    """
+    Shared palettes for every sprite. One palette is built per combination of colour shift, background and shadow
+    colour, and handed out to every sprite using that combination, so the number of palettes in RAM grows with the
+    number of tints in use rather than with the number of sprites. The shifted colours of each tint are worked out
+    once, when the tint is registered.
+    """
+
+    def __init__(self, base_colors):
+        self.base_colors = list(base_colors)
+        self.tints = {}  # Tint name to colour shift
+        self.colors = {}  # Colour shift to the shifted sprite sheet colours
+        self.palettes = {}  # (colour shift, background, shadow colour) to the shared palette
+        self.register_colors((0, 0, 0), self.base_colors)
+        self.tints['none'] = (0, 0, 0)
+
+    def register_colors(self, color_shift, colors):
+        """
+        Register colours that have already been shifted, such as the palettes prebuilt into the sprite pack.
+        :param color_shift:
+        :param colors:
+        :return:
+        """
+        self.colors[tuple(color_shift)] = list(colors)
+
+    def register_tint(self, name, color_shift):
+        """
+        Register a named tint, working out its shifted colours unless they are already known.
+        :param name:
+        :param color_shift:
+        :return: the colour shift of the tint
+        """
+        color_shift = tuple(color_shift)
+        if color_shift not in self.colors:
+            self.register_colors(color_shift, [adjust_color(color, color_shift) for color in self.base_colors])
+        self.tints[name] = color_shift
+        return color_shift
+
+    def resolve(self, tint):
+        """
+        Get the colour shift of a tint given either by name or as an (r, g, b) colour shift.
+        :param tint:
+        :return:
+        """
+        if isinstance(tint, str):
+            return self.tints[tint]
+        color_shift = tuple(tint)
+        if color_shift not in self.colors:
+            self.register_colors(color_shift, [adjust_color(color, color_shift) for color in self.base_colors])
+        return color_shift
+
+    def get(self, tint=(0, 0, 0), transparent_background=True, background_color=0xffffff, shadow_color=None):
+        """
+        Get the shared palette for a tint, building it the first time it is asked for.
+        :param tint: tint name or (r, g, b) colour shift
+        :param transparent_background:
+        :param background_color:
+        :param shadow_color: colour of the extra shadow entry after the sprite sheet colours, None for no shadow
+        :return:
+        """
+        color_shift = self.resolve(tint)
+        background = None if transparent_background else background_color
+        key = (color_shift, background, shadow_color)
+        palette = self.palettes.get(key)
+        if palette is not None:
+            return palette
+
+        colors = self.colors[color_shift]
+        palette = display_palette(len(colors) + (0 if shadow_color is None else 1))
+        for i, color in enumerate(colors):
+            palette[i] = color
+        if shadow_color is not None:
+            palette[len(colors)] = shadow_color
+        if background is None:
+            palette.make_transparent(0)
+        else:
+            palette[0] = background
+        self.palettes[key] = palette
+        return palette
+
+    def stats(self):
+        """
+        Get the bank counters.
+        :return:
+        """
+        return {
+            'tints': len(self.tints),
+            'shifts': len(self.colors),
+            'palettes': len(self.palettes),
+        }
+
+
+class SpriteVariantCache:
+    """
+    Least recently used cache of the bitmap/palette pairs built by SpriteExtractor.get_sprite. Identical variants
+    share the same bitmap and palette, and the least recently used variants are evicted once the estimated RAM used
+    by the cache goes over the budget.
+    """
+
+    def __init__(self, ram_budget=4096, entry_cost=96):
+        self.ram_budget = ram_budget
+        self.entry_cost = entry_cost  # Bytes charged for every entry, its key, variant tuple and dictionary slot
+        self.ram_used = 0
+        self.variants = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def estimate_size(self, variant):
+        """
+        Estimate the bytes of RAM held by a variant. Bitmaps shared with the sprite sheet or the shadow atlas and
+        palettes shared through the palette bank are not counted, as they are kept alive by the sheet, the atlas and
+        the bank themselves, but every entry is charged the entry cost, so the cache can't grow without bound when
+        nearly every variant shares its bitmap.
+        :param variant:
+        :return:
+        """
+        bitmap, palette, tile_width, tile_height, default_tile = variant
+        size = self.entry_cost
+        if bitmap.width == tile_width and bitmap.height == tile_height:
+            bits = 1
+            while (1 << bits) < len(palette):
+                bits *= 2
+            size += (bitmap.width * bitmap.height * bits + 7) // 8
+        return size
+
+    def get(self, key):
+        """
+        Get a cached variant, marking it as the most recently used.
+        :param key:
+        :return: the cached variant, or None on a miss
+        """
+        entry = self.variants.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.variants[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, variant):
+        """
+        Store a variant, evicting the least recently used variants until the cache is back within its budget.
+        :param key:
+        :param variant:
+        :return:
+        """
+        size = self.estimate_size(variant)
+        self.variants[key] = (variant, size)
+        self.ram_used += size
+        while self.ram_used > self.ram_budget and len(self.variants) > 1:
+            oldest_key = next(iter(self.variants))
+            self.ram_used -= self.variants.pop(oldest_key)[1]
+            self.evictions += 1
+        cleanup()
+
+    def clear(self):
+        """
+        Drop every cached variant.
+        :return:
+        """
+        self.variants.clear()
+        self.ram_used = 0
+        cleanup()
+
+    def stats(self):
+        """
+        Get the cache counters.
+        :return:
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'variants': len(self.variants),
+            'ram_used': self.ram_used,
+            'ram_budget': self.ram_budget,
+        }
 
 
 class SpriteExtractor:
@@ -94,95 +887,190 @@ class SpriteExtractor:
 
             cleanup()
 
-    def __init__(self, sprite_sheet, sprite_width, sprite_height, columns, rows):
+    def __init__(self, sprite_sheet, sprite_width, sprite_height, columns, rows, variant_cache_budget=4096,
+                 sprite_pack=None):
         # todo: fix why sprite width and height aren't working as expected, for example 'trolley.sprite.height'
         #  brings back '1' instead of the actual height
-        self.sprite_sheet = sprite_sheet
+        self.sprite_sheet = resource_path(sprite_sheet)
+        self.sprite_pack = resource_path(sprite_pack) if sprite_pack else None
         self.sprite_width = sprite_width
         self.sprite_height = sprite_height
         self.columns = columns
         self.rows = rows
-        self.sprites = self.load_sprites()
-
-        # x, y position of each sprite in the sprite sheet
-        self.sprite_matrix = {
-            "trolley_basic": (0, 0),
-            "trolley_better": (0, 1),
-            "trolley_big": (0, 2),
-            "trolley_super": (0, 3),
-            "block_1": (1, 0),
-            "money": (1, 1),
-            "carbon_fibre_frame": (1, 2),
-            "turbo_upgrade": (1, 3),
-            "water_spill_1": (2, 0),
-            "carbon_fibre_wheels": (2, 1),
-            "nitrous_oxide": (2, 2),
-            "air_filter_upgrade": (2, 3),
-            "sign": (3, 0),
-            "racing_handle": (3, 1),
-            "brake_upgrade": (3, 2),
-            "computer_chip_upgrade": (3, 3),
-            "person": (4, 0),
-            "scanning_computer": (4, 1),
-            "exhaust_upgrade": (4, 2),
-            "suspension_upgrade": (4, 3),
-            "block_2": (5, 0),
-            "block_3": (5, 1),
-            "block_4": (5, 2),
-            "block_5": (5, 3),
-        }
+
+        # x, y position of each sprite in the sprite sheet, replaced by the index of the sprite pack when one is loaded
+        self.sprite_matrix = dict(SPRITE_MATRIX)
+
+        # Shadow settings baked into the shadow atlas, other settings fall back to drawing the shadow per variant
+        self.atlas_shadow_angle = ATLAS_SHADOW_ANGLE
+        self.atlas_shadow_strength = ATLAS_SHADOW_STRENGTH
+        self.atlas_cell_width = self.sprite_width + self.atlas_shadow_strength
+        self.atlas_cell_height = self.sprite_height + self.atlas_shadow_strength
+
+        self.sheet_bitmap = None
+        self.sheet_palette = None
+        self.shadow_atlas = None
+        self.blank_tile = self.columns * self.rows  # First cell of the blank row at the bottom of the shadow atlas
+        self.palette_bank = None  # Shared palettes for every tint, seeded with the palettes prebuilt in the pack
+
+        self.load_sprites()
+        for name, color_shift in TINTS.items():
+            self.palette_bank.register_tint(name, color_shift)
+        self.variant_cache = SpriteVariantCache(ram_budget=variant_cache_budget)
 
         cleanup()
 
     def load_sprites(self):
         """
-        Load the sprites from the sprite sheet.
+        Load the sprite sheet, its palette and the shadow atlas, from the sprite pack if there is one, otherwise from
+        the sprite sheet BMP.
         :return:
         """
-        sprite_sheet, palette = imageload(self.sprite_sheet, bitmap=display_bitmap, palette=display_palette)
-        palette.make_transparent(0)  # Make the color at index 0 transparent
+        if self.sprite_pack:
+            try:
+                stat(self.sprite_pack)
+            except OSError:
+                pass
+            else:
+                self.load_sprite_pack()
+                return
 
-        sprites = []
-        for row in range(self.rows):
-            row_sprites = []
-            for col in range(self.columns):
-                # todo: look into tile_width and tile_height for collision testing, could maybe simplify objects
-                sprite = self.CustomTileGrid(sprite_sheet, pixel_shader=palette,
-                                             width=1, height=1,
-                                             tile_width=self.sprite_width,
-                                             tile_height=self.sprite_height,
-                                             default_tile=col + row * self.columns,
-                                             icon=False)
-                row_sprites.append(sprite)
-            sprites.append(row_sprites)
+        self.load_sprite_sheet()
+
+    def load_sprite_sheet(self):
+        """
+        Load the sprite sheet BMP and bake the shadow atlas from it.
+        :return:
+        """
+        self.sheet_bitmap, self.sheet_palette = imageload(self.sprite_sheet, bitmap=display_bitmap,
+                                                          palette=display_palette)
+        self.sheet_palette.make_transparent(0)  # Make the color at index 0 transparent
+        self.palette_bank = PaletteBank(self.sheet_palette[i] for i in range(len(self.sheet_palette)))
+
+        self.shadow_atlas = self.build_shadow_atlas(self.sheet_bitmap, len(self.sheet_palette))
 
         cleanup()
 
-        return sprites
+    def load_sprite_pack(self):
+        """
+        Load the sprite sheet, palettes and prebaked shadow atlas from the sprite pack, with one bulk read of the pack
+        and one blit per bitmap.
+        :return:
+        """
+        pack = AssetPack(self.sprite_pack)
+
+        self.sprite_width = pack.sprite_width
+        self.sprite_height = pack.sprite_height
+        self.columns = pack.columns
+        self.rows = pack.rows
+        self.sprite_matrix = pack.sprite_matrix()
+        self.atlas_shadow_angle = pack.shadow_angle
+        self.atlas_shadow_strength = pack.shadow_strength
+        self.atlas_cell_width = pack.cell_width
+        self.atlas_cell_height = pack.cell_height
+        self.blank_tile = self.columns * self.rows
+
+        self.sheet_bitmap = display_bitmap(pack.sheet_width, pack.sheet_height, pack.palette_size)
+        arrayblit(self.sheet_bitmap, pack.sheet_pixels())
+        self.shadow_atlas = display_bitmap(pack.atlas_width, pack.atlas_height, pack.palette_size + 1)
+        arrayblit(self.shadow_atlas, pack.atlas_pixels())
 
-    def adjust_color(self, color, offset):
+        shifted_colors = {shift: [pack.palette_color(palette_index, i) for i in range(pack.palette_size)]
+                          for palette_index, shift in enumerate(pack.palette_shifts())}
+        self.palette_bank = PaletteBank(shifted_colors.pop((0, 0, 0)))
+        for shift, colors in shifted_colors.items():
+            self.palette_bank.register_colors(shift, colors)
+
+        self.sheet_palette = self.palette_bank.get()
+
+        pack.close()
+        del pack
+        cleanup()
+
+    def build_shadow_atlas(self, sprite_sheet, palette_size):
         """
-        Adjust the given 8-bit color to create a different shade for the AI trolley.
-        :param color:
-        :param offset:
+        Build a copy of the sprite sheet with the drop shadow already drawn under every sprite in the sprite matrix,
+        so shadowed sprites are a tile lookup instead of a pixel loop. Each cell is expanded by the shadow strength
+        and the shadow is drawn with the colour index one past the end of the sprite sheet palette. An extra row of
+        blank cells is left at the bottom for empty tilemap cells.
+        :param sprite_sheet:
+        :param palette_size:
         :return:
         """
-        r = (color >> 16) & 0xFF
-        g = (color >> 8) & 0xFF
-        b = color & 0xFF
+        atlas = display_bitmap(self.columns * self.atlas_cell_width, (self.rows + 1) * self.atlas_cell_height,
+                               palette_size + 1)
+        draw_shadow_atlas(sprite_sheet, atlas, palette_size, self.atlas_shadow_strength, self.sprite_matrix,
+                          self.sprite_width, self.sprite_height)
 
-        # Adjust the color components to create a different shade
-        r = max(0, min(255, r + offset[0]))  # Increase red component
-        g = max(0, min(255, g + offset[1]))  # Decrease green component
-        b = max(0, min(255, b + offset[2]))  # Increase blue component
+        cleanup()
 
-        return (r << 16) | (g << 8) | b
+        return atlas
+
+    def tile_index(self, name):
+        """
+        Get the tile index of a sprite, valid for both the sprite sheet and the shadow atlas.
+        :param name:
+        :return:
+        """
+        column, row = self.sprite_matrix[name]
+        return row * self.columns + column
+
+    def variant_key(self, name, pixel_shadow, shadow_angle, shadow_strength, transparent_background,
+                    background_color, shadow_color, color_shift):
+        """
+        Build the cache key for a sprite variant, ignoring settings that have no effect on the result.
+        :param name:
+        :param pixel_shadow:
+        :param shadow_angle:
+        :param shadow_strength:
+        :param transparent_background:
+        :param background_color:
+        :param shadow_color:
+        :param color_shift:
+        :return:
+        """
+        if pixel_shadow:
+            shadow = (shadow_angle, shadow_strength, shadow_color)
+        else:
+            shadow = None
+        if transparent_background:
+            background = None
+        else:
+            background = background_color
+        return name, shadow, background, self.palette_bank.resolve(color_shift)
+
+    def get_variant(self, name, pixel_shadow=False, shadow_angle=135, shadow_strength=1, transparent_background=True,
+                    background_color=0xffffff, shadow_color=0x000000, color_shift=(0, 0, 0)):
+        """
+        Get the shared bitmap and palette of a sprite variant, building it on a variant cache miss.
+        :param name:
+        :param pixel_shadow:
+        :param shadow_angle:
+        :param shadow_strength:
+        :param transparent_background:
+        :param background_color:
+        :param shadow_color:
+        :param color_shift: tint name registered with the palette bank, or (r, g, b) colour shift
+        :return: tuple of (bitmap, palette, tile_width, tile_height, default_tile)
+        """
+        key = self.variant_key(name, pixel_shadow, shadow_angle, shadow_strength, transparent_background,
+                               background_color, shadow_color, color_shift)
+        variant = self.variant_cache.get(key)
+        if variant is None:
+            variant = self.build_variant(name, pixel_shadow=pixel_shadow, shadow_angle=shadow_angle,
+                                         shadow_strength=shadow_strength,
+                                         transparent_background=transparent_background,
+                                         background_color=background_color, shadow_color=shadow_color,
+                                         color_shift=color_shift)
+            self.variant_cache.put(key, variant)
+        return variant
 
     def get_sprite(self, name, pixel_shadow=False, shadow_angle=135, shadow_strength=1, transparent_background=True,
                    background_color=0xffffff,
                    shadow_color=0x000000, color_shift=(0, 0, 0)):
         """
-        Get a sprite from the sprite sheet.
+        Get a sprite from the sprite sheet. The bitmap and palette for each variant are built once and shared through
+        the variant cache, only the TileGrid wrapper is new for every call.
         :param name:
         :param pixel_shadow:
         :param shadow_angle:
@@ -193,17 +1081,44 @@ class SpriteExtractor:
         :param color_shift:
         :return:
         """
-        column, row = self.sprite_matrix[name]
-        original_sprite = self.sprites[row][column]
+        bitmap, palette, tile_width, tile_height, default_tile = self.get_variant(
+            name, pixel_shadow=pixel_shadow, shadow_angle=shadow_angle, shadow_strength=shadow_strength,
+            transparent_background=transparent_background, background_color=background_color,
+            shadow_color=shadow_color, color_shift=color_shift)
+        return self.CustomTileGrid(bitmap, pixel_shader=palette,
+                                   width=1, height=1,
+                                   tile_width=tile_width, tile_height=tile_height,
+                                   default_tile=default_tile, icon=True)
 
-        # Define a new palette for the AI trolley to differentiate it
-        alternate_palette = display_palette(len(original_sprite.pixel_shader))
-        for i in range(len(alternate_palette)):
-            original_color = original_sprite.pixel_shader[i]
-            # Change the color slightly to differentiate the AI trolley
-            alternate_palette[i] = self.adjust_color(original_color, color_shift)
+    def build_variant(self, name, pixel_shadow=False, shadow_angle=135, shadow_strength=1,
+                      transparent_background=True, background_color=0xffffff, shadow_color=0x000000,
+                      color_shift=(0, 0, 0)):
+        """
+        Build the bitmap and palette for a sprite variant.
+        :param name:
+        :param pixel_shadow:
+        :param shadow_angle:
+        :param shadow_strength:
+        :param transparent_background:
+        :param background_color:
+        :param shadow_color:
+        :param color_shift:
+        :return: tuple of (bitmap, palette, tile_width, tile_height, default_tile)
+        """
+        column, row = self.sprite_matrix[name]
 
         if pixel_shadow:
+            # The shadow colour is the extra entry after the sprite sheet colours
+            combined_palette = self.palette_bank.get(color_shift, transparent_background=transparent_background,
+                                                     background_color=background_color, shadow_color=shadow_color)
+            num_colors = len(combined_palette)
+            shadow_color_index = num_colors - 1
+
+            # The default shadow is prebaked, so the variant is just a tile of the shadow atlas
+            if shadow_angle == self.atlas_shadow_angle and shadow_strength == self.atlas_shadow_strength:
+                return (self.shadow_atlas, combined_palette, self.atlas_cell_width, self.atlas_cell_height,
+                        self.tile_index(name))
+
             # Calculate shadow offsets based on the angle and strength (WiP) it works with basic shadows,
             # but not with adjustments to angles etc.
             shadow_offset_x = shadow_strength
@@ -218,26 +1133,12 @@ class SpriteExtractor:
             # Calculate new bitmap dimensions to accommodate both sprite and shadow
             expanded_width = self.sprite_width + abs(shadow_offset_x)
             expanded_height = self.sprite_height + abs(shadow_offset_y)
-
-            # Adjust the number of colors to include the shadow color
-            num_colors = len(alternate_palette) + 1
             combined_bitmap = display_bitmap(expanded_width, expanded_height, num_colors)
-            combined_palette = display_palette(num_colors)
-
-            # Copy original palette colors and add shadow color
-            for i in range(len(alternate_palette)):
-                combined_palette[i] = alternate_palette[i]
-            if transparent_background:
-                combined_palette.make_transparent(0)
-            else:
-                combined_palette[0] = background_color
-            shadow_color_index = len(alternate_palette)
-            combined_palette[shadow_color_index] = shadow_color
 
             # Iterate through the original sprite's pixels to draw it and its shadow
             for y in range(self.sprite_height):
                 for x in range(self.sprite_width):
-                    original_index = original_sprite.bitmap[
+                    original_index = self.sheet_bitmap[
                         (column * self.sprite_width) + x, (row * self.sprite_height) + y]
                     if original_index != 0:  # If the pixel is not transparent
                         # Draw the original sprite pixel
@@ -248,31 +1149,14 @@ class SpriteExtractor:
                         if 0 <= shadow_x < expanded_width and 0 <= shadow_y < expanded_height:
                             combined_bitmap[shadow_x, shadow_y] = shadow_color_index
 
-            new_sprite = self.CustomTileGrid(combined_bitmap, pixel_shader=combined_palette,
-                                             width=1, height=1,
-                                             tile_width=expanded_width, tile_height=expanded_height,
-                                             default_tile=0, icon=True)
-        else:
-            if transparent_background:
-                alternate_palette.make_transparent(0)
-                modified_palette = alternate_palette
-            else:
-                num_colors = len(alternate_palette)
-                modified_palette = display_palette(num_colors)
+            return combined_bitmap, combined_palette, expanded_width, expanded_height, 0
 
-                for i in range(len(alternate_palette)):
-                    modified_palette[i] = alternate_palette[i]
-                if transparent_background:
-                    modified_palette.make_transparent(0)
-                else:
-                    modified_palette[0] = background_color
+        alternate_palette = self.palette_bank.get(color_shift, transparent_background=transparent_background,
+                                                  background_color=background_color)
 
-            # Create a TileGrid using the original sprite's attributes if no shadow is needed
-            new_sprite = self.CustomTileGrid(original_sprite.bitmap, pixel_shader=modified_palette,
-                                             width=1, height=1,
-                                             tile_width=self.sprite_width, tile_height=self.sprite_height,
-                                             default_tile=(row * self.columns + column), icon=True)
-        return new_sprite
+        # Share the original sprite sheet bitmap if no shadow is needed
+        return (self.sheet_bitmap, alternate_palette, self.sprite_width, self.sprite_height,
+                self.tile_index(name))
 
 
-sprite_extractor = SpriteExtractor("../images/sprites.bmp", 16, 16, 6, 4)
+sprite_extractor = SpriteExtractor(SPRITE_SHEET, SPRITE_WIDTH, SPRITE_HEIGHT, COLUMNS, ROWS, sprite_pack=SPRITE_PACK)
@@ -1,4 +1,4 @@
-from adafruit_pybadger import pybadger
+from hal import badger as pybadger
 
 from utils.resource_manager import cleanup
 
@@ -1,17 +1,20 @@
-from time import monotonic
-
 from components.objects import (BackMenuItem, PressStartMenuItem, TrackSelectMenuItem, TrolleyShopMenuItem,
                                 TrolleyGarageMenuItem, UpgradeShopMenuItem, DifficultyMenuItemEasy,
                                 DifficultyMenuItemMedium, DifficultyMenuItemDifficult, DifficultyMenuItemInsane,
                                 TrolleyCrashMenuItem, TrolleyWinMenuItem,
                                 TrolleyLoseMenuItem, TrolleyDrawMenuItem)
-from utils.resource_manager import cleanup
+from utils.resource_manager import cleanup, memory_policy
 
 
 class BaseMenu:
+    visible_rows = 4  # Menu options on screen at once, one label each
+    overlay_labels = 1  # Labels shown over the rows at most, the notification or the race's pause or no trolley text
+
     def __init__(self, app, background_image=None):
         self.app = app
-        self.app.root_display.fade_screen('instant_out')
+        # The previous menu may still be fading out while this one is built
+        if self.app.root_display.transition is None:
+            self.app.root_display.fade_screen('instant_out')
         self.menu_tune = None
         self.selected_index = 0
         self.visible_start_index = 0  # First index of the visible menu items
@@ -59,11 +62,26 @@ class BaseMenu:
         self.notification_duration = 3  # Duration in seconds for which the notification is visible
         self.notification_min_duration = 0.1  # Minimum duration for the notification to be visible
 
+        # The background is loaded now but only shown once the menu is first shown, as the previous menu may still
+        # be on screen. The loaded image is kept until then, so showing it isn't a second cache lookup.
+        self.background_image = background_image
+        self.background_shown = False
+        self.background = None
         if background_image:
-            self.app.root_display.show_image(background_image)
+            self.background = self.app.root_display.background_cache.get(background_image)
 
         cleanup()
 
+    def show_background(self):
+        """
+        Put the menu background on screen, if it isn't already.
+        :return:
+        """
+        if self.background_image and not self.background_shown:
+            self.app.root_display.show_image(self.background_image, image=self.background)
+            self.background = None  # The cache decides how long the image stays loaded from now on
+            self.background_shown = True
+
     def show(self, previous_menu_items=None):
         """
         Display the menu on the screen.
@@ -72,11 +90,14 @@ class BaseMenu:
         """
         self.app.controls.input_enabled = False
         while True:
+            self.app.clock.tick()
+            self.app.root_display.update_transition()
+
             if self.check_inputs():
                 return
 
             # Update the scroll offset for the selected menu item
-            current_time = monotonic()
+            current_time = self.app.clock.monotonic()
             if current_time - self.last_scroll_time > 0.2:
                 self.scroll_offset += 1  # Move text one character to the left
                 self.last_scroll_time = current_time
@@ -88,7 +109,7 @@ class BaseMenu:
 
             # Generate the new set of visible menu options
             visible_options = self.menu_options[
-                              self.visible_start_index:self.visible_start_index + 4]
+                              self.visible_start_index:self.visible_start_index + self.visible_rows]
 
             # Assume a dictionary has been formed from these options
             options_dict = {option.menu_id: option for option in visible_options}
@@ -163,7 +184,7 @@ class BaseMenu:
                                                                                   label_y_position),
                                                                                  color=self.text_colour,
                                                                                  background_color=self.text_background_colour)
-                    self.app.root_display.main_display_group.append(self.labels[label_key])
+                    self.app.root_display.add(self.labels[label_key], 'hud')
 
                     if self.check_inputs():
                         return
@@ -177,15 +198,12 @@ class BaseMenu:
                             option.sprite.y = label_y_position - self.sprite_y_offset
                             self.sprites[sprite_key] = option.sprite
 
-                            self.app.root_display.main_display_group.append(self.sprites[sprite_key])
+                            self.app.root_display.add(self.sprites[sprite_key], 'actors')
 
                             if self.check_inputs():
                                 return
                 else:
-                    selected_item = self.labels[label_key]
-                    for index, item in enumerate(self.app.root_display.main_display_group):
-                        if item == selected_item:
-                            self.app.root_display.main_display_group[index].text = text
+                    self.labels[label_key].text = text
 
                 del option
                 cleanup()
@@ -198,7 +216,7 @@ class BaseMenu:
                 """Update the notification display (remove it if the duration has passed)."""
                 if self.notification_label is not None and self.notification_start_time is not None:
                     # Check if the notification duration has passed
-                    if monotonic() - self.notification_start_time > self.notification_duration:
+                    if self.app.clock.monotonic() - self.notification_start_time > self.notification_duration:
                         self.close_notification()
 
             if self.check_inputs():
@@ -206,11 +224,17 @@ class BaseMenu:
 
             if self.first_run:
                 self.first_run = False
-                self.app.root_display.fade_screen('in')
+                self.show_background()
+                self.app.root_display.start_fade('in')
                 if self.menu_tune:
+                    # Let the fade finish before the tune blocks the loop
+                    self.app.root_display.finish_transition()
                     self.app.audio_engine.play_tune(self.menu_tune)
 
             cleanup()
+            # The menus refresh automatically, nothing waits out the frame, so the spare time is checked here
+            memory_policy.idle_collect()
+            memory_policy.frame()
 
     def format_option(self, option, index, scroll=True, max_text_length=None):
         """
@@ -274,7 +298,7 @@ class BaseMenu:
             if self.on_select():
                 button_pressed = True
         if button_pressed:
-            if self.notification_showing and monotonic() - self.notification_start_time > self.notification_min_duration:
+            if self.notification_showing and self.app.clock.monotonic() - self.notification_start_time > self.notification_min_duration:
                 self.close_notification()
             return True
         else:
@@ -296,8 +320,8 @@ class BaseMenu:
                 self.notification_label = self.app.root_display.label_factory(text=message, pos=(10, 110),
                                                                               color=self.text_colour,
                                                                               background_color=self.text_background_colour)
-                self.app.root_display.main_display_group.append(self.notification_label)
-                self.notification_start_time = monotonic()
+                self.app.root_display.add(self.notification_label, 'overlay')
+                self.notification_start_time = self.app.clock.monotonic()
                 self.notification_showing = True
         else:
             pass
@@ -307,7 +331,7 @@ class BaseMenu:
         Close the current notification message.
         :return:
         """
-        self.app.root_display.main_display_group.remove(self.notification_label)
+        self.app.root_display.release_label(self.notification_label)
         self.notification_label = None
         self.notification_start_time = None
         self.notification_showing = False
@@ -320,15 +344,23 @@ class BaseMenu:
         :return:
         """
         for label in self.labels.values():
-            if label in self.app.root_display.main_display_group:
-                self.app.root_display.main_display_group.remove(label)
+            self.app.root_display.release_label(label)
         for sprite in self.sprites.values():
-            if sprite in self.app.root_display.main_display_group:
-                self.app.root_display.main_display_group.remove(sprite)
+            self.app.root_display.remove(sprite)
         self.labels.clear()
         self.sprites.clear()
         cleanup()
 
+    def cleanup_display(self):
+        """
+        Take everything the menu put on screen off it, and hand its labels back to the label pool, before the menu is
+        dropped.
+        :return:
+        """
+        if self.notification_label is not None:
+            self.close_notification()
+        self.cleanup_labels_sprites()
+
     def switch_menu(self, menu_name, fade=True):
         """
         Switch to a different menu.
@@ -337,7 +369,8 @@ class BaseMenu:
         :return:
         """
         if fade:
-            self.app.root_display.fade_screen('out')
+            # The fade runs while the next menu is built, see Application.menu_controller
+            self.app.root_display.start_fade('out')
         if menu_name.object_id == 'previous_menu':
             self.app.current_menu = self.previous_menu
         else:
@@ -400,7 +433,7 @@ class BaseMenu:
         # Rollover to the bottom if we reach the top
         if self.selected_index < 0:
             self.selected_index = len(self.menu_options) - 1
-            self.visible_start_index = max(0, len(self.menu_options) - 4)
+            self.visible_start_index = max(0, len(self.menu_options) - self.visible_rows)
 
         self.update_visible_start_index()
 
@@ -429,8 +462,8 @@ class BaseMenu:
         # Update visible start index if necessary (for scrolling the menu)
         if self.selected_index < self.visible_start_index:
             self.visible_start_index = self.selected_index
-        elif self.selected_index >= self.visible_start_index + 4:
-            self.visible_start_index = self.selected_index - 4 + 1
+        elif self.selected_index >= self.visible_start_index + self.visible_rows:
+            self.visible_start_index = self.selected_index - self.visible_rows + 1
         self.item_selection_changed = True
 
     def on_left(self):
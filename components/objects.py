@@ -26,6 +26,20 @@ class SpriteFunctions:
         self.sprite.x += dx
         self.sprite.y += dy
 
+    def set_object(self, object_id, x, y):
+        """
+        Turn the sprite into another object from the sprite sheet by swapping its tile, so it can be reused without
+        building a new sprite. Only valid between objects sharing the same shadow and palette settings.
+        :param object_id:
+        :param x:
+        :param y:
+        :return:
+        """
+        self.object_id = object_id
+        self.sprite[0] = sprite_extractor.tile_index(object_id)
+        self.sprite.x = x
+        self.sprite.y = y
+
     def remove(self, obstacles):
         """
         Remove the sprite from the obstacles list.
@@ -36,48 +50,66 @@ class SpriteFunctions:
 
 
 class Block(SpriteFunctions):
+    object_id = "block_1"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="block_1", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class Block2(SpriteFunctions):
+    object_id = "block_2"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="block_2", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class Block3(SpriteFunctions):
+    object_id = "block_3"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="block_3", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class Block4(SpriteFunctions):
+    object_id = "block_4"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="block_4", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class Block5(SpriteFunctions):
+    object_id = "block_5"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="block_5", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class WaterSpill(SpriteFunctions):
+    object_id = "water_spill_1"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="water_spill_1", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class Sign(SpriteFunctions):
+    object_id = "sign"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="sign", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class Person(SpriteFunctions):
+    object_id = "person"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="person", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class Money(SpriteFunctions):
+    object_id = "money"
+
     def __init__(self, **kwargs):
-        super().__init__(object_id="money", **kwargs)
+        super().__init__(object_id=self.object_id, **kwargs)
 
 
 class TrolleyObject(SpriteFunctions):
@@ -410,7 +442,17 @@ class SuspensionUpgrade(UpgradeObject):
     }
 
 
-class BackMenuItem:
+class MenuItem:
+    def __init__(self, **kwargs):
+        """
+        Menu items are created with the same sprite settings as the other menu options and have no use for them.
+        MicroPython ignores unexpected constructor arguments, CPython doesn't, so they are accepted explicitly.
+        :param kwargs:
+        """
+        pass
+
+
+class BackMenuItem(MenuItem):
     name = "Back"
     actions = ['switch_menu']
     object_id = 'previous_menu'
@@ -418,7 +460,7 @@ class BackMenuItem:
     menu_id = 1
 
 
-class PressStartMenuItem:
+class PressStartMenuItem(MenuItem):
     name = "Press Start"
     actions = ['switch_menu']
     object_id = 'main'
@@ -426,7 +468,7 @@ class PressStartMenuItem:
     menu_id = 2
 
 
-class TrackSelectMenuItem:
+class TrackSelectMenuItem(MenuItem):
     name = "Track Select"
     actions = ['switch_menu']
     object_id = 'track_select'
@@ -434,7 +476,7 @@ class TrackSelectMenuItem:
     menu_id = 3
 
 
-class TrolleyShopMenuItem:
+class TrolleyShopMenuItem(MenuItem):
     name = "Trolley Shop"
     actions = ['switch_menu']
     object_id = 'trolley_shop'
@@ -442,7 +484,7 @@ class TrolleyShopMenuItem:
     menu_id = 4
 
 
-class TrolleyGarageMenuItem:
+class TrolleyGarageMenuItem(MenuItem):
     name = "Trolley Garage"
     actions = ['switch_menu']
     object_id = 'garage'
@@ -450,7 +492,7 @@ class TrolleyGarageMenuItem:
     menu_id = 5
 
 
-class UpgradeShopMenuItem:
+class UpgradeShopMenuItem(MenuItem):
     name = "Upgrade Shop"
     actions = ['switch_menu']
     object_id = 'trolley_upgrades'
@@ -458,7 +500,7 @@ class UpgradeShopMenuItem:
     menu_id = 6
 
 
-class DifficultyMenuItemEasy:
+class DifficultyMenuItemEasy(MenuItem):
     actions = ['switch_menu', "change_difficulty"]
     object_id = 'race'
     difficulty = 'easy'
@@ -467,7 +509,7 @@ class DifficultyMenuItemEasy:
     menu_id = 7
 
 
-class DifficultyMenuItemMedium:
+class DifficultyMenuItemMedium(MenuItem):
     actions = ['switch_menu', "change_difficulty"]
     object_id = 'race'
     difficulty = 'medium'
@@ -476,7 +518,7 @@ class DifficultyMenuItemMedium:
     menu_id = 8
 
 
-class DifficultyMenuItemDifficult:
+class DifficultyMenuItemDifficult(MenuItem):
     actions = ['switch_menu', "change_difficulty"]
     object_id = 'race'
     difficulty = 'difficult'
@@ -485,7 +527,7 @@ class DifficultyMenuItemDifficult:
     menu_id = 9
 
 
-class DifficultyMenuItemInsane:
+class DifficultyMenuItemInsane(MenuItem):
     actions = ['switch_menu', "change_difficulty"]
     object_id = 'race'
     difficulty = 'insane'
@@ -494,7 +536,7 @@ class DifficultyMenuItemInsane:
     menu_id = 10
 
 
-class TrolleyMovetoCrashMenuItem:
+class TrolleyMovetoCrashMenuItem(MenuItem):
     name = None
     actions = ['switch_menu']
     object_id = 'crash_menu'
@@ -502,7 +544,7 @@ class TrolleyMovetoCrashMenuItem:
     menu_id = 12
 
 
-class TrolleyCrashMenuItem:
+class TrolleyCrashMenuItem(MenuItem):
     actions = ['switch_menu']
     object_id = 'main'
 
@@ -512,7 +554,7 @@ class TrolleyCrashMenuItem:
         self.name = f"You crashed! Repairs cost ${kwargs['previous_menu_items']['repair_cost']}"
 
 
-class TrolleyMovetoWinMenuItem:
+class TrolleyMovetoWinMenuItem(MenuItem):
     name = None
     actions = ['switch_menu']
     object_id = 'win_menu'
@@ -520,7 +562,7 @@ class TrolleyMovetoWinMenuItem:
     menu_id = 14
 
 
-class TrolleyWinMenuItem:
+class TrolleyWinMenuItem(MenuItem):
     actions = ['switch_menu']
     object_id = 'main'
 
@@ -530,7 +572,7 @@ class TrolleyWinMenuItem:
         self.name = f"You win! Prize money: ${kwargs['previous_menu_items']['reward']}"
 
 
-class TrolleyMovetoLoseMenuItem:
+class TrolleyMovetoLoseMenuItem(MenuItem):
     name = None
     actions = ['switch_menu']
     object_id = 'lose_menu'
@@ -538,7 +580,7 @@ class TrolleyMovetoLoseMenuItem:
     menu_id = 31
 
 
-class TrolleyLoseMenuItem:
+class TrolleyLoseMenuItem(MenuItem):
     actions = ['switch_menu']
     object_id = 'main'
 
@@ -548,7 +590,7 @@ class TrolleyLoseMenuItem:
         self.name = f"You lost! Better luck next time!"
 
 
-class TrolleyMovetoDrawMenuItem:
+class TrolleyMovetoDrawMenuItem(MenuItem):
     name = None
     actions = ['switch_menu']
     object_id = 'draw_menu'
@@ -556,7 +598,7 @@ class TrolleyMovetoDrawMenuItem:
     menu_id = 31
 
 
-class TrolleyDrawMenuItem:
+class TrolleyDrawMenuItem(MenuItem):
     actions = ['switch_menu']
     object_id = 'main'
 
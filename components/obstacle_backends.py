@@ -0,0 +1,134 @@
+from hal import numpy
+
+"""Backends for the obstacle area queries and off-screen culling of the TrackGenerator, the per-step work that collision
+detection and the AI perception run on. Both give identical results, slots in ascending order, so they can be swapped
+and benchmarked against each other:
+    PythonObstacleBackend   binary searches the track's sorted obstacles and loops over the band of rows an area covers
+    VectorObstacleBackend   tests every slot at once with a few ulab.numpy operations (NumPy on the host)
+
+Scrolling needs no work from either, obstacle positions are stored relative to the track's scroll offset."""
+
+
+class PythonObstacleBackend:
+    """
+    Plain Python loops over the track's obstacle columns.
+    """
+    name = 'python'
+
+    def __init__(self, track):
+        self.track = track
+
+    def place(self, slot):
+        """
+        Start tracking the obstacle in a slot, once its columns have been written.
+        :param slot:
+        :return:
+        """
+
+    def remove(self, slot):
+        """
+        Stop tracking the obstacle in a slot.
+        :param slot:
+        :return:
+        """
+
+    def query(self, x, y, width, height):
+        """
+        Get the slots of the obstacles overlapping an area of the track, only visiting the obstacles in the band of
+        rows it covers.
+        :param x:
+        :param y:
+        :param width:
+        :param height:
+        :return:
+        """
+        track = self.track
+        found = []
+        right = x + width
+        size = track.obstacle_size
+        obstacles = track.obstacles
+        obstacle_x = track.obstacle_x
+        obstacle_track_y = track.obstacle_track_y
+        end = y + height - track.scroll
+        # Every obstacle from the start of the band down to its end overlaps the area vertically
+        for i in range(track.position(y - size + 1 - track.scroll), len(obstacles)):
+            slot = obstacles[i]
+            if obstacle_track_y[slot] >= end:
+                break
+            if x < obstacle_x[slot] + size and right > obstacle_x[slot]:
+                found.append(slot)
+        found.sort()
+        return found
+
+    def count_offscreen(self, limit):
+        """
+        Count the obstacles past a track position, walking up from the lowest one.
+        :param limit:
+        :return:
+        """
+        obstacles = self.track.obstacles
+        obstacle_track_y = self.track.obstacle_track_y
+        count = 0
+        while count < len(obstacles) and obstacle_track_y[obstacles[-1 - count]] > limit:
+            count += 1
+        return count
+
+
+class VectorObstacleBackend:
+    """
+    Whole-array tests on a copy of the obstacle positions, written when an obstacle spawns. ulab has no 32 bit
+    integers, track positions are kept as floats, which hold every position a race can reach exactly.
+    """
+    name = 'vector'
+
+    def __init__(self, track):
+        if numpy is None:
+            raise ImportError("The vector obstacle backend needs ulab on the device or NumPy on the host.")
+        size = track.max_obstacles
+        float_type = getattr(numpy, 'float32', None) or numpy.float
+        self.track = track
+        self.slots = numpy.array(range(size), dtype=numpy.uint8)
+        self.x = numpy.zeros(size, dtype=numpy.int16)
+        self.track_y = numpy.zeros(size, dtype=float_type)
+        self.active = numpy.zeros(size, dtype=numpy.bool)
+
+    def place(self, slot):
+        """
+        Start tracking the obstacle in a slot, once its columns have been written.
+        :param slot:
+        :return:
+        """
+        self.x[slot] = self.track.obstacle_x[slot]
+        self.track_y[slot] = self.track.obstacle_track_y[slot]
+        self.active[slot] = True
+
+    def remove(self, slot):
+        """
+        Stop tracking the obstacle in a slot.
+        :param slot:
+        :return:
+        """
+        self.active[slot] = False
+
+    def query(self, x, y, width, height):
+        """
+        Get the slots of the obstacles overlapping an area of the track, testing every slot at once.
+        :param x:
+        :param y:
+        :param width:
+        :param height:
+        :return:
+        """
+        size = self.track.obstacle_size
+        scroll = self.track.scroll
+        mask = (self.active & (self.x < x + width) & (self.x > x - size) &
+                (self.track_y < y + height - scroll) & (self.track_y > y - size - scroll))
+        return [int(slot) for slot in self.slots[mask]]
+
+    def count_offscreen(self, limit):
+        """
+        Count the obstacles past a track position.
+        :param limit:
+        :return:
+        """
+        return int(numpy.sum(self.active & (self.track_y > limit)))
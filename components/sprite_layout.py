@@ -0,0 +1,97 @@
+"""Layout of the sprite sheet in images/sprites.bmp, along with the colour shift and shadow atlas drawing shared by the
+game and the asset pack. Kept free of hardware imports so the host side asset compiler can use it as well as the
+game."""
+
+SPRITE_SHEET = "../images/sprites.bmp"
+SPRITE_PACK = "../images/sprites.pack"
+
+SPRITE_WIDTH = 16
+SPRITE_HEIGHT = 16
+COLUMNS = 6
+ROWS = 4
+
+# Shadow settings baked into the shadow atlas
+ATLAS_SHADOW_ANGLE = 135
+ATLAS_SHADOW_STRENGTH = 1
+
+# Named colour shifts registered with the palette bank, 'none' is the unshifted palette
+TINTS = {
+    "none": (0, 0, 0),
+    "ai_red": (255, 0, 0),
+}
+
+# Colour shifts prebuilt into the asset pack, every registered tint
+PACK_COLOR_SHIFTS = list(TINTS.values())
+
+# x, y position of each sprite in the sprite sheet
+SPRITE_MATRIX = {
+    "trolley_basic": (0, 0),
+    "trolley_better": (0, 1),
+    "trolley_big": (0, 2),
+    "trolley_super": (0, 3),
+    "block_1": (1, 0),
+    "money": (1, 1),
+    "carbon_fibre_frame": (1, 2),
+    "turbo_upgrade": (1, 3),
+    "water_spill_1": (2, 0),
+    "carbon_fibre_wheels": (2, 1),
+    "nitrous_oxide": (2, 2),
+    "air_filter_upgrade": (2, 3),
+    "sign": (3, 0),
+    "racing_handle": (3, 1),
+    "brake_upgrade": (3, 2),
+    "computer_chip_upgrade": (3, 3),
+    "person": (4, 0),
+    "scanning_computer": (4, 1),
+    "exhaust_upgrade": (4, 2),
+    "suspension_upgrade": (4, 3),
+    "block_2": (5, 0),
+    "block_3": (5, 1),
+    "block_4": (5, 2),
+    "block_5": (5, 3),
+}
+
+
+def adjust_color(color, offset):
+    """
+    Shift a 0xRRGGBB colour by an (r, g, b) offset, clamping every component.
+    :param color:
+    :param offset:
+    :return:
+    """
+    r = max(0, min(255, ((color >> 16) & 0xFF) + offset[0]))
+    g = max(0, min(255, ((color >> 8) & 0xFF) + offset[1]))
+    b = max(0, min(255, (color & 0xFF) + offset[2]))
+    return (r << 16) | (g << 8) | b
+
+
+def draw_shadow_atlas(sprite_sheet, atlas, shadow_color_index, shadow_strength, sprite_matrix=SPRITE_MATRIX,
+                      sprite_width=SPRITE_WIDTH, sprite_height=SPRITE_HEIGHT):
+    """
+    Draw every sprite of the sprite matrix into its cell of the shadow atlas with the drop shadow under it. Each cell
+    is the sprite expanded by the shadow strength. Both bitmaps are indexed by (x, y), so the game draws into a
+    displayio Bitmap and the asset compiler into a host Bitmap with the same pixels.
+    :param sprite_sheet:
+    :param atlas:
+    :param shadow_color_index:
+    :param shadow_strength:
+    :param sprite_matrix:
+    :param sprite_width:
+    :param sprite_height:
+    :return:
+    """
+    cell_width = sprite_width + shadow_strength
+    cell_height = sprite_height + shadow_strength
+
+    for column, row in sprite_matrix.values():
+        source_x = column * sprite_width
+        source_y = row * sprite_height
+        cell_x = column * cell_width
+        cell_y = row * cell_height
+        # Same drawing order as the per-variant shadow, so the sprite always ends up on top of its shadow
+        for y in range(sprite_height):
+            for x in range(sprite_width):
+                original_index = sprite_sheet[source_x + x, source_y + y]
+                if original_index != 0:
+                    atlas[cell_x + x, cell_y + y] = original_index
+                    atlas[cell_x + x + shadow_strength, cell_y + y + shadow_strength] = shadow_color_index
@@ -3,23 +3,26 @@ from components.controls import Controls
 from components.engine import PlayerStats, RaceEngine
 from components.graphics import Display
 from components.leds import LEDController
-from components.menus import (IntroMenu, MainMenu, TrolleyShopMenu, GarageMenu, TrolleyUpgradesMenu, TrackMenu,
-                              CrashMenu, WinMenu, LoseMenu, DrawMenu)
+from components.menus import (BaseMenu, IntroMenu, MainMenu, TrolleyShopMenu, GarageMenu, TrolleyUpgradesMenu,
+                              TrackMenu, CrashMenu, WinMenu, LoseMenu, DrawMenu)
 
-from utils.resource_manager import cleanup
+from utils.clock import RealClock
+from utils.resource_manager import cleanup, record_heap
 
 
 class Application:
-    def __init__(self):
+    def __init__(self, clock=None):
         self.current_menu = 'intro'
         self.last_menu = None  # No last menu to start with
         self.menu_passthrough = None  # Used to pass data between menus
 
-        self.root_display = Display()
+        self.clock = clock or RealClock()  # Where the components read the time from
+        # Enough pooled labels for a page of menu rows and the labels shown over them
+        self.root_display = Display(self.clock, label_pool_size=BaseMenu.visible_rows + BaseMenu.overlay_labels)
         self.player_stats = PlayerStats()
-        self.controls = Controls()
+        self.controls = Controls(self.clock)
         self.led_controller = LEDController(led_count=5, brightness=0.01)
-        self.audio_engine = AudioEngine()
+        self.audio_engine = AudioEngine(self.clock)
 
         # We'll store class references instead of instances
         self.menu_classes = {
@@ -46,27 +49,49 @@ class Application:
             # Check if the current menu is instantiated; if not, instantiate it
             if self.current_menu not in self.menus:
                 self.menus[self.current_menu] = self.menu_classes[self.current_menu](self)
+                record_heap('menu_build', self.current_menu)
 
             # Show the current menu
-            self.menu_passthrough = self.menus[self.current_menu].show(self.menu_passthrough)
+            shown_menu = self.current_menu
+            self.menu_passthrough = self.menus[shown_menu].show(self.menu_passthrough)
 
             # Check if the current menu has changed after showing the menu (e.g., if an action in the menu changed
             # the current_menu)
-            if self.current_menu != self.last_menu:
-                # Clear resources related to the last menu
-                if self.last_menu and self.last_menu in self.menus:
-                    self.menus[self.last_menu].cleanup_labels_sprites()
-                    del self.menus[self.last_menu]  # Remove the instance from the dictionary
+            if self.current_menu != shown_menu:
+                # Build the next menu while the last one fades out, then wait for the fade to finish
+                if self.current_menu not in self.menus:
+                    self.menus[self.current_menu] = self.menu_classes[self.current_menu](self)
+                    record_heap('menu_build', self.current_menu)
+                self.root_display.finish_transition()
 
-                # Update the last menu to the current one after processing
-                self.last_menu = self.current_menu
+                # Clear resources related to the menu just shown, its labels go back to the pool one by one as the
+                # next menu may already hold some
+                self.menus[shown_menu].cleanup_display()
+                del self.menus[shown_menu]  # Remove the instance from the dictionary
+
+                # Remember the menu that was left
+                self.last_menu = shown_menu
 
                 # Clear the display for the new menu
                 self.root_display.clear_main_display_group()
 
                 cleanup()
+                record_heap('menu_switch', self.current_menu)
+
+    def close(self):
+        """
+        Let go of what the application registered outside of itself, for host tools that run more than one
+        application in a process. The device never closes it.
+        :return:
+        """
+        self.root_display.close()
 
 
-cleanup()
-app = Application()
-app.menu_controller()
+def run():
+    """
+    Boot the game and hand over to the menu controller, never returns on the device.
+    :return:
+    """
+    cleanup()
+    app = Application()
+    app.menu_controller()
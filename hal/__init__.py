@@ -0,0 +1,15 @@
+from sys import implementation
+
+"""Hardware abstraction layer. Components import displayio, the display, the font, image loading, the PyBadge, the
+heap functions and ulab.numpy (as numpy, None where it isn't available) from here instead of from the CircuitPython
+modules directly, so the game can also be imported and run on a normal computer. On the PyBadge the device backend
+re-exports the real CircuitPython modules, everywhere else the host backend provides pure Python stand-ins for them."""
+
+if implementation.name == 'circuitpython':
+    from hal.device import (BACKEND, Bitmap, Palette, TileGrid, Group, OnDiskBitmap, arrayblit, imageload, display,
+                            font, Label, BitmapLabel, badger, collect, largest_free_block, mem_free, numpy,
+                            resource_path)
+else:
+    from hal.host import (BACKEND, Bitmap, Palette, TileGrid, Group, OnDiskBitmap, arrayblit, imageload, display,
+                          font, Label, BitmapLabel, badger, collect, largest_free_block, mem_free, numpy,
+                          resource_path)
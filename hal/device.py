@@ -0,0 +1,37 @@
+from adafruit_display_text.bitmap_label import Label as BitmapLabel
+from adafruit_display_text.label import Label
+from adafruit_imageload import load as imageload
+from adafruit_pybadger import pybadger as badger
+from bitmaptools import arrayblit
+from board import DISPLAY as display
+from displayio import Bitmap, Group, OnDiskBitmap, Palette, TileGrid
+from gc import collect, mem_free
+from terminalio import FONT as font
+
+try:
+    from ulab import numpy
+except ImportError:
+    numpy = None
+
+"""Device backend of the hardware abstraction layer, the real CircuitPython modules of the PyBadge. numpy is
+ulab.numpy, or None on builds without ulab."""
+
+BACKEND = 'device'
+
+
+def largest_free_block():
+    """
+    Get the size of the largest free block of heap. CircuitPython only prints the heap layout, through
+    micropython.mem_info, it has no way to read it back.
+    :return: None, it isn't known
+    """
+    return None
+
+
+def resource_path(path):
+    """
+    Get the path to open a file shipped with the game, paths are used as they are on the device.
+    :param path:
+    :return:
+    """
+    return path
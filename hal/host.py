@@ -0,0 +1,539 @@
+from gc import collect
+from os import path as os_path
+from struct import unpack_from
+from time import monotonic, sleep
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""Host backend of the hardware abstraction layer. Pure Python stand-ins for the CircuitPython modules used by the
+game, so the whole Application can be imported, booted and run headless on a normal computer for profiling and
+benchmarking:
+    displayio       Bitmap, Palette, TileGrid, Group and OnDiskBitmap modelled in memory, nothing is drawn
+    board.DISPLAY   a display that counts refreshes and keeps the brightness, root group and auto refresh settings
+    pybadger        a button register that can be pressed from code, a tone sink and a NeoPixel buffer
+    gc.mem_free     a fixed size heap, less whatever tracemalloc has traced when it is running
+    ulab.numpy      NumPy, when it is installed
+Image paths are resolved against the root of the repository, the way they resolve against the root of the
+CIRCUITPY drive on the device."""
+
+BACKEND = 'host'
+
+ROOT_DIR = os_path.dirname(os_path.dirname(os_path.abspath(__file__)))
+
+HEAP_SIZE = 131072  # Bytes of heap reported free by mem_free, roughly what the game has to work with on the PyBadge
+
+BUTTON_NAMES = ('up', 'down', 'left', 'right', 'a', 'b', 'start', 'select')
+
+
+class HostExit(Exception):
+    """
+    Raised from the next button read once exit has been requested, to stop the game loops of a headless run.
+    """
+
+
+def resource_path(path):
+    """
+    Get the path to open a file shipped with the game. On the device files are opened relative to the root of the
+    drive, so '../images/a.bmp', '/images/a.bmp' and 'images/a.bmp' are the same file, here they are resolved from
+    the repository. Absolute paths outside of what the repository ships, such as a path already resolved here or a
+    file elsewhere on the computer, are left as they are.
+    :param path:
+    :return:
+    """
+    if path.startswith('/'):
+        if not os_path.exists(os_path.join(ROOT_DIR, path.split('/')[1])):
+            return path
+        path = path[1:]
+    while path.startswith('../'):
+        path = path[3:]
+    return os_path.join(ROOT_DIR, path)
+
+
+def mem_free():
+    """
+    Get the number of bytes of free heap. Only memory traced by tracemalloc counts as used, so start tracemalloc to
+    get meaningful numbers.
+    :return:
+    """
+    import tracemalloc
+
+    if tracemalloc.is_tracing():
+        return max(0, HEAP_SIZE - tracemalloc.get_traced_memory()[0])
+    return HEAP_SIZE
+
+
+def largest_free_block():
+    """
+    Get the size of the largest free block of heap. The host heap isn't a fixed block of memory, so there is none.
+    :return: None, it isn't known
+    """
+    return None
+
+
+def read_bmp(path):
+    """
+    Read an uncompressed, indexed (1, 4 or 8 bit) BMP file.
+    :param path:
+    :return: tuple of (width, height, pixels as a bytearray with one byte per pixel, list of 0xRRGGBB colours)
+    """
+    with open(path, "rb") as bmp_file:
+        data = bmp_file.read()
+
+    if data[:2] != b"BM":
+        raise ValueError(f"'{path}' is not a BMP file.")
+
+    pixel_offset = unpack_from("<I", data, 10)[0]
+    header_size = unpack_from("<I", data, 14)[0]
+    width, height, _, bits_per_pixel, compression = unpack_from("<iiHHI", data, 18)
+    colors_used = unpack_from("<I", data, 46)[0]
+
+    if compression != 0 or bits_per_pixel not in (1, 4, 8):
+        raise ValueError(f"'{path}' must be an uncompressed 1, 4 or 8 bit indexed BMP.")
+
+    palette_size = colors_used or (1 << bits_per_pixel)
+    palette_offset = 14 + header_size
+    palette = []
+    for i in range(palette_size):
+        blue, green, red = data[palette_offset + i * 4:palette_offset + i * 4 + 3]
+        palette.append((red << 16) | (green << 8) | blue)
+
+    # Rows are stored bottom up unless the height is negative, and padded to 4 bytes
+    top_down = height < 0
+    height = abs(height)
+    stride = ((width * bits_per_pixel + 31) // 32) * 4
+    pixels_per_byte = 8 // bits_per_pixel
+    mask = (1 << bits_per_pixel) - 1
+
+    pixels = bytearray(width * height)
+    for y in range(height):
+        row_start = pixel_offset + (y if top_down else height - 1 - y) * stride
+        if bits_per_pixel == 8:
+            pixels[y * width:(y + 1) * width] = data[row_start:row_start + width]
+            continue
+        for x in range(width):
+            byte = data[row_start + x // pixels_per_byte]
+            shift = (pixels_per_byte - 1 - x % pixels_per_byte) * bits_per_pixel
+            pixels[y * width + x] = (byte >> shift) & mask
+
+    return width, height, pixels, palette
+
+
+class Bitmap:
+    def __init__(self, width, height, value_count):
+        self.width = width
+        self.height = height
+        self.value_count = value_count
+        self.pixels = bytearray(width * height) if value_count <= 256 else [0] * (width * height)
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            return self.pixels[index[1] * self.width + index[0]]
+        return self.pixels[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, tuple):
+            self.pixels[index[1] * self.width + index[0]] = value
+        else:
+            self.pixels[index] = value
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def fill(self, value):
+        """
+        Set every pixel to the same value.
+        :param value:
+        :return:
+        """
+        if isinstance(self.pixels, bytearray):
+            self.pixels[:] = bytes([value]) * len(self.pixels)
+        else:
+            self.pixels[:] = [value] * len(self.pixels)
+
+    def dirty(self, x1=0, y1=0, x2=-1, y2=-1):
+        """
+        Mark an area as changed, there is nothing to redraw on the host.
+        :return:
+        """
+
+
+class Palette:
+    def __init__(self, color_count):
+        self.colors = [0] * color_count
+        self.transparent = [False] * color_count
+
+    def __len__(self):
+        return len(self.colors)
+
+    def __getitem__(self, index):
+        return self.colors[index]
+
+    def __setitem__(self, index, color):
+        if isinstance(color, (bytes, bytearray, tuple, list)):
+            color = (color[0] << 16) | (color[1] << 8) | color[2]
+        self.colors[index] = color
+
+    def make_transparent(self, index):
+        self.transparent[index] = True
+
+    def make_opaque(self, index):
+        self.transparent[index] = False
+
+    def is_transparent(self, index):
+        return self.transparent[index]
+
+
+class TileGrid:
+    def __init__(self, bitmap, *, pixel_shader, width=1, height=1, tile_width=None, tile_height=None, default_tile=0,
+                 x=0, y=0):
+        self.bitmap = bitmap
+        self.pixel_shader = pixel_shader
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width or bitmap.width
+        self.tile_height = tile_height or bitmap.height
+        self.tiles = [default_tile] * (width * height)
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self.flip_x = False
+        self.flip_y = False
+        self.transpose_xy = False
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        return self.tiles[index]
+
+    def __setitem__(self, index, tile):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        self.tiles[index] = tile
+
+
+class Group:
+    def __init__(self, *, scale=1, x=0, y=0):
+        self.scale = scale
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self.layers = []
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, index):
+        return self.layers[index]
+
+    def __setitem__(self, index, layer):
+        self.layers[index] = layer
+
+    def __delitem__(self, index):
+        del self.layers[index]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def __contains__(self, layer):
+        return any(existing is layer for existing in self.layers)
+
+    def append(self, layer):
+        self.layers.append(layer)
+
+    def insert(self, index, layer):
+        self.layers.insert(index, layer)
+
+    def index(self, layer):
+        for i, existing in enumerate(self.layers):
+            if existing is layer:
+                return i
+        raise ValueError("object not in group")
+
+    def pop(self, index=-1):
+        return self.layers.pop(index)
+
+    def remove(self, layer):
+        del self.layers[self.index(layer)]
+
+
+class OnDiskBitmap(Bitmap):
+    """
+    The whole image is read into memory on the host, there is no slow storage to stream it from.
+    """
+
+    def __init__(self, file):
+        width, height, pixels, colors = read_bmp(file if isinstance(file, str) else file.name)
+        super().__init__(width, height, len(colors))
+        self.pixels[:] = pixels
+        self.pixel_shader = Palette(len(colors))
+        for i, color in enumerate(colors):
+            self.pixel_shader[i] = color
+
+
+def arrayblit(bitmap, data, x1=0, y1=0, x2=None, y2=None, skip_index=None):
+    """
+    Copy a buffer of pixel values into a rectangle of a bitmap, one row after the other.
+    :param bitmap:
+    :param data:
+    :param x1:
+    :param y1:
+    :param x2:
+    :param y2:
+    :param skip_index: pixel value left untouched in the bitmap
+    :return:
+    """
+    x2 = bitmap.width if x2 is None else x2
+    y2 = bitmap.height if y2 is None else y2
+    row_width = x2 - x1
+    for row in range(y2 - y1):
+        start = (y1 + row) * bitmap.width + x1
+        source = data[row * row_width:(row + 1) * row_width]
+        if skip_index is None:
+            bitmap.pixels[start:start + row_width] = source
+        else:
+            for x, value in enumerate(source):
+                if value != skip_index:
+                    bitmap.pixels[start + x] = value
+
+
+def imageload(file, *, bitmap=None, palette=None):
+    """
+    Decode an indexed BMP into a bitmap and palette, like adafruit_imageload.load.
+    :param file:
+    :param bitmap: bitmap class to create
+    :param palette: palette class to create
+    :return: tuple of (bitmap, palette)
+    """
+    width, height, pixels, colors = read_bmp(file)
+    image = (bitmap or Bitmap)(width, height, len(colors))
+    arrayblit(image, pixels)
+    image_palette = (palette or Palette)(len(colors))
+    for i, color in enumerate(colors):
+        image_palette[i] = color
+    return image, image_palette
+
+
+class HostDisplay:
+    """
+    The 160x128 PyBadge display. Refreshes are counted, and drawn by the rasterizer when one is attached, see
+    hal/raster.py.
+    """
+
+    def __init__(self, width=160, height=128):
+        self.width = width
+        self.height = height
+        self.brightness = 1.0
+        self.auto_refresh = True
+        self.root_group = None
+        self.refreshes = 0
+        self.rasterizer = None
+        self.on_frame = None  # Called with the stats of every rasterized frame
+        self.clock = monotonic  # Times the auto refresh, see use_clock
+        self.auto_refresh_interval = 1 / 60
+        self.last_refresh_time = 0
+
+    def refresh(self, *, target_frames_per_second=None, minimum_frames_per_second=0):
+        """
+        Count a refresh of the display, and draw it if there is a rasterizer.
+        :param target_frames_per_second:
+        :param minimum_frames_per_second:
+        :return:
+        """
+        self.refreshes += 1
+        self.last_refresh_time = self.clock()
+        if self.rasterizer is not None:
+            stats = self.rasterizer.render(self.root_group)
+            if self.on_frame:
+                self.on_frame(stats)
+        return True
+
+    def poll(self):
+        """
+        Stand in for the background refresh of the device while auto refresh is on, called from the game loops
+        through the button register.
+        :return:
+        """
+        if self.auto_refresh and self.clock() - self.last_refresh_time >= self.auto_refresh_interval:
+            self.refresh()
+
+
+class HostFont:
+    """
+    Metrics of the built in 6x12 terminalio font.
+    """
+
+    def get_bounding_box(self):
+        return 6, 12, 0, 0
+
+
+class Label:
+    def __init__(self, font, *, text="", color=0xFFFFFF, background_color=None, x=0, y=0, scale=1, **kwargs):
+        self.font = font
+        self.text = text
+        self.color = color
+        self.background_color = background_color
+        self.x = x
+        self.y = y
+        self.scale = scale
+        self.line_spacing = kwargs.get('line_spacing', 1.25)
+        self.hidden = False
+        self.anchor_point = kwargs.get('anchor_point')
+        self.anchored_position = kwargs.get('anchored_position')
+
+    @property
+    def width(self):
+        return max(len(line) for line in self.text.split("\n")) * self.font.get_bounding_box()[0] * self.scale
+
+    @property
+    def height(self):
+        glyph_height = self.font.get_bounding_box()[1]
+        return (int(glyph_height * self.line_spacing) * self.text.count("\n") + glyph_height) * self.scale
+
+
+class BitmapLabel(Label):
+    pass
+
+
+class ButtonRegister:
+    """
+    The PyBadge buttons as a bit mask, one bit per button in BUTTON_NAMES order, that can be pressed and released
+    from code.
+    """
+
+    def __init__(self):
+        self.mask = 0
+        self.exit_requested = False
+        self.on_poll = None  # Called on every button read, the game loops read the buttons every tick
+
+    def __getattr__(self, name):
+        if name not in BUTTON_NAMES:
+            raise AttributeError(name)
+        if self.exit_requested:
+            raise HostExit()
+        if self.on_poll:
+            self.on_poll()
+        return bool((self.mask >> BUTTON_NAMES.index(name)) & 1)
+
+    def press(self, name):
+        """
+        Hold a button down.
+        :param name:
+        :return:
+        """
+        self.mask |= 1 << BUTTON_NAMES.index(name)
+
+    def release(self, name):
+        """
+        Let go of a button.
+        :param name:
+        :return:
+        """
+        self.mask &= ~(1 << BUTTON_NAMES.index(name))
+
+
+class PixelBuffer:
+    """
+    The NeoPixels of the PyBadge, colours are kept and every show is counted.
+    """
+
+    def __init__(self, count=5):
+        self.colors = [(0, 0, 0)] * count
+        self.brightness = 1.0
+        self.shows = 0
+
+    def __len__(self):
+        return len(self.colors)
+
+    def __getitem__(self, index):
+        return self.colors[index]
+
+    def __setitem__(self, index, color):
+        self.colors[index] = color
+
+    def fill(self, color):
+        self.colors = [color] * len(self.colors)
+
+    def show(self):
+        self.shows += 1
+
+
+class ToneSink:
+    """
+    Records the tones played instead of playing them, and only waits for them when realtime is set. Tones started
+    and stopped are timed with the clock function, which a headless run can point at a simulated clock.
+    """
+
+    def __init__(self, history=64, realtime=False):
+        self.history = history
+        self.realtime = realtime
+        self.clock = monotonic
+        self.tones = []  # The last tones played, as (frequency, duration)
+        self.tone_time = 0.0  # Seconds of tones played in total
+        self.current_frequency = None
+        self.tone_start_time = 0.0
+
+    def record(self, frequency, duration):
+        self.tones.append((frequency, duration))
+        if len(self.tones) > self.history:
+            self.tones.pop(0)
+        self.tone_time += duration
+
+    def play_tone(self, frequency, duration):
+        self.record(frequency, duration)
+        if self.realtime:
+            sleep(duration)
+
+    def start_tone(self, frequency):
+        self.current_frequency = frequency
+        self.tone_start_time = self.clock()
+
+    def stop_tone(self):
+        if self.current_frequency is not None:
+            self.record(self.current_frequency, self.clock() - self.tone_start_time)
+        self.current_frequency = None
+
+
+class HostBadger:
+    """
+    Stands in for adafruit_pybadger.pybadger.
+    """
+
+    def __init__(self):
+        self.button = ButtonRegister()
+        self.pixels = PixelBuffer()
+        self.speaker = ToneSink()
+
+    def play_tone(self, frequency, duration):
+        self.speaker.play_tone(frequency, duration)
+
+    def start_tone(self, frequency):
+        self.speaker.start_tone(frequency)
+
+    def stop_tone(self):
+        self.speaker.stop_tone()
+
+    def request_exit(self):
+        """
+        Make the next button read raise HostExit, which ends a headless run.
+        :return:
+        """
+        self.button.exit_requested = True
+
+
+display = HostDisplay()
+font = HostFont()
+badger = HostBadger()
+
+
+def use_clock(clock):
+    """
+    Time the display's auto refresh and the tones on the Application's clock, so a run on a simulated clock refreshes
+    and plays tones in game time instead of wall time.
+    :param clock:
+    :return:
+    """
+    display.clock = clock.monotonic
+    badger.speaker.clock = clock.monotonic
@@ -0,0 +1,224 @@
+from time import perf_counter
+
+"""Software rasterizer for the host backend. Composites the displayio group tree into a NumPy RGB565 framebuffer the
+size of the PyBadge display every time the host display refreshes, so the cost of drawing a screen can be measured
+and compared off the device. Every TileGrid tile is drawn with one palette lookup and one masked copy over the whole
+tile, there are no per-pixel Python loops. Transparent palette entries are skipped, and every pixel written to a part
+of the frame that has already been drawn on in the same frame is counted as overdraw.
+
+Labels are drawn as their background box with one solid block per character, the host font has no glyphs, which
+keeps the pixel counts close to the real thing. Group scaling isn't supported, the game doesn't use it.
+
+NumPy is only needed on the host when the rasterizer is used:
+    pip install numpy"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def color_565(color):
+    """
+    Convert a 0xRRGGBB colour to RGB565.
+    :param color:
+    :return:
+    """
+    return ((color >> 8) & 0xF800) | ((color >> 5) & 0x07E0) | ((color >> 3) & 0x001F)
+
+
+class HostRasterizer:
+    def __init__(self, width=160, height=128):
+        if np is None:
+            raise ImportError("The host rasterizer needs NumPy, install it with 'pip install numpy'.")
+        self.width = width
+        self.height = height
+        self.frame = np.zeros((height, width), dtype=np.uint16)
+        self.coverage = np.zeros((height, width), dtype=np.uint8)  # Times each pixel was written this frame
+        self.palette_arrays = {}  # Palette id to (RGB565 colours, opaque mask), rebuilt every frame
+        self.frames = 0
+        self.elements = 0
+        self.last_stats = {}
+
+    def render(self, group):
+        """
+        Composite a group tree into the framebuffer.
+        :param group:
+        :return: stats of the frame
+        """
+        start_time = perf_counter()
+        self.frame.fill(0)
+        self.coverage.fill(0)
+        self.palette_arrays.clear()
+        self.elements = 0
+
+        if group is not None:
+            self.draw_group(group, 0, 0)
+
+        pixels_drawn = int(self.coverage.sum(dtype=np.uint32))
+        pixels_covered = int(np.count_nonzero(self.coverage))
+        self.frames += 1
+        self.last_stats = {
+            'frame': self.frames,
+            'elements': self.elements,
+            'pixels_drawn': pixels_drawn,
+            'pixels_covered': pixels_covered,
+            'overdraw': pixels_drawn - pixels_covered,
+            'render_ms': (perf_counter() - start_time) * 1000,
+        }
+        return self.last_stats
+
+    def draw_group(self, group, offset_x, offset_y):
+        """
+        Draw every visible element of a group, in order, so later elements end up on top.
+        :param group:
+        :param offset_x:
+        :param offset_y:
+        :return:
+        """
+        if group.hidden:
+            return
+        offset_x += group.x
+        offset_y += group.y
+        for element in group:
+            if getattr(element, 'hidden', False):
+                continue
+            if hasattr(element, 'pixel_shader'):
+                self.draw_tilegrid(element, offset_x, offset_y)
+            elif hasattr(element, 'text'):
+                self.draw_label(element, offset_x, offset_y)
+            else:
+                self.draw_group(element, offset_x, offset_y)
+
+    def palette(self, palette):
+        """
+        Get the RGB565 colours and opaque mask of a palette as arrays, built once per frame per palette.
+        :param palette:
+        :return:
+        """
+        arrays = self.palette_arrays.get(id(palette))
+        if arrays is None:
+            colors = np.array([color_565(palette[i]) for i in range(len(palette))], dtype=np.uint16)
+            opaque = np.array([not palette.is_transparent(i) for i in range(len(palette))], dtype=bool)
+            arrays = (colors, opaque)
+            self.palette_arrays[id(palette)] = arrays
+        return arrays
+
+    def clip(self, x, y, width, height):
+        """
+        Clip a rectangle to the framebuffer.
+        :param x:
+        :param y:
+        :param width:
+        :param height:
+        :return: tuple of (x1, y1, x2, y2) in the framebuffer, or None if nothing is visible
+        """
+        x1 = max(0, x)
+        y1 = max(0, y)
+        x2 = min(self.width, x + width)
+        y2 = min(self.height, y + height)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        return x1, y1, x2, y2
+
+    def blit(self, indices, colors, opaque, x1, y1, x2, y2):
+        """
+        Write the opaque pixels of a block of palette indices into the framebuffer.
+        :param indices:
+        :param colors:
+        :param opaque:
+        :param x1:
+        :param y1:
+        :param x2:
+        :param y2:
+        :return:
+        """
+        mask = opaque[indices]
+        np.copyto(self.frame[y1:y2, x1:x2], colors[indices], where=mask)
+        self.coverage[y1:y2, x1:x2] += mask
+
+    def draw_tilegrid(self, grid, offset_x, offset_y):
+        """
+        Draw every tile of a TileGrid.
+        :param grid:
+        :param offset_x:
+        :param offset_y:
+        :return:
+        """
+        self.elements += 1
+        bitmap = grid.bitmap
+        if isinstance(bitmap.pixels, bytearray):
+            pixels = np.frombuffer(bitmap.pixels, dtype=np.uint8)
+        else:
+            pixels = np.array(bitmap.pixels, dtype=np.int32)
+        pixels = pixels.reshape(bitmap.height, bitmap.width)
+        colors, opaque = self.palette(grid.pixel_shader)
+        tile_width = grid.tile_width
+        tile_height = grid.tile_height
+        tiles_per_row = bitmap.width // tile_width
+        grid_x = offset_x + grid.x
+        grid_y = offset_y + grid.y
+
+        for tile_y in range(grid.height):
+            for tile_x in range(grid.width):
+                area = self.clip(grid_x + tile_x * tile_width, grid_y + tile_y * tile_height, tile_width,
+                                 tile_height)
+                if area is None:
+                    continue
+                x1, y1, x2, y2 = area
+                tile = grid[tile_x, tile_y]
+                source_x = (tile % tiles_per_row) * tile_width - grid_x - tile_x * tile_width
+                source_y = (tile // tiles_per_row) * tile_height - grid_y - tile_y * tile_height
+                self.blit(pixels[source_y + y1:source_y + y2, source_x + x1:source_x + x2], colors, opaque,
+                          x1, y1, x2, y2)
+
+    def draw_label(self, text_label, offset_x, offset_y):
+        """
+        Draw a label as its background box and one solid block per character, the label y is the middle of the first
+        line of text. Lines are split on newlines and spaced by the font height times the label's line spacing, as
+        adafruit_display_text lays them out.
+        :param text_label:
+        :param offset_x:
+        :param offset_y:
+        :return:
+        """
+        self.elements += 1
+        glyph_width, glyph_height = text_label.font.get_bounding_box()[:2]
+        lines = (text_label.text or "").split("\n")
+        line_height = int(glyph_height * getattr(text_label, 'line_spacing', 1.25))
+        x = offset_x + text_label.x
+        y = offset_y + text_label.y - glyph_height // 2
+
+        if text_label.background_color is not None:
+            area = self.clip(x, y, max(len(line) for line in lines) * glyph_width,
+                             (len(lines) - 1) * line_height + glyph_height)
+            if area is not None:
+                x1, y1, x2, y2 = area
+                self.frame[y1:y2, x1:x2] = color_565(text_label.background_color)
+                self.coverage[y1:y2, x1:x2] += 1
+
+        color = color_565(text_label.color)
+        for row, line in enumerate(lines):
+            line_y = y + row * line_height
+            for i, character in enumerate(line):
+                if character == " ":
+                    continue
+                area = self.clip(x + i * glyph_width + 1, line_y + 2, glyph_width - 2, glyph_height - 4)
+                if area is not None:
+                    x1, y1, x2, y2 = area
+                    self.frame[y1:y2, x1:x2] = color
+                    self.coverage[y1:y2, x1:x2] += 1
+
+    def dump_frame(self, path):
+        """
+        Save the framebuffer as a binary PPM image.
+        :param path:
+        :return:
+        """
+        red = ((self.frame >> 11) & 0x1F).astype(np.uint8)
+        green = ((self.frame >> 5) & 0x3F).astype(np.uint8)
+        blue = (self.frame & 0x1F).astype(np.uint8)
+        rgb = np.dstack(((red << 3) | (red >> 2), (green << 2) | (green >> 4), (blue << 3) | (blue >> 2)))
+        with open(path, "wb") as ppm_file:
+            ppm_file.write(f"P6 {self.width} {self.height} 255\n".encode("ascii"))
+            ppm_file.write(rgb.tobytes())
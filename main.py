@@ -1 +1,3 @@
-import game
+from game import run
+
+run()
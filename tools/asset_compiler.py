@@ -0,0 +1,127 @@
+"""Host side asset compiler. Turns the sprite sheet BMP, the sprite matrix, the baked shadow atlas and the prebuilt
+colour shift palettes into the single packed file read by utils/asset_pack.py, so the game doesn't have to parse the
+BMP or bake shadows when it boots. The colour shifts and the shadow drawing come from components/sprite_layout.py, the
+same code the game runs when it falls back to the BMP, so the pack always matches.
+
+The pack is not zero-copy on the device: utils/asset_pack.py reads it with one bulk read into a single buffer, but the
+sheet and atlas pixels are still copied into displayio Bitmaps with arrayblit, since displayio can't use a buffer as
+the bitmap storage. What the pack saves is the BMP parsing and the per-pixel shadow baking at boot.
+
+Usage, from the root of the repository:
+    python tools/asset_compiler.py [--sheet images/sprites.bmp] [--output images/sprites.pack]"""
+
+import argparse
+import os
+import struct
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from components.sprite_layout import (SPRITE_WIDTH, SPRITE_HEIGHT, COLUMNS, ROWS, SPRITE_MATRIX,  # noqa: E402
+                                      ATLAS_SHADOW_ANGLE, ATLAS_SHADOW_STRENGTH, PACK_COLOR_SHIFTS, adjust_color,
+                                      draw_shadow_atlas)
+from hal.host import Bitmap, arrayblit, read_bmp  # noqa: E402
+from utils.asset_pack import PACK_MAGIC, PACK_VERSION, HEADER_FORMAT, HEADER_SIZE, PALETTE_SHIFT_FORMAT  # noqa: E402
+
+
+def bake_shadow_atlas(sheet_pixels, sheet_width, sheet_height, palette_size, shadow_strength):
+    """
+    Build the shadow atlas with the same drawing code SpriteExtractor.build_shadow_atlas uses on the device, including
+    the extra row of blank cells.
+    :param sheet_pixels:
+    :param sheet_width:
+    :param sheet_height:
+    :param palette_size:
+    :param shadow_strength:
+    :return: tuple of (atlas width, atlas height, atlas pixels)
+    """
+    sheet = Bitmap(sheet_width, sheet_height, palette_size)
+    arrayblit(sheet, sheet_pixels)
+    atlas = Bitmap(COLUMNS * (SPRITE_WIDTH + shadow_strength), (ROWS + 1) * (SPRITE_HEIGHT + shadow_strength),
+                   palette_size + 1)
+    draw_shadow_atlas(sheet, atlas, palette_size, shadow_strength)
+
+    return atlas.width, atlas.height, atlas.pixels
+
+
+def compile_pack(sheet_path, output_path, color_shifts=None):
+    """
+    Compile the sprite sheet into a sprite pack.
+    :param sheet_path:
+    :param output_path:
+    :param color_shifts:
+    :return: the size of the pack in bytes
+    """
+    if color_shifts is None:
+        color_shifts = PACK_COLOR_SHIFTS
+
+    sheet_width, sheet_height, sheet_pixels, palette = read_bmp(sheet_path)
+    if (sheet_width, sheet_height) != (COLUMNS * SPRITE_WIDTH, ROWS * SPRITE_HEIGHT):
+        raise ValueError(f"'{sheet_path}' is {sheet_width}x{sheet_height}, the sprite layout expects "
+                         f"{COLUMNS * SPRITE_WIDTH}x{ROWS * SPRITE_HEIGHT}.")
+    if len(palette) > 255:
+        raise ValueError(f"'{sheet_path}' has {len(palette)} colours, which leaves no index for the shadow.")
+
+    _, _, atlas_pixels = bake_shadow_atlas(sheet_pixels, sheet_width, sheet_height, len(palette), ATLAS_SHADOW_STRENGTH)
+
+    index = bytearray()
+    for name, (column, row) in SPRITE_MATRIX.items():
+        encoded_name = name.encode("utf-8")
+        index += bytes([len(encoded_name)]) + encoded_name + bytes([column, row])
+
+    palettes = bytearray()
+    for shift in color_shifts:
+        palettes += struct.pack(PALETTE_SHIFT_FORMAT, *shift)
+        for color in palette:
+            palettes += struct.pack("<I", adjust_color(color, shift))
+
+    index_offset = HEADER_SIZE
+    palettes_offset = index_offset + len(index)
+    sheet_offset = palettes_offset + len(palettes)
+    atlas_offset = sheet_offset + len(sheet_pixels)
+
+    header = struct.pack(HEADER_FORMAT, PACK_MAGIC, PACK_VERSION, SPRITE_WIDTH, SPRITE_HEIGHT, COLUMNS, ROWS,
+                         ATLAS_SHADOW_STRENGTH, ATLAS_SHADOW_ANGLE, len(palette), len(color_shifts),
+                         len(SPRITE_MATRIX), index_offset, palettes_offset, sheet_offset, atlas_offset)
+
+    with open(output_path, "wb") as pack_file:
+        for section in (header, index, palettes, sheet_pixels, atlas_pixels):
+            pack_file.write(section)
+
+    return atlas_offset + len(atlas_pixels)
+
+
+def parse_color_shift(value):
+    """
+    Parse an 'r,g,b' colour shift argument.
+    :param value:
+    :return:
+    """
+    parts = [int(part) for part in value.split(",")]
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError(f"Colour shift '{value}' must be three comma separated integers.")
+    return tuple(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the sprite sheet into a packed sprite/palette file.")
+    parser.add_argument("--sheet", default=os.path.join(ROOT_DIR, "images", "sprites.bmp"),
+                        help="sprite sheet BMP to compile")
+    parser.add_argument("--output", default=os.path.join(ROOT_DIR, "images", "sprites.pack"),
+                        help="path of the sprite pack to write")
+    parser.add_argument("--color-shift", action="append", type=parse_color_shift, dest="color_shifts",
+                        help="extra 'r,g,b' colour shift palette to prebuild, can be repeated")
+    args = parser.parse_args()
+
+    color_shifts = list(PACK_COLOR_SHIFTS)
+    for shift in args.color_shifts or []:
+        if shift not in color_shifts:
+            color_shifts.append(shift)
+
+    size = compile_pack(args.sheet, args.output, color_shifts)
+    print(f"Wrote {args.output} ({size} bytes, {len(SPRITE_MATRIX)} sprites, {len(color_shifts)} palettes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Boot the whole game headless on the host backend of the hardware abstraction layer, press buttons on a schedule and
+report what the game did, for profiling and benchmarking on a normal computer.
+
+Usage, from the root of the repository:
+    python tools/headless.py [--seconds 10] [--press 1.0:start] [--press 2.5:a:0.2] ...
+                             [--difficulty easy] [--render] [--dump-dir frames] [--dump-every 30] [--fast]
+
+Each --press is time:button[:hold], the time in seconds from boot and the hold time defaulting to 0.1 seconds.
+--render draws every refresh with the NumPy rasterizer in hal/raster.py and reports the draw cost per menu, so
+screens and race difficulties can be compared, --dump-dir also saves every --dump-every'th frame as a PPM image.
+--fast runs the game on a simulated clock that moves on a 60th of a second every loop, as fast as the computer can
+go, the press times and --seconds are then in game time."""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from hal.host import BUTTON_NAMES, HostExit, badger, display, use_clock  # noqa: E402
+from hal.raster import HostRasterizer  # noqa: E402
+from utils.clock import SimulatedClock  # noqa: E402
+
+
+def parse_press(value):
+    """
+    Parse a 'time:button[:hold]' press argument.
+    :param value:
+    :return:
+    """
+    parts = value.split(":")
+    if len(parts) not in (2, 3) or parts[1] not in BUTTON_NAMES:
+        raise argparse.ArgumentTypeError(f"Press '{value}' must be time:button[:hold], buttons are "
+                                         f"{', '.join(BUTTON_NAMES)}.")
+    hold = float(parts[2]) if len(parts) == 3 else 0.1
+    return float(parts[0]), parts[1], hold
+
+
+def press_events(presses, seconds):
+    """
+    Turn the presses into a schedule of (time, pressed, button) events, ending with an exit event.
+    :param presses:
+    :param seconds:
+    :return:
+    """
+    events = []
+    for at, button, hold in presses:
+        events.append((at, True, button))
+        events.append((at + hold, False, button))
+    events.append((seconds, None, None))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def apply_event(pressed, button):
+    """
+    Press or release a button, or ask the game to exit.
+    :param pressed:
+    :param button:
+    :return:
+    """
+    if pressed is None:
+        badger.request_exit()
+    elif pressed:
+        badger.button.press(button)
+    else:
+        badger.button.release(button)
+
+
+def press_buttons(events, start_time):
+    """
+    Press and release the buttons on schedule in real time, then ask the game to exit.
+    :param events:
+    :param start_time:
+    :return:
+    """
+    for at, pressed, button in events:
+        delay = start_time + at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        apply_event(pressed, button)
+
+
+class SimulatedPresser:
+    """
+    Presses and releases the buttons on schedule in simulated time, checked on every button read.
+    """
+
+    def __init__(self, events, clock, on_poll=None):
+        self.events = events
+        self.clock = clock
+        self.on_poll = on_poll
+        self.next_event = 0
+
+    def poll(self):
+        """
+        Apply every event that is due.
+        :return:
+        """
+        while self.next_event < len(self.events) and self.events[self.next_event][0] <= self.clock.monotonic():
+            _, pressed, button = self.events[self.next_event]
+            apply_event(pressed, button)
+            self.next_event += 1
+        if self.on_poll:
+            self.on_poll()
+
+
+class FrameReport:
+    """
+    Draw cost of the rasterized frames, per menu, and per difficulty for the race.
+    """
+
+    def __init__(self, app, rasterizer, dump_dir=None, dump_every=30):
+        self.app = app
+        self.rasterizer = rasterizer
+        self.dump_dir = dump_dir
+        self.dump_every = dump_every
+        self.menus = {}  # 'menu' or 'race difficulty' to [frames, render ms, pixels drawn, overdraw, worst overdraw]
+
+    def add(self, stats):
+        """
+        Record a rasterized frame, saving it if it is due to be dumped.
+        :param stats:
+        :return:
+        """
+        menu = self.app.current_menu
+        if menu == 'race':
+            menu = f"race {self.app.player_stats.difficulty}"
+        totals = self.menus.setdefault(menu, [0, 0.0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += stats['render_ms']
+        totals[2] += stats['pixels_drawn']
+        totals[3] += stats['overdraw']
+        totals[4] = max(totals[4], stats['overdraw'])
+        if self.dump_dir and stats['frame'] % self.dump_every == 0:
+            self.rasterizer.dump_frame(os.path.join(self.dump_dir, f"{stats['frame']:06d}_{menu.replace(' ', '_')}.ppm"))
+
+    def print(self):
+        """
+        Print the average draw cost per menu.
+        :return:
+        """
+        print(f"{'Menu':<24}{'Frames':>8}{'Render ms':>11}{'Drawn px':>10}{'Overdraw':>10}{'Worst':>8}")
+        for menu, (frames, render_ms, drawn, overdraw, worst) in self.menus.items():
+            print(f"{menu:<24}{frames:>8}{render_ms / frames:>11.3f}{drawn // frames:>10}{overdraw // frames:>10}"
+                  f"{worst:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the game headless on the host backend.")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long to run the game for")
+    parser.add_argument("--press", action="append", type=parse_press, dest="presses", default=[],
+                        help="button press as time:button[:hold], can be repeated")
+    parser.add_argument("--difficulty", help="race difficulty to start with")
+    parser.add_argument("--render", action="store_true", help="draw every refresh with the NumPy rasterizer")
+    parser.add_argument("--dump-dir", help="directory to save rasterized frames to, implies --render")
+    parser.add_argument("--dump-every", type=int, default=30, help="save every n'th rasterized frame")
+    parser.add_argument("--fast", action="store_true", help="run on a simulated clock, as fast as possible")
+    args = parser.parse_args()
+
+    from game import Application
+
+    clock = SimulatedClock(frame_time=1 / 60) if args.fast else None
+    if clock:
+        use_clock(clock)
+
+    start_time = time.monotonic()
+    app = Application(clock=clock)
+    boot_time = time.monotonic() - start_time
+
+    if args.difficulty:
+        app.player_stats.difficulty = args.difficulty
+
+    report = None
+    if args.render or args.dump_dir:
+        if args.dump_dir:
+            os.makedirs(args.dump_dir, exist_ok=True)
+        display.rasterizer = HostRasterizer(display.width, display.height)
+        report = FrameReport(app, display.rasterizer, args.dump_dir, args.dump_every)
+        display.on_frame = report.add
+        badger.button.on_poll = display.poll
+
+    events = press_events(args.presses, args.seconds)
+    if clock:
+        badger.button.on_poll = SimulatedPresser(events, clock, badger.button.on_poll).poll
+    else:
+        threading.Thread(target=press_buttons, args=(events, start_time), daemon=True).start()
+    try:
+        app.menu_controller()
+    except HostExit:
+        pass
+    app.close()
+    run_time = time.monotonic() - start_time
+
+    print(f"Boot: {boot_time * 1000:.1f} ms, ran for {run_time:.2f} s")
+    if clock:
+        print(f"Game time: {clock.monotonic():.2f} s")
+    print(f"Menu: {app.current_menu}")
+    print(f"Display: {display.refreshes} refreshes, brightness {display.brightness:.2f}")
+    print(f"Tones: {len(badger.speaker.tones)} recent, {badger.speaker.tone_time:.2f} s in total")
+    print(f"NeoPixels: {badger.pixels.shows} shows, {badger.pixels.colors}")
+    if report:
+        report.print()
+
+
+if __name__ == "__main__":
+    main()
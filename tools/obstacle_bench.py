@@ -0,0 +1,71 @@
+"""Benchmark the obstacle backends of the TrackGenerator against each other on the host. Each backend runs the same
+seeded race: every simulation step scrolls the track and runs the player collision and AI perception queries, the
+obstacles that have left the screen are culled by the step itself. The query results of the backends are compared, they
+have to match.
+
+Usage, from the root of the repository:
+    python tools/obstacle_bench.py [--difficulty insane] [--steps 10000] [--seed 1]"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from components.engine import TrackGenerator  # noqa: E402
+from utils.rng import RandomService  # noqa: E402
+
+
+def run(difficulty, steps, seed, vectorised):
+    """
+    Run a seeded race on one backend.
+    :param difficulty:
+    :param steps:
+    :param seed:
+    :param vectorised:
+    :return: tuple of (microseconds per step, query results)
+    """
+    track = TrackGenerator(difficulty, vectorised=vectorised, random_stream=RandomService(seed).stream('track'))
+    results = []
+    elapsed = 0.0
+    for step in range(steps):
+        # A player and an AI trolley weaving across the bottom half of the screen
+        player_x = 72 + int(60 * ((step % 240) / 120 - 1))
+        ai_x = 144 - player_x
+        start_time = time.perf_counter()
+        track.step(1 / 60)
+        player = track.query(player_x - 2, 88, 20, 20)
+        ai = track.query(ai_x - 10, 40, 36, 36)
+        elapsed += time.perf_counter() - start_time
+        # Nothing draws the culled sprites, so they are dropped here instead of by a render
+        del track.culled[:]
+        results.append((player, ai))
+    return elapsed * 1000000 / steps, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the obstacle backends.")
+    parser.add_argument("--difficulty", default="insane", help="race difficulty, sets how many obstacles there are")
+    parser.add_argument("--steps", type=int, default=10000, help="simulation steps to run")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the obstacle generation")
+    args = parser.parse_args()
+
+    python_time, python_results = run(args.difficulty, args.steps, args.seed, False)
+    print(f"python: {python_time:.1f} us per step")
+    try:
+        vector_time, vector_results = run(args.difficulty, args.steps, args.seed, True)
+    except ImportError as error:
+        print(f"vector: {error}")
+        return
+    print(f"vector: {vector_time:.1f} us per step")
+
+    mismatches = sum(1 for python, vector in zip(python_results, vector_results) if python != vector)
+    print(f"Query results differ on {mismatches} of {args.steps} steps")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
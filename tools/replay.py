@@ -0,0 +1,171 @@
+"""Make and replay race input logs on the host, for benchmarking the race with a fixed workload.
+
+Usage, from the root of the repository:
+    python tools/replay.py script race.rpl [--difficulty insane] [--trolley trolley_basic] [--seed 1]
+                                           [--seconds 60] [--press 0:up:60] [--press 2.5:left:0.5] ...
+    python tools/replay.py play race.rpl [--frame-time 0.0167] [--save frames.txt] [--baseline frames.txt]
+
+script writes a log from a schedule of button presses in race time, each --press is time:button[:hold] with the
+hold time defaulting to 0.1 seconds, only the driving buttons can be pressed. Logs recorded on the device by setting
+RaceEngine.input_recorder to an InputRecorder play back the same way.
+
+play boots the game on the host backend with a simulated clock, starts the race in the log straight away and plays
+it to the end of the log or the race, then prints the distribution of the frame times. Every frame moves the simulated
+clock on by --frame-time, the race played is the same whatever it is set to, up to RaceEngine.max_steps_per_frame
+steps a frame, only the number of frames it is drawn in changes. --save keeps the frame times, one per line in
+microseconds, and --baseline prints the distribution of saved frame times next to this run's, so two builds can be
+compared on the same race."""
+
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from components.controls import BUTTON_ORDER  # noqa: E402
+from hal.host import HostExit, badger, use_clock  # noqa: E402
+from utils.clock import SimulatedClock  # noqa: E402
+from utils.replay import DRIVING_BUTTONS, InputPlayer, InputRecorder  # noqa: E402
+from utils.resource_manager import memory_policy  # noqa: E402
+
+STEPS_PER_SECOND = 60  # RaceEngine.simulation_step
+
+
+def parse_press(value):
+    """
+    Parse a 'time:button[:hold]' press argument.
+    :param value:
+    :return:
+    """
+    parts = value.split(":")
+    if len(parts) not in (2, 3) or parts[1] not in BUTTON_ORDER or \
+            not DRIVING_BUTTONS & (1 << BUTTON_ORDER.index(parts[1])):
+        raise argparse.ArgumentTypeError(f"Press '{value}' must be time:button[:hold], buttons are "
+                                         f"{', '.join(BUTTON_ORDER[:6])}.")
+    hold = float(parts[2]) if len(parts) == 3 else 0.1
+    return float(parts[0]), parts[1], hold
+
+
+def script(args):
+    """
+    Write a log from a schedule of button presses.
+    :param args:
+    :return:
+    """
+    masks = bytearray(int(args.seconds * STEPS_PER_SECOND))
+    for at, button, hold in args.presses:
+        bit = 1 << BUTTON_ORDER.index(button)
+        for step in range(int(at * STEPS_PER_SECOND), min(len(masks), int((at + hold) * STEPS_PER_SECOND))):
+            masks[step] |= bit
+
+    recorder = InputRecorder(args.log)
+    recorder.start(args.seed, args.difficulty, args.trolley)
+    for mask in masks:
+        recorder.record(mask)
+    recorder.close()
+    print(f"Wrote {recorder.steps} steps ({args.seconds:.1f} s) of {args.difficulty} with seed {args.seed}")
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile of sorted values.
+    :param values:
+    :param fraction:
+    :return:
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def distribution(frame_times):
+    """
+    Summarise frame times in microseconds.
+    :param frame_times:
+    :return: tuple of (frames, mean, median, 90th, 99th percentile, worst) in milliseconds, frames excepted
+    """
+    values = sorted(frame_times)
+    return (len(values), sum(values) / len(values) / 1000, percentile(values, 0.5) / 1000,
+            percentile(values, 0.9) / 1000, percentile(values, 0.99) / 1000, values[-1] / 1000)
+
+
+def play(args):
+    """
+    Replay a log and print the frame time distribution.
+    :param args:
+    :return:
+    """
+    from game import Application
+    from components.engine import RaceEngine
+
+    clock = SimulatedClock(frame_time=args.frame_time)
+    use_clock(clock)
+    player = InputPlayer(args.log)
+    app = Application(clock=clock)
+    trolley_controller = app.player_stats.trolley_controller
+    app.player_stats.garage[player.trolley] = trolley_controller.instantiate_trolley(player.trolley)
+    trolley_controller.current_trolley = player.trolley
+    app.player_stats.difficulty = player.difficulty
+    app.current_menu = 'race'
+    RaceEngine.input_player = player
+
+    def stop_after_race():
+        if app.current_menu != 'race':
+            badger.request_exit()
+
+    badger.button.on_poll = stop_after_race
+    try:
+        app.menu_controller()
+    except HostExit:
+        pass
+    app.close()
+
+    frame_times = [frame_ns // 1000 for frame_ns in player.frame_times]
+    if not frame_times:
+        print("No frames were played.")
+        return
+    print(f"Replayed {player.step} of {len(player.masks)} steps of {player.difficulty} with seed {player.seed}, "
+          f"race ended in {app.current_menu}")
+
+    rows = [("this run", distribution(frame_times))]
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            rows.insert(0, ("baseline", distribution([int(line) for line in baseline_file if line.strip()])))
+    print(f"{'':<10}{'Frames':>8}{'Mean ms':>9}{'p50':>8}{'p90':>8}{'p99':>8}{'Worst':>8}")
+    for name, (frames, mean, median, p90, p99, worst) in rows:
+        print(f"{name:<10}{frames:>8}{mean:>9.3f}{median:>8.3f}{p90:>8.3f}{p99:>8.3f}{worst:>8.3f}")
+    print(f"Garbage collection: {sum(player.gc_times) / len(player.gc_times):.3f} ms per frame on average, "
+          f"{max(player.gc_times):.3f} ms at worst, {memory_policy.collections} collections")
+
+    if args.save:
+        with open(args.save, "w") as save_file:
+            save_file.write("".join(f"{frame_time}\n" for frame_time in frame_times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Make and replay race input logs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    script_parser = commands.add_parser("script", help="write a log from a schedule of button presses")
+    script_parser.add_argument("log", help="log file to write")
+    script_parser.add_argument("--difficulty", default="insane", help="race difficulty")
+    script_parser.add_argument("--trolley", default="trolley_basic", help="trolley to race with")
+    script_parser.add_argument("--seed", type=int, default=1, help="seed of the race's random streams")
+    script_parser.add_argument("--seconds", type=float, default=60.0, help="length of the log in race time")
+    script_parser.add_argument("--press", action="append", type=parse_press, dest="presses", default=[],
+                               help="button press as time:button[:hold], can be repeated")
+
+    play_parser = commands.add_parser("play", help="replay a log and print the frame time distribution")
+    play_parser.add_argument("log", help="log file to replay")
+    play_parser.add_argument("--frame-time", type=float, default=1 / 60, help="simulated seconds every frame covers")
+    play_parser.add_argument("--save", help="file to save the frame times to")
+    play_parser.add_argument("--baseline", help="frame times saved by an earlier run to compare with")
+
+    args = parser.parse_args()
+    if args.command == "script":
+        script(args)
+    else:
+        play(args)
+
+
+if __name__ == "__main__":
+    main()
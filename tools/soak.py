@@ -0,0 +1,183 @@
+"""Soak test the race on the host, to catch memory leaks before they reach the PyBadge. Runs the full race loop on
+the host backend with a simulated clock for hours of game time, samples the heap, the Python object count and the
+number of display elements, pooled labels and obstacles in use at an interval, and fails if the heap or the object
+count keeps growing after the race has warmed up.
+
+Usage, from the root of the repository:
+    python tools/soak.py [--difficulty performance_test] [--seconds 7200] [--interval 300] [--warmup 60]
+                         [--frame-time 0.1] [--max-heap-growth 4096] [--max-object-growth 200] [--seed 1]
+
+The heap is measured with tracemalloc, as free_memory reports it on the host. Growth is the trend across every sample
+after the warmup, the median of the slopes between each pair of samples over the length of the soak, so the odd sample
+caught with a cache full or a collection due can't fail the soak the way comparing the first and last could. The
+samples are kept in columns allocated before the race starts, so sampling doesn't grow the heap it measures. A two
+hour soak takes about three minutes on a desktop. Every loop of the race moves the
+simulated clock on by --frame-time, which defaults to the most time a single race frame simulates. The trolley is
+held moving up and steers from side to side so it keeps running into things, except in performance_test which has
+no collisions. The race ends early if the trolley is wrecked, which fails the soak as well."""
+
+import argparse
+import gc
+from array import array
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from hal.host import HostExit, badger, use_clock  # noqa: E402
+from utils.clock import SimulatedClock  # noqa: E402
+from utils.resource_manager import free_memory, heap_telemetry  # noqa: E402
+
+
+class Sampler:
+    """
+    Samples the race at an interval of game time, checked on every button read.
+    """
+
+    def __init__(self, app, clock, seconds, interval, warmup):
+        self.app = app
+        self.clock = clock
+        self.seconds = seconds
+        self.interval = interval
+        self.warmup = warmup
+        self.next_sample = warmup
+        # One column per measurement: game time, free heap, objects, display elements, labels, obstacles and pooled
+        # obstacles, with room for a sample every interval from the warmup and a last one when the soak ends
+        size = max(0, int((seconds - warmup) // interval)) + 2
+        self.columns = [array('d', [0.0] * size)] + [array('l', [0] * size) for _ in range(6)]
+        self.count = 0
+
+    def poll(self):
+        """
+        Steer the trolley, take a sample when one is due and stop the run once the race has left the race loop or
+        the soak is over.
+        :return:
+        """
+        now = self.clock.monotonic()
+        if self.app.current_menu != 'race' or now >= self.seconds:
+            self.sample()
+            badger.request_exit()
+            return
+        # Hold up, and swap between left and right every four seconds
+        badger.button.mask = 0b0101 if int(now) % 8 < 4 else 0b1001
+        if now >= self.next_sample:
+            self.sample()
+            self.next_sample += self.interval
+
+    def sample(self):
+        """
+        Record the heap and object counts.
+        :return:
+        """
+        if self.count == len(self.columns[0]):
+            return
+        race = self.app.menus.get('race')
+        track = getattr(race, 'track_generator', None)
+        gc.collect()
+        columns = self.columns
+        i = self.count
+        columns[0][i] = self.clock.monotonic()
+        columns[1][i] = free_memory()
+        columns[2][i] = len(gc.get_objects())
+        columns[3][i] = sum(len(layer) for layer in self.app.root_display.layers.values())
+        columns[4][i] = self.app.root_display.label_pool.stats()['in_use']
+        columns[5][i] = len(track.obstacles) if track else 0
+        columns[6][i] = track.obstacle_pool.in_use if track else 0
+        self.count += 1
+
+    def samples(self):
+        """
+        Get the samples taken.
+        :return: list of (game time, free heap, objects, display elements, labels, obstacles, pooled obstacles)
+        """
+        return [tuple(column[i] for column in self.columns) for i in range(self.count)]
+
+
+def growth(times, values):
+    """
+    Get how much values grew over the samples, from the median of the slopes between every pair of samples, which a
+    few outlying samples can't move.
+    :param times:
+    :param values:
+    :return:
+    """
+    slopes = sorted((values[j] - values[i]) / (times[j] - times[i])
+                    for i in range(len(times)) for j in range(i + 1, len(times)) if times[j] > times[i])
+    return slopes[len(slopes) // 2] * (times[-1] - times[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the race for memory leaks.")
+    parser.add_argument("--difficulty", default="performance_test", help="race difficulty")
+    parser.add_argument("--trolley", default="trolley_basic", help="trolley to race with")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the race's random streams")
+    parser.add_argument("--seconds", type=float, default=7200.0, help="game time to soak for")
+    parser.add_argument("--interval", type=float, default=300.0, help="game time between samples")
+    parser.add_argument("--warmup", type=float, default=60.0, help="game time before the first, baseline, sample")
+    parser.add_argument("--frame-time", type=float, default=0.1, help="game time every race loop moves on by")
+    parser.add_argument("--max-heap-growth", type=int, default=4096,
+                        help="bytes the heap in use may trend up by after the warmup")
+    parser.add_argument("--max-object-growth", type=int, default=200,
+                        help="number of Python objects the object count may trend up by after the warmup")
+    args = parser.parse_args()
+
+    from game import Application
+    from components.engine import RaceEngine
+
+    tracemalloc.start()
+    clock = SimulatedClock(frame_time=args.frame_time)
+    use_clock(clock)
+    app = Application(clock=clock)
+    trolley_controller = app.player_stats.trolley_controller
+    app.player_stats.garage[args.trolley] = trolley_controller.instantiate_trolley(args.trolley)
+    trolley_controller.current_trolley = args.trolley
+    app.player_stats.difficulty = args.difficulty
+    app.current_menu = 'race'
+    RaceEngine.race_seed = args.seed
+
+    sampler = Sampler(app, clock, args.seconds, args.interval, args.warmup)
+    badger.button.on_poll = sampler.poll
+    start_time = time.monotonic()
+    try:
+        app.menu_controller()
+    except HostExit:
+        pass
+    app.close()
+    run_time = time.monotonic() - start_time
+
+    print(f"Soaked {clock.monotonic():.0f} s of {args.difficulty} in {run_time:.1f} s, race ended in "
+          f"{app.current_menu}")
+    print(f"{'Game s':>8}{'Free heap':>11}{'Objects':>9}{'Display':>9}{'Labels':>8}{'Obstacles':>11}{'Pooled':>8}")
+    samples = sampler.samples()
+    for game_time, heap, objects, elements, labels, obstacles, pooled in samples:
+        print(f"{game_time:>8.0f}{heap:>11}{objects:>9}{elements:>9}{labels:>8}{obstacles:>11}{pooled:>8}")
+
+    print("Lowest free heap by phase: " + ", ".join(f"{phase} {tag} {free}" for phase, tag, free in
+                                                    heap_telemetry.low_water_marks()))
+
+    failures = []
+    if app.current_menu != 'race':
+        failures.append(f"the race ended early, in {app.current_menu}")
+    if len(samples) < 2:
+        failures.append("the soak ended before the warmup, nothing to compare")
+    else:
+        times = [sample[0] for sample in samples]
+        heap_growth = int(-growth(times, [sample[1] for sample in samples]))
+        object_growth = int(growth(times, [sample[2] for sample in samples]))
+        print(f"Growth since the warmup: heap {heap_growth} bytes, {object_growth} objects")
+        if heap_growth > args.max_heap_growth:
+            failures.append(f"the heap grew by {heap_growth} bytes, over {args.max_heap_growth}")
+        if object_growth > args.max_object_growth:
+            failures.append(f"the object count grew by {object_growth}, over {args.max_object_growth}")
+
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == "__main__":
+    main()
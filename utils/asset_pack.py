@@ -0,0 +1,145 @@
+from os import stat
+from struct import calcsize, unpack_from
+
+"""This module reads the packed sprite/palette file produced by tools/asset_compiler.py. The whole pack is read into a
+single preallocated buffer with one bulk read (or memory mapped on a host that supports it), and sprite pixels and
+palettes are handed out as memoryview slices of that buffer, so loading it makes no per-sprite allocations.
+
+Pack layout, all values little-endian:
+    header      magic, version, sprite size, sheet size in sprites, baked shadow settings, palette and sprite counts,
+                followed by the offsets of the index, palettes, sheet and atlas sections
+    index       per sprite: name length (u8), name, column (u8), row (u8)
+    palettes    per palette: colour shift (3 x i16), then one 0xRRGGBB colour (u32) per sheet palette entry
+    sheet       one byte per pixel, the indexed pixels of the sprite sheet
+    atlas       one byte per pixel, the sprite sheet with the shadow baked in, shadow colour index = palette size,
+                plus one extra row of blank cells for tilemaps"""
+
+PACK_MAGIC = b"CCPK"
+PACK_VERSION = 2
+HEADER_FORMAT = "<4sBBBBBBHBBBIIII"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+PALETTE_SHIFT_FORMAT = "<hhh"
+PALETTE_SHIFT_SIZE = calcsize(PALETTE_SHIFT_FORMAT)
+
+
+class AssetPack:
+    def __init__(self, path, use_mmap=False):
+        self.path = path
+        self._file = None
+        self._mmap = None
+
+        if use_mmap:
+            self.data = self.map_file(path)
+        else:
+            self.data = self.read_file(path)
+
+        (magic, version, self.sprite_width, self.sprite_height, self.columns, self.rows, self.shadow_strength,
+         self.shadow_angle, self.palette_size, self.palette_count, self.sprite_count, self.index_offset,
+         self.palettes_offset, self.sheet_offset, self.atlas_offset) = unpack_from(HEADER_FORMAT, self.data, 0)
+
+        if magic != PACK_MAGIC:
+            raise ValueError(f"'{path}' is not a sprite pack.")
+        if version != PACK_VERSION:
+            raise ValueError(f"Sprite pack '{path}' is version {version}, expected version {PACK_VERSION}.")
+
+        self.sheet_width = self.columns * self.sprite_width
+        self.sheet_height = self.rows * self.sprite_height
+        self.cell_width = self.sprite_width + self.shadow_strength
+        self.cell_height = self.sprite_height + self.shadow_strength
+        self.atlas_width = self.columns * self.cell_width
+        self.atlas_height = (self.rows + 1) * self.cell_height
+        self.palette_stride = PALETTE_SHIFT_SIZE + self.palette_size * 4
+
+    def read_file(self, path):
+        """
+        Read the whole pack into one preallocated buffer.
+        :param path:
+        :return:
+        """
+        buffer = bytearray(stat(path)[6])
+        with open(path, "rb") as pack_file:
+            pack_file.readinto(buffer)
+        return memoryview(buffer)
+
+    def map_file(self, path):
+        """
+        Memory map the pack, only available on a host with the mmap module.
+        :param path:
+        :return:
+        """
+        from mmap import mmap, ACCESS_READ
+
+        self._file = open(path, "rb")
+        self._mmap = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def close(self):
+        """
+        Release the pack buffer, and the mapping if the pack is memory mapped.
+        :return:
+        """
+        if hasattr(self.data, "release"):
+            self.data.release()
+        self.data = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def sprite_matrix(self):
+        """
+        Read the sprite index into a dictionary of sprite name to (column, row) in the sprite sheet.
+        :return:
+        """
+        matrix = {}
+        offset = self.index_offset
+        for _ in range(self.sprite_count):
+            name_length = self.data[offset]
+            name = str(bytes(self.data[offset + 1:offset + 1 + name_length]), "utf-8")
+            offset += 1 + name_length
+            matrix[name] = (self.data[offset], self.data[offset + 1])
+            offset += 2
+        return matrix
+
+    def palette_shifts(self):
+        """
+        Get the colour shifts of every palette in the pack, in pack order.
+        :return:
+        """
+        return [unpack_from(PALETTE_SHIFT_FORMAT, self.data, self.palettes_offset + i * self.palette_stride)
+                for i in range(self.palette_count)]
+
+    def palette_color(self, palette_index, color_index):
+        """
+        Get a single colour from a palette in the pack.
+        :param palette_index:
+        :param color_index:
+        :return:
+        """
+        offset = self.palettes_offset + palette_index * self.palette_stride + PALETTE_SHIFT_SIZE + color_index * 4
+        return unpack_from("<I", self.data, offset)[0]
+
+    def palette_bytes(self, palette_index):
+        """
+        Get the raw colours of a palette in the pack as a memoryview slice.
+        :param palette_index:
+        :return:
+        """
+        start = self.palettes_offset + palette_index * self.palette_stride + PALETTE_SHIFT_SIZE
+        return self.data[start:start + self.palette_size * 4]
+
+    def sheet_pixels(self):
+        """
+        Get the indexed pixels of the sprite sheet as a memoryview slice.
+        :return:
+        """
+        return self.data[self.sheet_offset:self.sheet_offset + self.sheet_width * self.sheet_height]
+
+    def atlas_pixels(self):
+        """
+        Get the indexed pixels of the shadow atlas as a memoryview slice.
+        :return:
+        """
+        return self.data[self.atlas_offset:self.atlas_offset + self.atlas_width * self.atlas_height]
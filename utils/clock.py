@@ -0,0 +1,75 @@
+from time import monotonic, sleep
+
+"""Clocks the game can be run on. The Application holds one and the components read the time from it, so a headless
+run can swap the real clock for a simulated one whose time only moves when it is told to. The menu and race loops
+tick the clock once per loop, which is how a simulated clock with a frame time set runs the game as fast as the
+computer can: every loop is a frame later, and every sleep returns straight away."""
+
+
+class RealClock:
+    """
+    Wall clock time, from time.monotonic.
+    """
+
+    def monotonic(self):
+        """
+        Get the current time in seconds.
+        :return:
+        """
+        return monotonic()
+
+    def sleep(self, seconds):
+        """
+        Wait for a number of seconds.
+        :param seconds:
+        :return:
+        """
+        sleep(seconds)
+
+    def tick(self):
+        """
+        Called once per main loop tick, real time moves on by itself.
+        :return:
+        """
+
+
+class SimulatedClock:
+    """
+    Time that only moves when advanced, sleeping returns straight away after moving the time on.
+    """
+
+    def __init__(self, start=0.0, frame_time=None):
+        self.now = start
+        self.frame_time = frame_time  # Seconds every main loop tick moves the time on by, None to only move it by hand
+
+    def monotonic(self):
+        """
+        Get the current time in seconds.
+        :return:
+        """
+        return self.now
+
+    def sleep(self, seconds):
+        """
+        Move the time on by a number of seconds, without waiting.
+        :param seconds:
+        :return:
+        """
+        self.advance(seconds)
+
+    def tick(self):
+        """
+        Called once per main loop tick, moves the time on by the frame time.
+        :return:
+        """
+        if self.frame_time:
+            self.now += self.frame_time
+
+    def advance(self, seconds):
+        """
+        Move the time on by a number of seconds.
+        :param seconds:
+        :return:
+        """
+        if seconds > 0:
+            self.now += seconds
@@ -0,0 +1,144 @@
+from struct import pack, unpack_from
+from time import monotonic_ns
+
+from hal import badger
+from utils.resource_manager import memory_policy
+
+"""Race input logs, for replaying a race exactly as it was played. A log is a small header, the race's random seed,
+difficulty and trolley, followed by one byte per simulation step holding the driving buttons (up, down, left, right,
+A and B, in the Controls.button_mask bit order) held during that step. Start and select aren't recorded, pausing is
+never simulated so it has no part in a replay.
+
+Frame boundaries aren't recorded either, as the race doesn't depend on them: obstacles spawn and are culled in the
+simulation steps, the driving buttons are debounced in simulated time and the race ends in the step it is won or
+lost in. A log recorded on the device replays the same race on the host at any frame time.
+
+The InputRecorder works anywhere the log file can be written, the InputPlayer feeds a log back through the host
+backend's buttons, to be run on a SimulatedClock with a frame time, and keeps the wall time and garbage
+collection time of every frame."""
+
+MAGIC = b'TRR1'
+DRIVING_BUTTONS = 0x3F  # up, down, left, right, a and b
+
+
+def pack_name(name):
+    """
+    Pack a short name as a length byte and its characters.
+    :param name:
+    :return:
+    """
+    encoded = name.encode()
+    return bytes((len(encoded),)) + encoded
+
+
+def unpack_name(data, offset):
+    """
+    Unpack a name packed by pack_name.
+    :param data:
+    :param offset:
+    :return: tuple of (name, offset after it)
+    """
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode(), offset + 1 + length
+
+
+class InputRecorder:
+    """
+    Writes the driving buttons of every simulation step of a race to a log file.
+    """
+
+    def __init__(self, path, buffer_size=512):
+        self.path = path
+        self.buffer = bytearray(buffer_size)  # Allocated once, the steps not written yet are the first buffered
+        self.buffered = 0
+        self.log_file = None
+        self.steps = 0
+
+    def start(self, seed, difficulty, trolley):
+        """
+        Start a new log, called by the race once its seed is known.
+        :param seed:
+        :param difficulty:
+        :param trolley:
+        :return:
+        """
+        self.close()
+        self.log_file = open(self.path, 'wb')
+        self.log_file.write(MAGIC + pack('<I', seed) + pack_name(difficulty) + pack_name(trolley))
+        self.steps = 0
+
+    def record(self, mask):
+        """
+        Record the buttons of a simulation step.
+        :param mask:
+        :return:
+        """
+        self.buffer[self.buffered] = mask & DRIVING_BUTTONS
+        self.buffered += 1
+        self.steps += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered steps to the log.
+        :return:
+        """
+        if self.log_file and self.buffered:
+            self.log_file.write(memoryview(self.buffer)[:self.buffered])
+        self.buffered = 0
+
+    def close(self):
+        """
+        Finish the log.
+        :return:
+        """
+        if self.log_file:
+            self.flush()
+            self.log_file.close()
+            self.log_file = None
+
+
+class InputPlayer:
+    """
+    Plays a log back on the host backend, one button mask per simulation step. Once the log runs out the buttons are
+    let go and the run is asked to exit.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as log_file:
+            data = log_file.read()
+        if data[:4] != MAGIC:
+            raise ValueError(f"{path} isn't a race input log.")
+        self.seed = unpack_from('<I', data, 4)[0]
+        self.difficulty, offset = unpack_name(data, 8)
+        self.trolley, offset = unpack_name(data, offset)
+        self.masks = data[offset:]
+        self.step = 0
+        self.frame_times = []  # Wall time of every frame in nanoseconds
+        self.gc_times = []  # Milliseconds of every frame spent collecting garbage
+        self.last_frame_ns = None
+
+    def next_frame(self):
+        """
+        Called at the start of every race frame, times the last frame.
+        :return:
+        """
+        now = monotonic_ns()
+        if self.last_frame_ns is not None:
+            self.frame_times.append(now - self.last_frame_ns)
+            self.gc_times.append(memory_policy.last_frame_gc_ms)
+        self.last_frame_ns = now
+
+    def next_step(self):
+        """
+        Called at the start of every simulation step, holds the buttons recorded for it.
+        :return:
+        """
+        if self.step < len(self.masks):
+            badger.button.mask = self.masks[self.step]
+            self.step += 1
+        else:
+            badger.button.mask = 0
+            badger.request_exit()
+
@@ -1,13 +1,277 @@
-from gc import collect
+from array import array
 
-"""This module provides utility functions for managing resources in the system. The memory on the PyBadge can be 
-affected easily by fragmentation; it seems that once you go below around 7KB of free memory, the system becomes 
-unstable. We want to keep the free RAM above this point therefore to keep the system stable."""
+from hal import collect, largest_free_block, mem_free
+from utils.clock import RealClock
+
+"""This module provides utility functions for managing resources in the system. The memory on the PyBadge can be
+affected easily by fragmentation; it seems that once you go below around 7KB of free memory, the system becomes
+unstable. We want to keep the free RAM above this point therefore to keep the system stable.
+
+A full collection takes milliseconds, so rather than collecting every time it is called, cleanup() is a hint to the
+memory policy: it only collects once the free heap has dropped below the watermark, after asking the caches that
+registered a low memory handler to drop what they can rebuild. Loops with a frame budget offer the policy the time
+left over in the frame before they refresh the display, since the refresh waits out the rest of the frame, and the
+policy collects in it when the heap is getting low, before a hint would have to collect in the middle of a frame.
+Collections are timed in float seconds from the clock, not monotonic_ns, whose large ints would allocate on the heap
+of the policy that is trying to keep it free.
+
+Heap telemetry records the free heap, the largest free block where the platform reports it and the collection count
+at points of each phase of the game, tagged with the menu or race difficulty, in a ring buffer of the most recent
+records. The lowest free heap seen is kept for every phase and tag, so it can be checked at runtime which menu or
+difficulty gets closest to running out. Hot loops record with the phase id and a tag id looked up once beforehand, so
+a record makes no allocations."""
+
+PHASES = ('menu_build', 'menu_switch', 'race_spawn', 'race_frame')
+PHASE_MENU_BUILD, PHASE_MENU_SWITCH, PHASE_RACE_SPAWN, PHASE_RACE_FRAME = range(len(PHASES))  # Indexes into PHASES
+
+
+class MemoryPolicy:
+    """
+    Decides when to collect garbage, and keeps count of the time spent collecting.
+    """
+
+    def __init__(self, watermark=12288, idle_watermark=32768, clock=None):
+        self.watermark = watermark  # Free heap below which a cleanup hint collects
+        self.idle_watermark = idle_watermark  # Free heap below which spare frame time is used to collect
+        self.hints = 0
+        self.collections = 0
+        self.idle_collections = 0
+        self.average_collect_ms = 2.0  # Running average of how long a collection takes, for fitting one in a frame
+        self.total_gc_ms = 0.0
+        self.frame_gc_ms = 0.0  # Time spent collecting in the current frame
+        self.last_frame_gc_ms = 0.0  # Time spent collecting in the last whole frame
+        self.frames = 0
+        self.clock = clock or RealClock()  # Always real time, collections take just as long in a simulated run
+        self.frame_start_time = self.clock.monotonic()
+        self.low_memory_handlers = []  # Called before a hint collects, to drop cached data that can be rebuilt
+
+    def add_low_memory_handler(self, handler):
+        """
+        Register a function to call before collecting because the heap is below the watermark.
+        :param handler:
+        :return:
+        """
+        self.low_memory_handlers.append(handler)
+
+    def remove_low_memory_handler(self, handler):
+        """
+        Stop calling a low memory handler, pass the same object that was registered.
+        :param handler:
+        :return:
+        """
+        if handler in self.low_memory_handlers:
+            self.low_memory_handlers.remove(handler)
+
+    def collect(self):
+        """
+        Run a full collection and time it.
+        :return:
+        """
+        start_time = self.clock.monotonic()
+        collect()
+        collect_ms = (self.clock.monotonic() - start_time) * 1000
+        self.collections += 1
+        self.average_collect_ms += (collect_ms - self.average_collect_ms) * 0.2
+        self.total_gc_ms += collect_ms
+        self.frame_gc_ms += collect_ms
+
+    def hint(self):
+        """
+        A good point to collect, collect if the free heap is below the watermark, once the low memory handlers have
+        dropped what they can.
+        :return:
+        """
+        self.hints += 1
+        if mem_free() < self.watermark:
+            for handler in self.low_memory_handlers:
+                handler()
+            self.collect()
+
+    def idle_collect(self, budget=1 / 60):
+        """
+        Called once the work of a frame is done, before the display refresh that waits out the rest of the frame. If
+        there is time left in the budget and the free heap is below the idle watermark, collect now while it doesn't
+        cost a frame.
+        :param budget: seconds a frame may take
+        :return: True if it collected
+        """
+        spare_ms = (budget - (self.clock.monotonic() - self.frame_start_time)) * 1000
+        if spare_ms > self.average_collect_ms and mem_free() < self.idle_watermark:
+            self.idle_collections += 1
+            self.collect()
+            return True
+        return False
+
+    def frame(self):
+        """
+        End a frame of a loop with a frame budget, the next frame starts now.
+        :return: milliseconds spent collecting in the frame
+        """
+        self.last_frame_gc_ms = self.frame_gc_ms
+        self.frame_gc_ms = 0.0
+        self.frames += 1
+        self.frame_start_time = self.clock.monotonic()
+        return self.last_frame_gc_ms
+
+    def stats(self):
+        """
+        Get the policy counters.
+        :return:
+        """
+        return {
+            'hints': self.hints,
+            'collections': self.collections,
+            'idle_collections': self.idle_collections,
+            'average_collect_ms': self.average_collect_ms,
+            'total_gc_ms': self.total_gc_ms,
+            'last_frame_gc_ms': self.last_frame_gc_ms,
+            'frames': self.frames,
+        }
+
+
+class HeapTelemetry:
+    """
+    A fixed size ring buffer of heap records, and the low-water marks of the free heap.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.phases = array('B', [0] * size)
+        self.tags = array('B', [0] * size)
+        self.free = array('l', [0] * size)
+        self.largest_block = array('l', [0] * size)  # -1 where the platform doesn't report it
+        self.collections = array('l', [0] * size)
+        self.next_record = 0
+        self.count = 0
+        self.tag_names = []  # Tag ids are indexes into this list
+        # phase id << 8 | tag id to the lowest free heap recorded, a small int key allocates nothing
+        self.low_water = {}
+
+    def tag_id(self, tag):
+        """
+        Get the id of a tag, adding it to the known tags if it is new.
+        :param tag: menu name or race difficulty
+        :return:
+        """
+        if tag not in self.tag_names:
+            self.tag_names.append(tag)
+        return self.tag_names.index(tag)
+
+    def record(self, phase, tag=''):
+        """
+        Record the heap now, and update the low-water mark of the phase and tag.
+        :param phase: one of PHASES
+        :param tag: menu name or race difficulty
+        :return: the free heap
+        """
+        return self.record_ids(PHASES.index(phase), self.tag_id(tag))
+
+    def record_ids(self, phase_id, tag_id):
+        """
+        Record the heap now by phase and tag id, without looking either of them up.
+        :param phase_id: one of the PHASE_ constants
+        :param tag_id: from tag_id
+        :return: the free heap
+        """
+        free = mem_free()
+        largest_block = largest_free_block()
+
+        i = self.next_record
+        self.phases[i] = phase_id
+        self.tags[i] = tag_id
+        self.free[i] = free
+        self.largest_block[i] = -1 if largest_block is None else largest_block
+        self.collections[i] = memory_policy.collections
+        self.next_record = (i + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+        key = phase_id << 8 | tag_id
+        if free < self.low_water.get(key, free + 1):
+            self.low_water[key] = free
+        return free
+
+    def records(self):
+        """
+        Get the records in the ring buffer, oldest first.
+        :return: list of (phase, tag, free heap, largest free block or None, collections)
+        """
+        records = []
+        for n in range(self.count):
+            i = (self.next_record - self.count + n) % self.size
+            records.append((PHASES[self.phases[i]], self.tag_names[self.tags[i]], self.free[i],
+                            None if self.largest_block[i] < 0 else self.largest_block[i], self.collections[i]))
+        return records
+
+    def lowest(self, phase=None, tag=None):
+        """
+        Get the lowest free heap recorded, for a phase and/or tag or overall.
+        :param phase:
+        :param tag:
+        :return: the free heap, or None if nothing matching has been recorded
+        """
+        marks = [free for mark_phase, mark_tag, free in self.low_water_marks()
+                 if (phase is None or mark_phase == phase) and (tag is None or mark_tag == tag)]
+        return min(marks) if marks else None
+
+    def low_water_marks(self):
+        """
+        Get the low-water marks, lowest first.
+        :return: list of (phase, tag, lowest free heap)
+        """
+        return sorted(((PHASES[key >> 8], self.tag_names[key & 0xFF], free) for key, free in self.low_water.items()),
+                      key=lambda mark: mark[2])
+
+    def reset_low_water(self):
+        """
+        Forget the low-water marks.
+        :return:
+        """
+        self.low_water.clear()
+
+
+memory_policy = MemoryPolicy()
+heap_telemetry = HeapTelemetry()
 
 
 def cleanup():
     """
-    Perform garbage collection.
+    Hint that this is a good point to collect garbage, see MemoryPolicy.hint.
+    :return:
+    """
+    memory_policy.hint()
+
+
+def collect_now():
+    """
+    Perform garbage collection straight away, for when the free heap has to be measured right after freeing memory.
+    :return:
+    """
+    memory_policy.collect()
+
+
+def free_memory():
+    """
+    Get the number of bytes of free heap.
+    :return:
+    """
+    return mem_free()
+
+
+def record_heap(phase, tag=''):
+    """
+    Record the heap in the telemetry, see HeapTelemetry.record.
+    :param phase:
+    :param tag:
+    :return: the free heap
+    """
+    return heap_telemetry.record(phase, tag)
+
+
+def show_free_memory():
+    """
+    Print the free heap and the lowest free heap recorded for every phase and tag.
     :return:
     """
-    collect()
+    print(f"Free memory: {mem_free()} bytes, {memory_policy.collections} collections")
+    for phase, tag, free in heap_telemetry.low_water_marks():
+        print(f"  lowest {free} bytes in {phase} {tag}")
@@ -0,0 +1,162 @@
+from time import monotonic
+
+"""Deterministic random numbers for the race. A RandomService holds one xorshift32 stream per part of the game
+(track, ai, pickups), all derived from a single per-race seed, so a race started with the same seed plays out the
+same way on every build, and drawing more numbers in one stream never shifts the others.
+
+MicroPython keeps integers up to 30 bits in the object itself and allocates anything bigger on the heap, so the 32 bit
+state is held as two 16 bit halves and every draw stays within 30 bits, drawing never allocates."""
+
+MASK_32 = 0xFFFFFFFF
+MASK_16 = 0xFFFF
+
+
+def name_hash(name):
+    """
+    FNV-1a hash of a stream name, stable between runs unlike hash().
+    :param name:
+    :return:
+    """
+    value = 0x811C9DC5
+    for byte in name.encode():
+        value = ((value ^ byte) * 0x01000193) & MASK_32
+    return value
+
+
+def build_alias_table(weights):
+    """
+    Build a Walker/Vose alias table for picking an index in constant time, weighted by the given weights.
+    :param weights:
+    :return: tuple of (probability, alias), pick a random column, keep it with its probability or take its alias
+    """
+    count = len(weights)
+    total = sum(weights)
+    scaled = [weight * count / total for weight in weights]
+    probability = [1.0] * count
+    alias = bytearray(range(count))
+    small = [i for i in range(count) if scaled[i] < 1]
+    large = [i for i in range(count) if scaled[i] >= 1]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        probability[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= 1 - scaled[less]
+        if scaled[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+    return probability, alias
+
+
+class RandomStream:
+    """
+    A xorshift32 generator with the few helpers the game needs, its state split into a high and a low 16 bit half.
+    """
+
+    def __init__(self, seed):
+        self.high = (seed >> 16) & MASK_16
+        self.low = seed & MASK_16
+        if not self.high and not self.low:  # xorshift gets stuck on 0
+            self.high = 0x9E37
+            self.low = 0x79B9
+        for _ in range(8):  # Spread the seed's bits, nearby seeds start out correlated
+            self.next()
+
+    def next(self):
+        """
+        Advance the stream, the shifts of xorshift32 are carried between the halves.
+        :return: the next value, the top 30 bits of the state
+        """
+        high = self.high
+        low = self.low
+        # x ^= x << 13
+        high ^= ((high << 13) | (low >> 3)) & MASK_16
+        low ^= (low << 13) & MASK_16
+        # x ^= x >> 17
+        low ^= high >> 1
+        # x ^= x << 5
+        high ^= ((high << 5) | (low >> 11)) & MASK_16
+        low ^= (low << 5) & MASK_16
+        self.high = high
+        self.low = low
+        return (high << 14) | (low >> 2)
+
+    def below(self, n):
+        """
+        Get a random integer from 0 up to but not including n. Up to 2 ** 15 it scales 15 random bits by n, so the
+        product stays within 30 bits, above that it takes the next value modulo n, which is biased by under n / 2 ** 30.
+        :param n:
+        :return:
+        """
+        if n <= 0x8000:
+            self.next()
+            return ((self.high >> 1) * n) >> 15
+        return self.next() % n
+
+    def randint(self, low, high):
+        """
+        Get a random integer from low to high, both included.
+        :param low:
+        :param high:
+        :return:
+        """
+        return low + self.below(high - low + 1)
+
+    def random(self):
+        """
+        Get a random float from 0 up to but not including 1.
+        :return:
+        """
+        return self.next() / 1073741824
+
+    def uniform(self, low, high):
+        """
+        Get a random float between low and high.
+        :param low:
+        :param high:
+        :return:
+        """
+        return low + (high - low) * self.random()
+
+    def choice(self, sequence):
+        """
+        Pick a random item of a sequence.
+        :param sequence:
+        :return:
+        """
+        return sequence[self.below(len(sequence))]
+
+    def weighted(self, table):
+        """
+        Pick a random index from an alias table made by build_alias_table.
+        :param table:
+        :return:
+        """
+        probability, alias = table
+        column = self.below(len(alias))
+        if self.random() < probability[column]:
+            return column
+        return alias[column]
+
+
+class RandomService:
+    """
+    The named random streams of a race, seeded from one seed.
+    """
+
+    def __init__(self, seed=None):
+        self.seed = int(monotonic() * 1000) & 0x3FFFFFFF if seed is None else seed
+        self.streams = {}
+
+    def stream(self, name):
+        """
+        Get a named stream, created the first time it is asked for.
+        :param name:
+        :return:
+        """
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = RandomStream(self.seed ^ name_hash(name))
+            self.streams[name] = stream
+        return stream